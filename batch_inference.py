@@ -0,0 +1,266 @@
+import json
+import os
+import threading
+import time
+import uuid
+import llm
+import llm_cache
+import local_classifier
+import profiles
+import telemetry
+import triage
+
+# ============================================
+# Offline Bulk Triage via Batch Inference
+# ============================================
+
+BATCH_DIR = "batches"
+DONE_STATES = {
+    'JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED',
+    'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED'
+}
+
+def build_requests(emails: dict, **prompt_kwargs) -> list:
+    """One combined classify+draft request per message, keyed by message id"""
+    _, config = profiles.get_profile('triage').apply(triage.MODEL, triage.triage_config())
+    generation_config = config.model_dump(mode='json', exclude_none=True)
+    requests = []
+    for message_id, email_data in emails.items():
+        instruction, prompt = triage.triage_request(email_data, **prompt_kwargs)
+        requests.append({
+            'key': str(message_id),
+            'request': {
+                'system_instruction': {'parts': [{'text': instruction}]},
+                'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+                'generation_config': generation_config
+            }
+        })
+    return requests
+
+def write_batch_file(requests: list, path: str) -> str:
+    """Write requests as JSONL, the input format of the batch API"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for request in requests:
+            f.write(json.dumps(request) + '\n')
+    return path
+
+def response_text(response: dict):
+    """Concatenate the text parts of a GenerateContentResponse JSON object"""
+    try:
+        parts = response['candidates'][0]['content']['parts']
+    except (KeyError, IndexError, TypeError):
+        return None
+    return ''.join(part.get('text', '') for part in parts) or None
+
+def request_instruction(request: dict):
+    """System instruction text of a batch request line, or None"""
+    parts = (request.get('system_instruction') or {}).get('parts', [])
+    return ''.join(part.get('text', '') for part in parts) or None
+
+def request_prompt(request: dict) -> str:
+    """Prompt text of a batch request line (without the system instruction)"""
+    return ''.join(
+        part.get('text', '')
+        for content in request['contents']
+        for part in content.get('parts', [])
+    )
+
+# ============================================
+# Backends
+# ============================================
+
+class GeminiBatchBackend:
+    """Gemini Batch API: upload the JSONL file, create one job, download results"""
+
+    def __init__(self, client, model: str = triage.MODEL):
+        self.client = client
+        self.model = model
+
+    def submit(self, input_path: str) -> str:
+        from google.genai import types
+        uploaded = self.client.files.upload(
+            file=input_path,
+            config=types.UploadFileConfig(
+                display_name=os.path.basename(input_path),
+                mime_type='jsonl'
+            )
+        )
+        job = self.client.batches.create(
+            model=self.model,
+            src=uploaded.name,
+            config=types.CreateBatchJobConfig(display_name=os.path.basename(input_path))
+        )
+        return job.name
+
+    def state(self, job_name: str) -> str:
+        return self.client.batches.get(name=job_name).state.name
+
+    def results(self, job_name: str):
+        job = self.client.batches.get(name=job_name)
+        if not job.dest or not job.dest.file_name:
+            return
+        content = self.client.files.download(file=job.dest.file_name)
+        for line in content.decode('utf-8').splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+def keyword_responder(request: dict) -> str:
+    """Offline stand-in for the model: keyword rules that return triage JSON"""
+    body = request_prompt(request).lower()
+
+    if any(word in body for word in ('unsubscribe', 'winner', 'limited offer', 'click here')):
+        category, priority, needs_reply = 'spam', 'low', 'no'
+    elif any(word in body for word in ('urgent', 'asap', 'immediately', 'down', 'failing')):
+        category, priority, needs_reply = 'urgent', 'high', 'yes'
+    elif any(word in body for word in ('help', 'issue', 'problem', 'error', 'feature')):
+        category, priority, needs_reply = 'customer_support', 'medium', 'yes'
+    else:
+        category, priority, needs_reply = 'general_inquiry', 'medium', 'yes'
+
+    return json.dumps({
+        'category': category,
+        'priority': priority,
+        'sentiment': 'negative' if category == 'urgent' else 'neutral',
+        'needs_reply': needs_reply,
+        'reason': 'local keyword rules',
+        'draft': '' if needs_reply == 'no' else
+                 'Hello,\n\nThank you for your email. We have received it and will follow up shortly.\n\nBest regards'
+    })
+
+class LocalBatchBackend:
+    """Runs a batch file in a background thread with no network access.
+
+    `responder` maps one request dict to the model's text answer; it
+    defaults to keyword_responder so batch mode is testable offline.
+    """
+
+    def __init__(self, responder=keyword_responder, output_dir: str = BATCH_DIR):
+        self.responder = responder
+        self.output_dir = output_dir
+        self._jobs = {}
+
+    def submit(self, input_path: str) -> str:
+        job_name = f"local-{uuid.uuid4().hex[:12]}"
+        output_path = os.path.join(self.output_dir, f"{job_name}_output.jsonl")
+        self._jobs[job_name] = {'state': 'JOB_STATE_RUNNING', 'output': output_path}
+        threading.Thread(target=self._run, args=(job_name, input_path, output_path), daemon=True).start()
+        return job_name
+
+    def _run(self, job_name: str, input_path: str, output_path: str):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(input_path, encoding='utf-8') as src, open(output_path, 'w', encoding='utf-8') as dst:
+            for line in src:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                try:
+                    text = self.responder(item['request'])
+                    out = {'key': item['key'], 'response': {
+                        'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}}]
+                    }}
+                except Exception as e:
+                    out = {'key': item['key'], 'error': {'message': str(e)}}
+                dst.write(json.dumps(out) + '\n')
+        self._jobs[job_name]['state'] = 'JOB_STATE_SUCCEEDED'
+
+    def state(self, job_name: str) -> str:
+        return self._jobs[job_name]['state']
+
+    def results(self, job_name: str):
+        with open(self._jobs[job_name]['output'], encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def get_backend(name: str, client=None):
+    """Pick a backend by name ('gemini' or 'local')"""
+    if name == 'local':
+        return LocalBatchBackend()
+    return GeminiBatchBackend(client)
+
+# ============================================
+# Submit, Poll, Join
+# ============================================
+
+@telemetry.traced('llm.batch')
+def run_batch(backend, emails: dict, poll_interval: float = 30, **prompt_kwargs) -> dict:
+    """Triage every message in one batch job.
+
+    Returns {message_id: (classification, draft)}; ids whose request failed
+    or whose answer could not be parsed map to None. Parsed answers are also
+    written to the LLM cache so a later online run of the same prompt is a hit.
+    """
+    if not emails:
+        return {}
+
+    # Messages settled by header rules need no request at all
+    settled = {str(message_id): (email_data['rule_classification'], None)
+               for message_id, email_data in emails.items() if email_data.get('rule_classification')}
+    emails = {message_id: email_data for message_id, email_data in emails.items()
+              if str(message_id) not in settled}
+    if settled:
+        print(f"   🏷️  {len(settled)} message(s) settled by header rules")
+
+    # Confident local no-reply predictions need no request either, scored in one pass
+    classifier = local_classifier.get_classifier()
+    if classifier is not None and emails:
+        predictions = classifier.predict_batch(list(emails.values()))
+        local = {}
+        for message_id, classification in zip(list(emails), predictions):
+            if classification is None:
+                continue
+            if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
+                classifier.stats['local'] += 1
+                local[str(message_id)] = (classification, None)
+        settled.update(local)
+        emails = {message_id: email_data for message_id, email_data in emails.items()
+                  if str(message_id) not in local}
+        if local:
+            print(f"   🧠 {len(local)} message(s) settled by the local classifier")
+
+    if not emails:
+        return settled
+
+    requests = build_requests(emails, **prompt_kwargs)
+    stamp = time.strftime("%Y%m%d_%H%M%S")
+    input_path = write_batch_file(requests, os.path.join(BATCH_DIR, f"{stamp}_input.jsonl"))
+    print(f"   📝 Wrote {len(requests)} request(s) to {input_path}")
+
+    job_name = backend.submit(input_path)
+    print(f"   🚀 Submitted batch job: {job_name}")
+
+    started = time.time()
+    state = backend.state(job_name)
+    while state not in DONE_STATES:
+        time.sleep(poll_interval)
+        state = backend.state(job_name)
+        print(f"   ⏳ {state} ({time.time() - started:.0f}s)")
+
+    if state not in ('JOB_STATE_SUCCEEDED', 'JOB_STATE_PARTIALLY_SUCCEEDED'):
+        print(f"   ❌ Batch job ended in state {state}")
+        return dict(settled, **{str(message_id): None for message_id in emails})
+
+    prompts = {item['key']: request_prompt(item['request']) for item in requests}
+    instructions = {item['key']: request_instruction(item['request']) for item in requests}
+    by_key = {str(message_id): email_data for message_id, email_data in emails.items()}
+    cache = llm_cache.get_cache()
+    # The key an interactive triage call of the same email would look up
+    model, config = profiles.get_profile('triage').apply(triage.MODEL, triage.triage_config())
+    results = {key: None for key in prompts}
+    results.update(settled)
+
+    for line in backend.results(job_name):
+        key = str(line.get('key'))
+        text = response_text(line.get('response') or {})
+        if key not in results or text is None:
+            continue
+        results[key] = triage.parse_triage(text)
+        if results[key] is not None:
+            triage.remember_classification(by_key[key], results[key][0])
+            if cache:
+                cache.put(llm.cache_key(model, prompts[key], config, instructions[key]), text)
+
+    done = sum(1 for key in prompts if results[key] is not None)
+    print(f"   ✅ Batch finished: {done}/{len(prompts)} result(s) in {time.time() - started:.0f}s")
+    return results
@@ -0,0 +1,282 @@
+"""End-to-end benchmark: IMAP fetch, classify + draft and SMTP send against in-process fakes.
+
+Every case runs in its own process, in a scratch directory, against the
+fake IMAP server / SMTP sink in benchmarks/fakes.py and the stub Gemini
+model (GEMINI_TRANSPORT=stub), so nothing touches the network, the real
+mailbox or this checkout's caches. Results (messages/sec, p50/p95/p99
+per stage, peak RSS) are printed and saved as JSON.
+
+Run from the repo root:  python benchmarks/bench_pipeline.py [--sizes 10,1000,100000] [--cases fetch,gmail]
+Compare two runs:        python benchmarks/bench_pipeline.py --compare old.json new.json
+
+Cases:
+  fetch        GmailAgent.get_unread_emails(), every message iterated (whole mailbox)
+  gmail        gmail_agent.process_gmail() on the first --process-limit messages
+  email_agent  email_agent.process_all_emails() on --process-limit message files
+  send         emailpro.send_email() for --process-limit replies
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+CASES = ('fetch', 'gmail', 'email_agent', 'send')
+MAIN_STAGE = {'fetch': 'fetch', 'gmail': 'message', 'email_agent': 'message', 'send': 'send'}
+ADDRESS = "bench@bench.local"
+PASSWORD = "bench-password"
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# ============================================
+# Measurements
+# ============================================
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'count': len(ordered), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+
+def timed(fn, samples: list):
+    """fn wrapped to append each call's duration to samples"""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+    return wrapper
+
+# ============================================
+# Cases (run inside the child process)
+# ============================================
+
+def connect_gmail_agent_to(server):
+    """Point gmail_agent's IMAPClient at the fake server (plain TCP on localhost)"""
+    import gmail_agent
+    from imapclient import IMAPClient
+    gmail_agent.IMAPClient = lambda host, **kwargs: IMAPClient('127.0.0.1', port=server.port, use_uid=True, ssl=False)
+
+def case_fetch(mailbox, limit, stages, extra):
+    import fakes
+    import gmail_agent
+    server = fakes.FakeIMAPServer(mailbox).start()
+    connect_gmail_agent_to(server)
+    agent = gmail_agent.GmailAgent(ADDRESS, PASSWORD)
+    samples = stages.setdefault('fetch', [])
+    count = 0
+    try:
+        last = time.perf_counter()
+        for _ in agent.get_unread_emails(limit=None):
+            now = time.perf_counter()
+            samples.append(now - last)
+            last = now
+            count += 1
+    finally:
+        agent.close()
+    extra['imap'] = server.stats
+    return count
+
+def case_gmail(mailbox, limit, stages, extra):
+    import fakes
+    import gmail_agent
+    import triage
+    server = fakes.FakeIMAPServer(mailbox).start()
+    connect_gmail_agent_to(server)
+    samples = stages.setdefault('message', [])
+    triage.classify_and_draft = timed(triage.classify_and_draft, samples)
+    triage.classify_and_draft_stream = timed(triage.classify_and_draft_stream, samples)
+    gmail_agent.process_gmail(limit=limit)
+    extra['imap'] = server.stats
+    return len(samples)
+
+def case_email_agent(mailbox, limit, stages, extra):
+    os.makedirs(os.path.join("emails", "incoming"), exist_ok=True)
+    os.makedirs(os.path.join("emails", "processed"), exist_ok=True)
+    os.makedirs("responses", exist_ok=True)
+    for uid in range(1, limit + 1):
+        message = mailbox.message(uid)
+        headers = dict(message['headers'])
+        body = message['parts'][0]['payload'].decode('utf-8')
+        with open(os.path.join("emails", "incoming", f"bench_{uid:06d}.txt"), 'w', encoding='utf-8') as f:
+            f.write(f"From: {headers['From']}\nSubject: {headers['Subject']}\nDate: {headers['Date']}\n\n{body}")
+
+    import email_agent
+    samples = stages.setdefault('message', [])
+    email_agent.process_email = timed(email_agent.process_email, samples)
+    email_agent.process_all_emails()
+    return len(samples)
+
+def case_send(mailbox, limit, stages, extra):
+    import fakes
+    import smtp_pool
+    server = fakes.FakeSMTPServer().start()
+    smtp_pool.SMTP_SERVERS[fakes.DOMAIN] = ('127.0.0.1', server.port)
+    import emailpro  # a Streamlit script; runs in bare mode with no UI
+
+    samples = stages.setdefault('send', [])
+    failures = 0
+    for uid in range(1, limit + 1):
+        headers = dict(mailbox.message(uid)['headers'])
+        started = time.perf_counter()
+        success, _ = emailpro.send_email(headers['From'], headers['Subject'], "Thanks, we are on it.\n" * 8)
+        samples.append(time.perf_counter() - started)
+        failures += not success
+    extra['smtp'] = dict(server.stats, failures=failures)
+    return limit - failures
+
+def run_child(case: str, size: int, limit: int, seed: int, output: str):
+    import fakes
+    import profiles
+    import rate_limit
+    profiles.LATENCY_WINDOW = 10 ** 7  # keep every call for the percentiles
+
+    mailbox = fakes.SyntheticMailbox(size, seed=seed)
+    stages, extra = {}, {}
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    count = globals()[f"case_{case}"](mailbox, min(size, limit), stages, extra)
+    elapsed = time.perf_counter() - started
+
+    for stage, samples in profiles.latency.totals.items():
+        stages[f"llm_{stage}"] = list(samples)
+    extra['llm'] = rate_limit.metrics()
+    result = {
+        'case': case, 'size': size, 'messages': count, 'seconds': round(elapsed, 3),
+        'messages_per_sec': round(count / elapsed, 2) if elapsed else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1), 'baseline_rss_mb': round(baseline, 1),
+        'stages': {stage: percentiles(samples) for stage, samples in stages.items()},
+        'extra': extra
+    }
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+# ============================================
+# Runner
+# ============================================
+
+def child_env(args) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'PYTHON_DOTENV_DISABLED': '1',  # never pick up the real .env credentials
+        'EMAIL_ADDRESS': ADDRESS, 'EMAIL_PASSWORD': PASSWORD,
+        'GEMINI_TRANSPORT': 'stub', 'GEMINI_API_KEY': 'offline',
+        'GEMINI_STUB_LATENCY': str(args.llm_latency), 'GEMINI_STUB_PER_TOKEN': str(args.llm_per_token),
+        'GEMINI_STUB_ERROR_RATE': str(args.error_rate), 'GEMINI_STUB_RETRY_DELAY': '0',
+        'GEMINI_STUB_SEED': str(args.seed),
+        'PYTHONPATH': os.pathsep.join([REPO_DIR, BENCH_DIR, env.get('PYTHONPATH', '')]),
+    })
+    env.pop('GEMINI_BASE_URL', None)
+    return env
+
+def run_case(case: str, size: int, args) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"bench-{case}-") as scratch:
+        output = os.path.join(scratch, "result.json")
+        command = [sys.executable, os.path.abspath(__file__), '--child', case, str(size), output,
+                   '--process-limit', str(args.process_limit), '--seed', str(args.seed)]
+        # The agents' output (and Streamlit's bare-mode warnings) only with --verbose or on failure
+        completed = subprocess.run(command, cwd=scratch, env=child_env(args),
+                                   stdout=None if args.verbose else subprocess.DEVNULL,
+                                   stderr=None if args.verbose else subprocess.PIPE, text=True)
+        if completed.returncode != 0 or not os.path.exists(output):
+            if completed.stderr:
+                print(completed.stderr[-4000:], file=sys.stderr)
+            return {'case': case, 'size': size, 'error': f"exit code {completed.returncode}"}
+        with open(output, encoding='utf-8') as f:
+            return json.load(f)
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+def print_row(result: dict):
+    if 'error' in result:
+        print(f"{result['case']:<12} {result['size']:>7}   failed ({result['error']})")
+        return
+    main = result['stages'].get(MAIN_STAGE[result['case']], {})
+    ms = lambda key: f"{main[key] * 1000:>9.1f}" if key in main else f"{'-':>9}"
+    print(f"{result['case']:<12} {result['size']:>7} {result['messages']:>8} {result['messages_per_sec'] or 0:>10.1f}"
+          f" {ms('p50')} {ms('p95')} {ms('p99')} {result['peak_rss_mb']:>9.1f}")
+
+def compare(old_path: str, new_path: str):
+    with open(old_path, encoding='utf-8') as f:
+        old = {(r['case'], r['size']): r for r in json.load(f)['results'] if 'error' not in r}
+    with open(new_path, encoding='utf-8') as f:
+        new = {(r['case'], r['size']): r for r in json.load(f)['results'] if 'error' not in r}
+    print(f"{'case':<12} {'size':>7} {'msg/s old':>10} {'msg/s new':>10} {'speedup':>8} "
+          f"{'p95 old ms':>11} {'p95 new ms':>11} {'RSS old':>8} {'RSS new':>8}")
+    for key in sorted(old.keys() & new.keys()):
+        a, b = old[key], new[key]
+        stage = MAIN_STAGE[key[0]]
+        p95 = lambda r: r['stages'].get(stage, {}).get('p95', 0) * 1000
+        speedup = (b['messages_per_sec'] or 0) / a['messages_per_sec'] if a['messages_per_sec'] else 0
+        print(f"{key[0]:<12} {key[1]:>7} {a['messages_per_sec']:>10.1f} {b['messages_per_sec']:>10.1f} "
+              f"{speedup:>7.2f}x {p95(a):>11.1f} {p95(b):>11.1f} {a['peak_rss_mb']:>8.1f} {b['peak_rss_mb']:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,1000', help="mailbox sizes, comma separated (e.g. 10,1000,100000)")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"comma separated subset of {', '.join(CASES)}")
+    parser.add_argument('--process-limit', type=int, default=1000,
+                        help="messages classified / drafted / sent per case (fetch always reads the whole mailbox)")
+    parser.add_argument('--llm-latency', type=float, default=0.01, help="stub model seconds to first byte")
+    parser.add_argument('--llm-per-token', type=float, default=0.0, help="stub model seconds per output token")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of stub calls failing with 429/503")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="JSON results path (default benchmarks/results/pipeline_<time>.json)")
+    parser.add_argument('--verbose', action='store_true', help="show the agents' own output")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two saved runs and exit")
+    parser.add_argument('--child', nargs=3, metavar=('CASE', 'SIZE', 'OUTPUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        case, size, output = args.child
+        run_child(case, int(size), args.process_limit, args.seed, output)
+        return
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    cases = [c for c in args.cases.split(',') if c]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+
+    print(f"{'case':<12} {'size':>7} {'messages':>8} {'msg/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'peak MB':>9}")
+    results = []
+    for size in sizes:
+        for case in cases:
+            result = run_case(case, size, args)
+            results.append(result)
+            print_row(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'settings': {k: v for k, v in vars(args).items() if k not in ('child', 'compare', 'output', 'verbose')},
+            'results': results
+        }, f, indent=2)
+    print(f"\n💾 Saved {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Startup benchmark: cold import time of each entry point and Streamlit rerun latency.
+
+Imports run in a fresh interpreter per repeat (python -X importtime), so
+they measure what a cold CLI start or the first Streamlit page load pays.
+Reruns use streamlit.testing's AppTest, which executes the script the
+way a click does: modules stay imported, the script body runs again. The
+dashboard case seeds email_agent_ui with processed emails so the charts
+and the email list are rendered on every rerun.
+
+Like bench_pipeline, everything runs in a scratch directory with the stub
+Gemini transport and without the real .env.
+
+Run from the repo root:  python benchmarks/bench_startup.py [--repeat 5] [--reruns 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+from bench_pipeline import ADDRESS, PASSWORD, RESULTS_DIR, git_commit
+
+MODULES = ('gmail_agent', 'email_agent', 'worker', 'email_agent_simple', 'email_agent_ui', 'emailpro')
+APPS = {
+    'email_agent_simple': 'email_agent_simple.py',
+    'email_agent_ui': 'email_agent_ui.py',
+    'email_agent_ui (dashboard)': 'email_agent_ui.py',
+    'emailpro': 'emailpro.py',
+}
+TOP = 5
+
+# ============================================
+# Imports (one interpreter per measurement)
+# ============================================
+
+def bench_env() -> dict:
+    env = dict(os.environ)
+    env.update({
+        'PYTHON_DOTENV_DISABLED': '1',  # never pick up the real .env credentials
+        'EMAIL_ADDRESS': ADDRESS, 'EMAIL_PASSWORD': PASSWORD,
+        'GEMINI_TRANSPORT': 'stub', 'GEMINI_API_KEY': 'offline',
+        'PYTHONPATH': os.pathsep.join([REPO_DIR, BENCH_DIR, env.get('PYTHONPATH', '')]),
+    })
+    env.pop('GEMINI_BASE_URL', None)
+    env.pop('METRICS_PORT', None)
+    return env
+
+def import_once(module: str, scratch: str) -> dict:
+    """{'ms': cumulative import time, 'wall_ms': process wall time, 'slowest': [(module, ms)]}"""
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                               cwd=scratch, env=bench_env(), capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-2000:])
+    # "import time: self [us] | cumulative | imported package", children indented under parents
+    direct = []
+    total = 0
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        if name.strip() == module and depth == 0:
+            total = int(cumulative) / 1000
+        elif depth == 1:
+            direct.append((name.strip(), int(cumulative) / 1000))
+    direct.sort(key=lambda item: item[1], reverse=True)
+    return {'ms': total, 'wall_ms': wall * 1000, 'slowest': direct[:TOP]}
+
+def bench_import(module: str, repeat: int, scratch: str) -> dict:
+    runs = [import_once(module, scratch) for _ in range(repeat)]
+    best = min(runs, key=lambda run: run['ms'])
+    return {
+        'module': module,
+        'import_ms': round(statistics.median(run['ms'] for run in runs), 1),
+        'import_ms_min': round(best['ms'], 1),
+        'process_ms': round(statistics.median(run['wall_ms'] for run in runs), 1),
+        'slowest': [(name, round(ms, 1)) for name, ms in best['slowest']]
+    }
+
+# ============================================
+# Streamlit reruns (run inside the child process)
+# ============================================
+
+def processed_emails(count: int = 50) -> list:
+    categories = ['urgent', 'spam', 'customer_support', 'general_inquiry', 'internal']
+    now = datetime.now()
+    return [{
+        'from': f"customer{i}@example.com",
+        'subject': f"Order #{1000 + i} status",
+        'body': "Where is my order? It was due last week.\n" * 5,
+        'classification': {'category': categories[i % len(categories)], 'priority': ['high', 'medium', 'low'][i % 3],
+                           'sentiment': 'neutral', 'needs_reply': 'yes', 'reason': '', 'source': 'llm'},
+        'response': None if i % 4 == 0 else "Hello,\n\nThanks for reaching out.\n\nBest regards",
+        'timestamp': now - timedelta(minutes=i)
+    } for i in range(count)]
+
+def run_reruns(app: str, reruns: int, output: str):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(REPO_DIR, APPS[app]), default_timeout=120)
+    if app.endswith('(dashboard)'):
+        at.session_state['processed_emails'] = processed_emails()
+    started = time.perf_counter()
+    at.run()
+    first = time.perf_counter() - started
+    samples = []
+    for _ in range(reruns):
+        started = time.perf_counter()
+        at.run()
+        samples.append(time.perf_counter() - started)
+    if at.exception:
+        raise RuntimeError(str(at.exception[0].value))
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'app': app, 'first_run_ms': round(first * 1000, 1),
+                   'rerun_ms': round(statistics.median(samples) * 1000, 1),
+                   'rerun_ms_max': round(max(samples) * 1000, 1)}, f)
+
+def bench_rerun(app: str, reruns: int, scratch: str, verbose: bool) -> dict:
+    output = os.path.join(scratch, "rerun.json")
+    if os.path.exists(output):
+        os.remove(output)
+    completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', app, output,
+                                '--reruns', str(reruns)], cwd=scratch, env=bench_env(),
+                               stdout=None if verbose else subprocess.DEVNULL,
+                               stderr=None if verbose else subprocess.PIPE, text=True)
+    if completed.returncode != 0 or not os.path.exists(output):
+        if completed.stderr:
+            print(completed.stderr[-4000:], file=sys.stderr)
+        return {'app': app, 'error': f"exit code {completed.returncode}"}
+    with open(output, encoding='utf-8') as f:
+        return json.load(f)
+
+# ============================================
+# Runner
+# ============================================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', default=','.join(MODULES), help="entry modules to import, comma separated")
+    parser.add_argument('--apps', default=','.join(APPS), help="Streamlit apps to rerun, comma separated")
+    parser.add_argument('--repeat', type=int, default=5, help="cold imports per module (median reported)")
+    parser.add_argument('--reruns', type=int, default=20, help="reruns per app after the first run")
+    parser.add_argument('--output', help="JSON results path (default benchmarks/results/startup_<time>.json)")
+    parser.add_argument('--verbose', action='store_true', help="show the apps' own output")
+    parser.add_argument('--child', nargs=2, metavar=('APP', 'OUTPUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_reruns(args.child[0], args.reruns, args.child[1])
+        return
+
+    modules = [m for m in args.modules.split(',') if m]
+    apps = [a for a in args.apps.split(',') if a]
+    unknown = set(apps) - set(APPS)
+    if unknown:
+        parser.error(f"unknown app(s): {', '.join(sorted(unknown))}")
+
+    imports, reruns = [], []
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as scratch:
+        print(f"{'module':<28} {'import ms':>10} {'process ms':>11}   slowest direct imports (ms)")
+        for module in modules:
+            result = bench_import(module, args.repeat, scratch)
+            imports.append(result)
+            slowest = ", ".join(f"{name} {ms:.0f}" for name, ms in result['slowest'])
+            print(f"{module:<28} {result['import_ms']:>10.1f} {result['process_ms']:>11.1f}   {slowest}")
+
+        try:
+            import streamlit.testing.v1  # noqa: F401
+        except ImportError:
+            apps = []
+            print("\nstreamlit is not installed; skipping reruns")
+        if apps:
+            print(f"\n{'app':<28} {'first run ms':>12} {'rerun ms':>9} {'max ms':>8}")
+        for app in apps:
+            result = bench_rerun(app, args.reruns, scratch, args.verbose)
+            reruns.append(result)
+            if 'error' in result:
+                print(f"{app:<28}   failed ({result['error']})")
+            else:
+                print(f"{app:<28} {result['first_run_ms']:>12.1f} {result['rerun_ms']:>9.1f} "
+                      f"{result['rerun_ms_max']:>8.1f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"startup_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'settings': {'repeat': args.repeat, 'reruns': args.reruns},
+            'imports': imports, 'reruns': reruns
+        }, f, indent=2)
+    print(f"\n💾 Saved {output}")
+
+if __name__ == '__main__':
+    main()
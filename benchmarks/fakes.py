@@ -0,0 +1,378 @@
+"""In-process fake IMAP server, SMTP sink and synthetic mailboxes for the benchmarks.
+
+The IMAP server speaks enough IMAP4rev1 over a real socket for IMAPClient
+(LOGIN, SELECT, UID SEARCH, UID FETCH of BODYSTRUCTURE / header fields /
+partial sections, LOGOUT), so protocol parsing is part of what gets
+measured. Messages are generated from their UID on demand, so a 100k
+mailbox costs no memory. The SMTP sink accepts STARTTLS (self-signed
+certificate) and AUTH, and counts what it receives.
+"""
+import base64
+import os
+import random
+import re
+import socketserver
+import ssl
+import tempfile
+import threading
+
+# ============================================
+# Synthetic Mailbox
+# ============================================
+
+DOMAIN = "bench.local"
+NAMES = ['john', 'maria', 'wei', 'aisha', 'lars', 'priya', 'tom', 'sofia', 'kenji', 'olu']
+PRODUCTS = ['dashboard', 'invoice', 'API key', 'mobile app', 'export', 'subscription', 'login', 'report']
+TEMPLATES = {
+    'urgent': ("URGENT: {product} is down",
+               "Our {product} has been failing since {hour}:00 and customers cannot work. "
+               "We need this fixed immediately, please call me asap. Order #{order}."),
+    'customer_support': ("Problem with my {product}",
+                         "Hi, I have an issue with the {product}: it shows an error when I open it. "
+                         "I tried again this morning and the problem is still there. Can you help? Order #{order}."),
+    'spam': ("You are a WINNER! Claim your {product}",
+             "Congratulations! Click here to claim your free {product}. Limited offer, act now. "
+             "Unsubscribe at any time."),
+    'general_inquiry': ("Question about {product} pricing",
+                        "Hello, we are evaluating your {product} for a team of {seats} people. "
+                        "Could you send details about pricing and onboarding?"),
+    'internal': ("Notes from the {product} sync",
+                 "Team, attached are the notes from today's {product} meeting. "
+                 "Please review the action items before Friday."),
+}
+WEIGHTS = {'urgent': 1, 'customer_support': 4, 'spam': 2, 'general_inquiry': 3, 'internal': 1}
+REPLY_RATE = 0.15       # messages answering one of the previous few
+ATTACHMENT_RATE = 0.2   # messages carrying a binary attachment
+HTML_RATE = 0.1         # HTML-only messages
+BULK_RATE = 0.3         # spam carrying List-Unsubscribe (settled by header rules)
+ATTACHMENT_BYTES = 48 * 1024
+
+_attachment_payload = None
+
+def _attachment() -> bytes:
+    """One base64 attachment body shared by every message (the server never re-encodes it)"""
+    global _attachment_payload
+    if _attachment_payload is None:
+        data = random.Random(0).randbytes(ATTACHMENT_BYTES)
+        _attachment_payload = base64.encodebytes(data).replace(b'\n', b'\r\n')
+    return _attachment_payload
+
+class SyntheticMailbox:
+    """`size` unread messages, each a pure function of (seed, uid)"""
+
+    def __init__(self, size: int, seed: int = 42):
+        self.size = size
+        self.seed = seed
+        categories = list(WEIGHTS)
+        self._categories = [c for c in categories for _ in range(WEIGHTS[c])]
+
+    def message_id(self, uid: int) -> str:
+        return f"<{uid}.{self.seed}@{DOMAIN}>"
+
+    def message(self, uid: int) -> dict:
+        """{'headers': [(name, value)], 'parts': [{...}], 'category'}"""
+        rng = random.Random(self.seed * 1_000_003 + uid)
+        category = rng.choice(self._categories)
+        subject, body = TEMPLATES[category]
+        fields = {'product': rng.choice(PRODUCTS), 'hour': rng.randint(0, 23),
+                  'order': rng.randint(10_000, 99_999), 'seats': rng.randint(2, 500)}
+        name = rng.choice(NAMES)
+        headers = [
+            ('From', f"{name.title()} <{name}{rng.randint(1, 999)}@customer.example>"),
+            ('To', f"support@{DOMAIN}"),
+            ('Subject', subject.format(**fields)),
+            ('Date', f"Mon, {1 + uid % 28:02d} Sep 2026 {fields['hour']:02d}:{uid % 60:02d}:00 +0000"),
+            ('Message-ID', self.message_id(uid)),
+        ]
+        if uid > 5 and rng.random() < REPLY_RATE:
+            parent = uid - rng.randint(1, 5)
+            headers[2] = ('Subject', f"Re: {headers[2][1]}")
+            headers += [('In-Reply-To', self.message_id(parent)), ('References', self.message_id(parent))]
+        if category == 'spam' and rng.random() < BULK_RATE:
+            headers.append(('List-Unsubscribe', f"<mailto:unsubscribe@{DOMAIN}>"))
+
+        text = (f"Hi,\n\n{body.format(**fields)}\n\n" + " ".join(rng.choice(PRODUCTS) for _ in range(rng.randint(5, 60)))
+                + f"\n\nThanks,\n{name.title()}\n")
+        if rng.random() < HTML_RATE:
+            html = "<html><body>" + "".join(f"<p>{line}</p>" for line in text.split("\n") if line) + "</body></html>"
+            parts = [{'type': ('TEXT', 'HTML'), 'params': ('CHARSET', 'utf-8'), 'encoding': '7BIT',
+                      'payload': html.encode('utf-8')}]
+        else:
+            parts = [{'type': ('TEXT', 'PLAIN'), 'params': ('CHARSET', 'utf-8'), 'encoding': '7BIT',
+                      'payload': text.encode('utf-8')}]
+        if rng.random() < ATTACHMENT_RATE:
+            parts.append({'type': ('APPLICATION', 'PDF'), 'params': ('NAME', 'invoice.pdf'), 'encoding': 'BASE64',
+                          'payload': _attachment(), 'attachment': 'invoice.pdf'})
+        return {'headers': headers, 'parts': parts, 'category': category}
+
+def _quote(value: str) -> bytes:
+    return b'"' + value.replace('\\', '\\\\').replace('"', '\\"').encode('utf-8') + b'"'
+
+def _part_structure(part: dict) -> bytes:
+    maintype, subtype = part['type']
+    payload = part['payload']
+    fields = [_quote(maintype), _quote(subtype), b'(' + b' '.join(_quote(p) for p in part['params']) + b')',
+              b'NIL', b'NIL', _quote(part['encoding']), str(len(payload)).encode()]
+    if maintype == 'TEXT':
+        fields.append(str(payload.count(b'\n') + 1).encode())
+    fields.append(b'NIL')  # md5
+    if part.get('attachment'):
+        fields.append(b'("ATTACHMENT" ("FILENAME" ' + _quote(part['attachment']) + b'))')
+    else:
+        fields.append(b'NIL')
+    fields += [b'NIL', b'NIL']
+    return b'(' + b' '.join(fields) + b')'
+
+def bodystructure(message: dict) -> bytes:
+    parts = message['parts']
+    if len(parts) == 1:
+        return _part_structure(parts[0])
+    return (b'(' + b''.join(_part_structure(p) for p in parts) +
+            b' "MIXED" ("BOUNDARY" "bench-boundary") NIL NIL NIL)')
+
+def header_bytes(message: dict, names=None) -> bytes:
+    wanted = {n.upper() for n in names} if names else None
+    lines = [f"{k}: {v}\r\n" for k, v in message['headers'] if wanted is None or k.upper() in wanted]
+    return (''.join(lines) + '\r\n').encode('utf-8')
+
+def section_bytes(message: dict, section: str) -> bytes:
+    """BODY[section] for '' (whole message), 'HEADER...' or a part number"""
+    parts = message['parts']
+    if section == '':
+        if len(parts) == 1:
+            part = parts[0]
+            head = header_bytes(message)[:-2] + (
+                f"Content-Type: {'/'.join(part['type']).lower()}; charset=utf-8\r\n"
+                f"Content-Transfer-Encoding: {part['encoding'].lower()}\r\n\r\n").encode()
+            return head + part['payload']
+        out = header_bytes(message)[:-2] + b'MIME-Version: 1.0\r\nContent-Type: multipart/mixed; boundary="bench-boundary"\r\n\r\n'
+        for part in parts:
+            out += (f"--bench-boundary\r\nContent-Type: {'/'.join(part['type']).lower()}\r\n"
+                    f"Content-Transfer-Encoding: {part['encoding'].lower()}\r\n").encode()
+            if part.get('attachment'):
+                out += f'Content-Disposition: attachment; filename="{part["attachment"]}"\r\n'.encode()
+            out += b'\r\n' + part['payload'] + b'\r\n'
+        return out + b'--bench-boundary--\r\n'
+    index = int(section.split('.')[0]) - 1
+    return parts[index]['payload'] if 0 <= index < len(parts) else b''
+
+# ============================================
+# Fake IMAP Server
+# ============================================
+
+_FETCH_ITEM = re.compile(r'BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)(?:\.(\d+))?>)?|BODYSTRUCTURE|UID|FLAGS|RFC822\.SIZE')
+_HEADER_FIELDS = re.compile(r'HEADER\.FIELDS \(([^)]*)\)', re.IGNORECASE)
+
+def parse_uid_set(text: str, highest: int) -> list:
+    uids = []
+    for piece in text.split(','):
+        if ':' in piece:
+            start, end = piece.split(':')
+            start = int(start)
+            end = highest if end == '*' else int(end)
+            uids.extend(range(min(start, end), max(start, end) + 1))
+        else:
+            uids.append(highest if piece == '*' else int(piece))
+    return [uid for uid in uids if 1 <= uid <= highest]
+
+class _IMAPHandler(socketserver.StreamRequestHandler):
+    # Buffer each response and flush once per command; small unbuffered
+    # writes stall on Nagle + delayed ACK and would dominate the timings
+    wbufsize = 256 * 1024
+    disable_nagle_algorithm = True
+
+    def send(self, data: bytes):
+        self.wfile.write(data)
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.send(b'* OK [CAPABILITY IMAP4rev1 IDLE UIDPLUS] bench IMAP ready\r\n')
+        while True:
+            self.wfile.flush()
+            line = self.rfile.readline()
+            if not line:
+                return
+            tag, _, rest = line.decode('utf-8', 'replace').rstrip('\r\n').partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            self.server.stats['commands'] += 1
+            if command == 'CAPABILITY':
+                self.send(b'* CAPABILITY IMAP4rev1 IDLE UIDPLUS\r\n')
+            elif command in ('LOGIN', 'NOOP', 'CLOSE', 'CHECK'):
+                pass
+            elif command in ('SELECT', 'EXAMINE'):
+                self.send(f"* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)\r\n"
+                          f"* {mailbox.size} EXISTS\r\n* 0 RECENT\r\n"
+                          f"* OK [UIDVALIDITY {mailbox.seed}] UIDs valid\r\n"
+                          f"* OK [UIDNEXT {mailbox.size + 1}] Predicted next UID\r\n".encode())
+                self.send(f"{tag} OK [READ-WRITE] {command} completed\r\n".encode())
+                continue
+            elif command == 'LOGOUT':
+                self.send(f"* BYE logging out\r\n{tag} OK LOGOUT completed\r\n".encode())
+                self.wfile.flush()
+                return
+            elif command == 'UID':
+                subcommand, _, args = args.partition(' ')
+                if subcommand.upper() == 'SEARCH':
+                    self._search(args, mailbox)
+                elif subcommand.upper() == 'FETCH':
+                    self._fetch(args, mailbox)
+                else:
+                    self.send(f"{tag} BAD UID {subcommand} not supported\r\n".encode())
+                    continue
+            else:
+                self.send(f"{tag} BAD {command} not supported\r\n".encode())
+                continue
+            self.send(f"{tag} OK {command} completed\r\n".encode())
+
+    def _search(self, args: str, mailbox):
+        # Every message is unread (fetches only PEEK); only a UID range narrows it
+        match = re.search(r'UID (\S+)', args, re.IGNORECASE)
+        uids = parse_uid_set(match.group(1), mailbox.size) if match else range(1, mailbox.size + 1)
+        self.send(b'* SEARCH ' + ' '.join(map(str, uids)).encode() + b'\r\n')
+
+    def _fetch(self, args: str, mailbox):
+        uid_set, _, items = args.partition(' ')
+        items = items.strip()
+        if items.startswith('(') and items.endswith(')'):
+            items = items[1:-1]
+        wanted = list(_FETCH_ITEM.finditer(items))
+        for uid in parse_uid_set(uid_set, mailbox.size):
+            message = mailbox.message(uid)
+            out = [f"* {uid} FETCH (UID {uid}".encode()]
+            for item in wanted:
+                name = item.group(0).upper()
+                if name == 'UID':
+                    continue
+                if name == 'FLAGS':
+                    out.append(b' FLAGS ()')
+                elif name == 'RFC822.SIZE':
+                    out.append(f" RFC822.SIZE {len(section_bytes(message, ''))}".encode())
+                elif name == 'BODYSTRUCTURE':
+                    out.append(b' BODYSTRUCTURE ' + bodystructure(message))
+                else:
+                    section = item.group(1)
+                    fields = _HEADER_FIELDS.match(section)
+                    if fields:
+                        data = header_bytes(message, fields.group(1).split())
+                    elif section.upper() == 'HEADER':
+                        data = header_bytes(message)
+                    else:
+                        data = section_bytes(message, section)
+                    origin = ''
+                    if item.group(2) is not None:
+                        start = int(item.group(2))
+                        length = int(item.group(3)) if item.group(3) else len(data)
+                        data = data[start:start + length]
+                        origin = f"<{start}>"
+                    self.server.stats['body_bytes'] += len(data)
+                    out.append(f" BODY[{section}]{origin} {{{len(data)}}}\r\n".encode() + data)
+            out.append(b')\r\n')
+            self.send(b''.join(out))
+            self.server.stats['messages_fetched'] += 1
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """Serves one SyntheticMailbox as INBOX on 127.0.0.1:<port>"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox: SyntheticMailbox, port: int = 0):
+        self.mailbox = mailbox
+        self.stats = {'commands': 0, 'messages_fetched': 0, 'body_bytes': 0}
+        super().__init__(('127.0.0.1', port), _IMAPHandler)
+        self.port = self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+# ============================================
+# Fake SMTP Sink
+# ============================================
+
+def self_signed_context() -> ssl.SSLContext:
+    """Server TLS context with a throwaway self-signed cert (needs `cryptography`)"""
+    import datetime
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256()))
+    directory = tempfile.mkdtemp(prefix="bench-tls-")
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, 'wb') as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True
+
+    def reply(self, line: str):
+        self.wfile.write(line.encode() + b'\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        server.stats['sessions'] += 1
+        self.reply("220 bench.local ESMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b"250-bench.local\r\n250-AUTH PLAIN LOGIN\r\n250-STARTTLS\r\n250 8BITMIME\r\n")
+                self.wfile.flush()
+            elif verb == 'STARTTLS':
+                self.reply("220 Ready to start TLS")
+                tls = server.tls_context.wrap_socket(self.connection, server_side=True)
+                self.connection = tls
+                self.rfile = tls.makefile('rb')
+                self.wfile = tls.makefile('wb')
+            elif verb == 'AUTH':
+                self.reply("235 Authentication successful")
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply("250 OK")
+            elif verb == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                    size += len(data)
+                server.stats['messages'] += 1
+                server.stats['bytes'] += size
+                self.reply("250 OK queued")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    """Accepts and counts every message; nothing is delivered"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port: int = 0):
+        self.tls_context = self_signed_context()
+        self.stats = {'sessions': 0, 'messages': 0, 'bytes': 0}
+        super().__init__(('127.0.0.1', port), _SMTPHandler)
+        self.port = self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
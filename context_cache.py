@@ -0,0 +1,121 @@
+import atexit
+import hashlib
+import os
+import threading
+import time
+import prompt_budget
+
+# ============================================
+# Static Prompt Prefixes (System Instructions / Context Caching)
+# ============================================
+#
+# Category definitions, guidelines and output formats are the same for
+# every email, so they travel as a system instruction instead of being
+# pasted into each prompt. Instructions long enough for Gemini's explicit
+# context caching are uploaded once per run as CachedContent and then
+# referenced by name; shorter ones still benefit from implicit prefix
+# caching, which needs the shared text at the start of the request.
+#
+# CONTEXT_CACHE_MODE:
+#   auto     - explicit cache when the instruction is long enough, else system instruction
+#   explicit - always try an explicit cache (falls back to system instruction on error)
+#   system   - system instruction only, no CachedContent (local testing)
+#   inline   - prepend the instruction to the prompt, as before
+
+DEFAULT_TTL_SECONDS = 3600
+MIN_CACHE_TOKENS = 1024  # smallest explicit cache Gemini 2.5 Flash accepts
+REFRESH_MARGIN = 60  # recreate a cache this long before it expires
+MODES = ('auto', 'explicit', 'system', 'inline')
+
+def mode() -> str:
+    value = os.environ.get("CONTEXT_CACHE_MODE", "auto").lower()
+    return value if value in MODES else 'auto'
+
+def with_fields(config, **fields):
+    """A GenerateContentConfig with `fields` set, leaving `config` untouched"""
+    if config is None:
+        from google.genai import types
+        return types.GenerateContentConfig(**fields)
+    return config.model_copy(update=fields)
+
+class PrefixCache:
+    """Explicit caches created this run, keyed by model and instruction hash"""
+
+    def __init__(self, ttl_seconds: float = DEFAULT_TTL_SECONDS, min_tokens: int = MIN_CACHE_TOKENS):
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.stats = {'created': 0, 'cached': 0, 'system': 0, 'inline': 0, 'fallbacks': 0}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _cache_name(self, client, model: str, instruction: str):
+        """Name of a live CachedContent for the instruction, creating it if needed; None on failure"""
+        key = (model, hashlib.sha256(instruction.encode('utf-8')).hexdigest())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and (entry['name'] is None or entry['expires_at'] - REFRESH_MARGIN > time.time()):
+                return entry['name']
+            try:
+                from google.genai import types
+                cache = client.caches.create(model=model, config=types.CreateCachedContentConfig(
+                    system_instruction=instruction,
+                    ttl=f"{int(self.ttl_seconds)}s",
+                    display_name=f"email-agent-{key[1][:12]}"
+                ))
+                name = cache.name
+                self.stats['created'] += 1
+            except Exception as e:
+                # Too short for this model, caching unavailable, ... - system instruction still works
+                print(f"   ⚠️  Context cache unavailable for {model}: {e}")
+                name = None
+                self.stats['fallbacks'] += 1
+            self._entries[key] = {'name': name, 'client': client, 'expires_at': time.time() + self.ttl_seconds}
+            return name
+
+    def apply(self, client, model: str, contents, config, instruction: str):
+        """(contents, config) carrying `instruction` the cheapest way the mode allows"""
+        if not instruction:
+            return contents, config
+        current = mode()
+        if current == 'inline':
+            self.stats['inline'] += 1
+            return f"{instruction}\n{contents}", config
+        if current == 'explicit' or (current == 'auto' and prompt_budget.count_tokens(instruction) >= self.min_tokens):
+            name = self._cache_name(client, model, instruction)
+            if name:
+                self.stats['cached'] += 1
+                return contents, with_fields(config, cached_content=name)
+        self.stats['system'] += 1
+        return contents, with_fields(config, system_instruction=instruction)
+
+    def close(self):
+        """Delete the caches this run created instead of paying for them until the TTL"""
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), {}
+        for entry in entries:
+            if entry['name']:
+                try:
+                    entry['client'].caches.delete(name=entry['name'])
+                except Exception:
+                    pass
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"{s['created']} cache(s) created, {s['cached']} request(s) via cache, "
+                f"{s['system']} via system instruction, {s['inline']} inline")
+
+_prefix_cache = None
+
+def get_prefix_cache():
+    """Process-wide prefix cache (CONTEXT_CACHE_TTL_SECONDS, CONTEXT_CACHE_MIN_TOKENS)"""
+    global _prefix_cache
+    if _prefix_cache is None:
+        _prefix_cache = PrefixCache(
+            ttl_seconds=float(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+            min_tokens=int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", MIN_CACHE_TOKENS))
+        )
+        atexit.register(_prefix_cache.close)
+    return _prefix_cache
+
+def summary() -> str:
+    return get_prefix_cache().summary()
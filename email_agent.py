@@ -1,17 +1,27 @@
-from google import genai
-from google.genai import types
 import os
 from dotenv import load_dotenv
 from datetime import datetime
 import shutil
+import asyncio
+import argparse
+import triage
+import batch_inference
+import llm
+import local_classifier
+import near_dup
+import prompt_budget
+import profiles
+import telemetry
+import profiler
 
 load_dotenv()
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+client = llm.LazyClient()
 
 # ============================================
 # Read Email from File
 # ============================================
 
+@telemetry.traced('file.read')
 def read_email(filepath: str) -> dict:
     """Read an email file and extract details"""
     print(f"   📧 Reading email: {filepath}")
@@ -67,33 +77,14 @@ def save_response(filename: str, classification: str, response: str, needs_revie
     return output_file
 
 # ============================================
-# Main Agent Logic
+# Prompts & Parsing
 # ============================================
 
-def process_email(email_file: str):
-    """Process a single email file"""
-    print(f"\n{'='*70}")
-    print(f"📨 PROCESSING: {email_file}")
-    print(f"{'='*70}")
-    
-    # Read the email
-    email_data = read_email(email_file)
-    
-    print(f"\n📧 Email Details:")
-    print(f"   From: {email_data['from']}")
-    print(f"   Subject: {email_data['subject']}")
-    print(f"   Preview: {email_data['body'][:100]}...")
-    
-    # STEP 1: Classify the email
-    print(f"\n🤖 STEP 1: Classifying email...")
-    
-    classification_prompt = f"""
-Analyze this email and classify it into ONE category. Respond with ONLY the category name.
+MODEL = "models/gemini-2.5-flash"
+DEFAULT_CONCURRENCY = 16
 
-Email:
-From: {email_data['from']}
-Subject: {email_data['subject']}
-Body: {email_data['body']}
+CLASSIFICATION_INSTRUCTION = """
+Classify each email into ONE category. Respond with ONLY the category name.
 
 Categories:
 - urgent: Payment issues, system down, angry customers, needs immediate action
@@ -104,87 +95,185 @@ Categories:
 
 Respond with ONLY ONE WORD from the categories above.
 """
+
+def build_classification_prompt(email_data: dict) -> str:
+    """Build the per-email part of the one-word classification prompt"""
+    return f"""
+Email:
+From: {email_data['from']}
+Subject: {email_data['subject']}
+Body: {prompt_budget.fit_body(email_data, 'classify')}
+"""
+
+def parse_classification(classification_text: str) -> str:
+    """Map the model's answer onto a known category"""
+    classification_text = classification_text.strip().lower()
     
-    response = client.models.generate_content(
-        model="models/gemini-2.5-flash",
-        contents=classification_prompt
-    )
-    
-    # Get classification
-    classification_text = response.text.strip().lower()
-    
-    # Parse classification
     if "urgent" in classification_text:
-        classification = "urgent"
+        return "urgent"
     elif "spam" in classification_text:
-        classification = "spam"
+        return "spam"
     elif "customer" in classification_text or "support" in classification_text:
-        classification = "customer_support"
+        return "customer_support"
     elif "internal" in classification_text:
-        classification = "internal"
-    else:
-        classification = "general_inquiry"
-    
-    print(f"\n📊 Classification: {classification.upper()}")
-    
-    # STEP 2: Draft response
-    print(f"\n🤖 STEP 2: Drafting response...")
-    
-    if classification == "spam":
-        print(f"   🗑️  SPAM detected - No response needed")
-        response_text = "[NO RESPONSE - MARKED AS SPAM]"
-        needs_review = False
-    else:
-        # Create response guidelines based on classification
-        if classification == "urgent":
-            guidelines = """
+        return "internal"
+    return "general_inquiry"
+
+GUIDELINES = {
+    'urgent': """
 - Acknowledge the urgency immediately
 - Apologize for the inconvenience
 - Provide immediate next steps
 - Give a specific timeline (e.g., "within 1 hour")
 - Escalate if needed
-"""
-        elif classification == "customer_support":
-            guidelines = """
+""",
+    'customer_support': """
 - Be empathetic and understanding
 - Acknowledge their issue
 - Provide clear solution or next steps
 - Offer additional help if needed
-"""
-        else:
-            guidelines = """
+""",
+    'default': """
 - Be friendly and professional
 - Provide helpful information
 - Offer to answer additional questions
 """
-        
-        draft_prompt = f"""
-Draft a professional email response for this email.
-
-Original Email:
-From: {email_data['from']}
-Subject: {email_data['subject']}
-Body: {email_data['body']}
-
-Type: {classification}
+}
 
-Guidelines:{guidelines}
-
-Requirements:
+DRAFT_REQUIREMENTS = """
 - Professional and helpful tone
 - 2-3 short paragraphs maximum
 - Direct and clear
 - Just the email body (no subject line, no "Dear X" greeting if not natural)
+"""
+
+DRAFT_INSTRUCTION = """
+Draft a professional email response to each email, following the guidelines for its type.
+
+Guidelines by type:
+""" + "".join(f"{category}:{text}" for category, text in GUIDELINES.items()) + f"""
+Requirements:{DRAFT_REQUIREMENTS}"""
+
+def build_draft_prompt(email_data: dict, classification: str) -> str:
+    """Build the per-email part of the draft prompt"""
+    return f"""
+Original Email:
+From: {email_data['from']}
+Subject: {email_data['subject']}
+Body: {prompt_budget.fit_body(email_data, 'draft')}
+
+Type: {classification if classification in GUIDELINES else 'default'}
 
 Draft the response:
 """
+
+def triage_kwargs() -> dict:
+    """Prompt options for the combined classify+draft call"""
+    return {
+        'guidelines': GUIDELINES,
+        'draft_requirements': DRAFT_REQUIREMENTS
+    }
+
+@telemetry.traced('file.write')
+def finish_email(email_file: str, classification: str, response_text: str, needs_review: bool):
+    """Save the response and move the email into emails/processed"""
+    filename = os.path.basename(email_file)
+    save_response(filename, classification, response_text, needs_review)
+    
+    processed_path = os.path.join("emails/processed", filename)
+    shutil.move(email_file, processed_path)
+    print(f"   📦 Moved to: {processed_path}")
+    return processed_path
+
+# ============================================
+# Main Agent Logic
+# ============================================
+
+@telemetry.traced('process_email')
+def process_email(email_file: str):
+    """Process a single email file"""
+    print(f"\n{'='*70}")
+    print(f"📨 PROCESSING: {email_file}")
+    print(f"{'='*70}")
+    
+    # Read the email
+    email_data = read_email(email_file)
+    
+    print(f"\n📧 Email Details:")
+    print(f"   From: {email_data['from']}")
+    print(f"   Subject: {email_data['subject']}")
+    print(f"   Preview: {email_data['body'][:100]}...")
+    
+    # STEP 1: Classify the email (combined mode also drafts in the same call)
+    print(f"\n🤖 STEP 1: Classifying email...")
+    
+    with telemetry.span('classify'):
+        reused = triage.reuse_near_duplicate(email_data)
+        local = triage.classify_locally(email_data) if reused is None else None
+        triaged = None
+        if reused is None and local is None and triage.combined_mode_enabled():
+            triaged = triage.triage_email(client, email_data, **triage_kwargs())
+    
+        if reused is not None:
+            details = reused[0]
+            classification = details['category']
+            draft = reused[1]
+            # Reused as-is: an email answered as needing no reply gets none here either
+            needs_reply = details.get('needs_reply') != 'no'
+            print(f"   ♻️  Near-duplicate of an answered email - reusing its draft")
+        elif local is not None:
+            details = local
+            classification = local['category']
+            draft = None
+            needs_reply = local.get('needs_reply') != 'no'
+            print(f"   🧠 Classified locally ({local['confidence']:.0%} confident)")
+        elif triaged is not None:
+            details = triaged[0]
+            classification = details['category']
+            draft = triaged[1]
+            # The combined answer already decided; no second call for a reply it says isn't needed
+            needs_reply = triaged[0]['needs_reply'] != 'no'
+            triage.remember_classification(email_data, triaged[0])
+        else:
+            response = llm.generate_content(
+                client,
+                model=MODEL,
+                contents=build_classification_prompt(email_data),
+                instruction=CLASSIFICATION_INSTRUCTION,
+                profile='classify'
+            )
+            classification = parse_classification(response.text)
+            details = dict(triage.DEFAULT_CLASSIFICATION, category=classification)
+            draft = None
+            needs_reply = True
+            triage.remember_classification(email_data, {'category': classification})
+    
+    print(f"\n📊 Classification: {classification.upper()}")
+    
+    # STEP 2: Draft response
+    print(f"\n🤖 STEP 2: Drafting response...")
+    
+    if classification == "spam":
+        print(f"   🗑️  SPAM detected - No response needed")
+        response_text = "[NO RESPONSE - MARKED AS SPAM]"
+        needs_review = False
+    elif not needs_reply:
+        print(f"   📭 No reply needed")
+        response_text = "[NO RESPONSE NEEDED]"
+        needs_review = False
+    else:
+        if draft is None:
+            with telemetry.span('draft'):
+                response = llm.generate_content(
+                    client,
+                    model=MODEL,
+                    contents=build_draft_prompt(email_data, classification),
+                    instruction=DRAFT_INSTRUCTION,
+                    profile='draft'
+                )
+            draft = response.text
         
-        response = client.models.generate_content(
-            model="models/gemini-2.5-flash",
-            contents=draft_prompt
-        )
-        
-        response_text = response.text
+        response_text = draft
         
         # Determine if needs human review
         needs_review = classification in ["urgent", "customer_support"]
@@ -195,15 +284,87 @@ Draft the response:
         print(f"{'='*70}")
         print(f"\n   🚦 Needs Human Review: {'YES ⚠️' if needs_review else 'NO ✅'}")
     
-    # STEP 3: Save the response
+    if reused is None:
+        triage.remember_draft(email_data, details, draft if classification != "spam" else None)
+    
+    # STEP 3: Save the response and move processed email
     print(f"\n🤖 STEP 3: Saving response...")
-    filename = os.path.basename(email_file)
-    save_response(filename, classification, response_text, needs_review)
+    finish_email(email_file, classification, response_text, needs_review)
     
-    # STEP 4: Move processed email
-    processed_path = os.path.join("emails/processed", filename)
-    shutil.move(email_file, processed_path)
-    print(f"   📦 Moved to: {processed_path}")
+    return {
+        'classification': classification,
+        'needs_review': needs_review,
+        'response': response_text
+    }
+
+@telemetry.traced('process_email')
+async def process_email_async(email_file: str, semaphore: asyncio.Semaphore):
+    """Process a single email file using the async Gemini client"""
+    async with semaphore:
+        email_data = read_email(email_file)
+        
+        with telemetry.span('classify'):
+            reused = triage.reuse_near_duplicate(email_data)
+            local = triage.classify_locally(email_data) if reused is None else None
+            triaged = None
+            if reused is None and local is None and triage.combined_mode_enabled():
+                triaged = await triage.triage_email_async(client, email_data, **triage_kwargs())
+        
+            if reused is not None:
+                details = reused[0]
+                classification = details['category']
+                draft = reused[1]
+                needs_reply = details.get('needs_reply') != 'no'
+            elif local is not None:
+                details = local
+                classification = local['category']
+                draft = None
+                needs_reply = local.get('needs_reply') != 'no'
+            elif triaged is not None:
+                details = triaged[0]
+                classification = details['category']
+                draft = triaged[1]
+                needs_reply = triaged[0]['needs_reply'] != 'no'
+                triage.remember_classification(email_data, triaged[0])
+            else:
+                response = await llm.generate_content_async(
+                    client,
+                    model=MODEL,
+                    contents=build_classification_prompt(email_data),
+                    instruction=CLASSIFICATION_INSTRUCTION,
+                    profile='classify'
+                )
+                classification = parse_classification(response.text)
+                details = dict(triage.DEFAULT_CLASSIFICATION, category=classification)
+                draft = None
+                needs_reply = True
+                triage.remember_classification(email_data, {'category': classification})
+        
+        if classification == "spam":
+            response_text = "[NO RESPONSE - MARKED AS SPAM]"
+            needs_review = False
+        elif not needs_reply:
+            response_text = "[NO RESPONSE NEEDED]"
+            needs_review = False
+        else:
+            if draft is None:
+                with telemetry.span('draft'):
+                    response = await llm.generate_content_async(
+                        client,
+                        model=MODEL,
+                        contents=build_draft_prompt(email_data, classification),
+                        instruction=DRAFT_INSTRUCTION,
+                        profile='draft'
+                    )
+                draft = response.text
+            response_text = draft
+            needs_review = classification in ["urgent", "customer_support"]
+        
+        if reused is None:
+            triage.remember_draft(email_data, details, draft if classification != "spam" else None)
+    
+    print(f"   📊 {os.path.basename(email_file)}: {classification.upper()}")
+    finish_email(email_file, classification, response_text, needs_review)
     
     return {
         'classification': classification,
@@ -215,13 +376,41 @@ Draft the response:
 # Batch Processor
 # ============================================
 
+def list_incoming(incoming_dir: str = "emails/incoming") -> list:
+    """List email files waiting in the incoming folder"""
+    return sorted(
+        os.path.join(incoming_dir, f)
+        for f in os.listdir(incoming_dir) if f.endswith('.txt')
+    )
+
+def print_summary(results: list):
+    """Print the processing summary"""
+    print(f"\n{'='*70}")
+    print(f"📊 PROCESSING SUMMARY")
+    print(f"{'='*70}")
+    print(f"Total Processed: {len(results)}")
+    print(f"Urgent: {sum(1 for r in results if r['classification'] == 'urgent')}")
+    print(f"Spam: {sum(1 for r in results if r['classification'] == 'spam')}")
+    print(f"Customer Support: {sum(1 for r in results if r['classification'] == 'customer_support')}")
+    print(f"Needs Human Review: {sum(1 for r in results if r['needs_review'])}")
+    print(f"LLM Cache: {llm.cache_summary()}")
+    print(f"LLM Calls: {llm.rate_limit_summary()}")
+    print(f"LLM Transport: {llm.transport_summary()}")
+    print(f"Static Instructions: {llm.context_cache_summary()}")
+    print(f"Prompt Bodies: {prompt_budget.summary()}")
+    print(f"Generation: {llm.profile_summary()}")
+    print(f"Local Classifier: {local_classifier.summary()}")
+    print(f"Near-Duplicates: {near_dup.summary()}")
+    print(f"Stages: {llm.stage_summary()}")
+    print(f"\n✅ All responses saved to 'responses/' folder")
+    print(f"✅ Processed emails moved to 'emails/processed/' folder")
+
 def process_all_emails():
     """Process all emails in the incoming folder"""
     print("🤖 EMAIL AUTO-RESPONDER AGENT")
     print("="*70)
     
-    incoming_dir = "emails/incoming"
-    email_files = [f for f in os.listdir(incoming_dir) if f.endswith('.txt')]
+    email_files = list_incoming()
     
     if not email_files:
         print("\n📭 No emails to process!")
@@ -229,27 +418,137 @@ def process_all_emails():
     
     print(f"\n📬 Found {len(email_files)} email(s) to process\n")
     
+    results = []
+    for filepath in email_files:
+        try:
+            results.append(process_email(filepath))
+        except Exception as e:
+            # Retries are exhausted by now (see rate_limit); leave the file for the next run
+            print(f"   ❌ {os.path.basename(filepath)}: {e}")
+    
+    print_summary(results)
+    if len(results) < len(email_files):
+        print(f"⚠️  {len(email_files) - len(results)} email(s) failed and were left in 'emails/incoming/'")
+
+async def process_all_emails_async(concurrency: int = DEFAULT_CONCURRENCY):
+    """Process all emails in the incoming folder concurrently.
+    
+    At most `concurrency` emails are in flight at once. Results keep the
+    order of the incoming listing; a file whose LLM calls fail is left in
+    emails/incoming so the next run picks it up again.
+    """
+    print("🤖 EMAIL AUTO-RESPONDER AGENT (async)")
+    print("="*70)
+    
+    email_files = list_incoming()
+    
+    if not email_files:
+        print("\n📭 No emails to process!")
+        return
+    
+    print(f"\n📬 Found {len(email_files)} email(s) to process (concurrency: {concurrency})\n")
+    
+    semaphore = asyncio.Semaphore(concurrency)
+    outcomes = await asyncio.gather(
+        *(process_email_async(f, semaphore) for f in email_files),
+        return_exceptions=True
+    )
+    
+    results = []
+    for email_file, outcome in zip(email_files, outcomes):
+        if isinstance(outcome, BaseException):
+            print(f"   ❌ {os.path.basename(email_file)}: {outcome}")
+        else:
+            results.append(outcome)
+    
+    print_summary(results)
+    if len(results) < len(email_files):
+        print(f"⚠️  {len(email_files) - len(results)} email(s) failed and were left in 'emails/incoming/'")
+
+def process_all_emails_batch(backend_name: str = "gemini", poll_interval: float = 30):
+    """Triage the whole incoming folder as one batch inference job"""
+    print("🤖 EMAIL AUTO-RESPONDER AGENT (batch)")
+    print("="*70)
+    
+    email_files = list_incoming()
+    
+    if not email_files:
+        print("\n📭 No emails to process!")
+        return
+    
+    print(f"\n📬 Found {len(email_files)} email(s) to process (backend: {backend_name})\n")
+    
+    emails = {os.path.basename(f): read_email(f) for f in email_files}
+    backend = batch_inference.get_backend(backend_name, client)
+    triaged = batch_inference.run_batch(backend, emails, poll_interval, **triage_kwargs())
+    
     results = []
     for email_file in email_files:
-        filepath = os.path.join(incoming_dir, email_file)
-        result = process_email(filepath)
-        results.append(result)
+        result = triaged.get(os.path.basename(email_file))
+        if result is None:
+            print(f"   ❌ {os.path.basename(email_file)}: no usable batch result")
+            continue
+        
+        classification, draft = result[0]['category'], result[1]
+        if classification == "spam":
+            response_text = "[NO RESPONSE - MARKED AS SPAM]"
+            needs_review = False
+        else:
+            response_text = draft or "[NO RESPONSE NEEDED]"
+            needs_review = classification in ["urgent", "customer_support"]
+        
+        finish_email(email_file, classification, response_text, needs_review)
+        results.append({
+            'classification': classification,
+            'needs_review': needs_review,
+            'response': response_text
+        })
     
-    # Summary
-    print(f"\n{'='*70}")
-    print(f"📊 PROCESSING SUMMARY")
-    print(f"{'='*70}")
-    print(f"Total Processed: {len(results)}")
-    print(f"Urgent: {sum(1 for r in results if r['classification'] == 'urgent')}")
-    print(f"Spam: {sum(1 for r in results if r['classification'] == 'spam')}")
-    print(f"Customer Support: {sum(1 for r in results if r['classification'] == 'customer_support')}")
-    print(f"Needs Human Review: {sum(1 for r in results if r['needs_review'])}")
-    print(f"\n✅ All responses saved to 'responses/' folder")
-    print(f"✅ Processed emails moved to 'emails/processed/' folder")
+    print_summary(results)
+    if len(results) < len(email_files):
+        print(f"⚠️  {len(email_files) - len(results)} email(s) failed and were left in 'emails/incoming/'")
 
 # ============================================
 # RUN THE AGENT
 # ============================================
 
 if __name__ == "__main__":
-    process_all_emails()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Email auto-responder agent")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="process emails concurrently with the async Gemini client")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.environ.get("EMAIL_AGENT_CONCURRENCY", DEFAULT_CONCURRENCY)),
+                        help="max emails in flight in async mode")
+    parser.add_argument("--batch", action="store_true",
+                        help="triage the whole backlog as one batch inference job")
+    parser.add_argument("--batch-backend", choices=["gemini", "local"],
+                        default=os.environ.get("EMAIL_AGENT_BATCH_BACKEND", "gemini"),
+                        help="'local' runs the batch offline with keyword rules")
+    parser.add_argument("--poll-interval", type=float, default=None,
+                        help="seconds between batch job status checks")
+    parser.add_argument("--generation", choices=list(profiles.PRESETS), default=profiles.get_preset(),
+                        help="per-stage model / thinking budget / output cap preset (GENERATION_PRESET)")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT") or 0),
+                        help="serve Prometheus metrics on this port at /metrics (0 = off)")
+    parser.add_argument("--trace", choices=list(telemetry.TRACE_FORMATS),
+                        default=os.environ.get("TRACE_EXPORT", "none"),
+                        help="append a span per stage to TRACE_PATH as JSON or OTLP/JSON lines")
+    parser.add_argument("--profile", nargs="?", const="all", choices=list(profiler.MODES),
+                        help="sample CPU per stage and/or trace allocations (default: both); "
+                             "flamegraph-ready files go to profiling/")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        # asyncio.Semaphore(0) would make every email wait forever
+        parser.error(f"--concurrency must be at least 1 (got {args.concurrency})")
+    profiles.set_preset(args.generation)
+    telemetry.configure_tracing(args.trace)
+    telemetry.serve(args.metrics_port)
+    
+    with profiler.profiling(args.profile, label="email_agent"):
+        if args.batch:
+            poll_interval = args.poll_interval or (1 if args.batch_backend == "local" else 30)
+            process_all_emails_batch(args.batch_backend, poll_interval)
+        elif args.use_async:
+            asyncio.run(process_all_emails_async(args.concurrency))
+        else:
+            process_all_emails()
@@ -1,14 +1,20 @@
 import streamlit as st
-from google import genai
-from imapclient import IMAPClient
-import email
-from email import policy
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+import triage
+import llm
+import imap_fetch
+import thread_index
+import prompt_budget
+import profiles
+import telemetry
+import profiler
+import imap_pool
 
 load_dotenv()
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+client = llm.LazyClient()
+telemetry.serve()  # METRICS_PORT; started once, kept across reruns
 
 # Page config
 st.set_page_config(
@@ -53,6 +59,14 @@ if 'emails' not in st.session_state:
 # Functions
 # ============================================
 
+FETCH_LIMIT = int(os.environ.get("EMAIL_FETCH_LIMIT", 10))  # 0 = no limit
+
+@st.cache_resource
+def get_imap_pool(server, email_address, password):
+    """Logged-in IMAP connections per account, kept across reruns"""
+    return imap_pool.IMAPPool(server, email_address, password)
+
+@telemetry.traced('ui.fetch')
 def fetch_and_process():
     """Fetch and process emails"""
     # Get credentials from .env
@@ -67,97 +81,97 @@ def fetch_and_process():
     
     try:
         # Connect
-        with st.spinner(f"📬 Connecting to {email_address}..."):
-            imap = IMAPClient(server, use_uid=True, ssl=True)
-            imap.login(email_address, password)
-            imap.select_folder('INBOX')
-            
-            # Fetch unread emails
-            messages = imap.search(['UNSEEN'])
+        pool = get_imap_pool(server, email_address, password)
+        with st.spinner(f"📬 Connecting to {email_address}..."), pool.connection() as imap:
+            # Unread emails new since the last sync, streamed in chunks
+            fetched = imap_fetch.UnreadMessages(
+                imap, email_address, limit=FETCH_LIMIT or None, max_chars=1500
+            )
             
-            if not messages:
+            if not fetched:
                 st.info("📭 No unread emails found!")
                 return True
             
-            # Limit to 10
-            messages = messages[:10]
-            st.success(f"✅ Found {len(messages)} unread email(s)")
-            
-            # Process each email
-            raw_messages = imap.fetch(messages, ['RFC822'])
+            st.success(f"✅ Found {len(fetched)} unread email(s)")
             st.session_state.emails = []
             
             progress = st.progress(0)
-            for idx, (msg_id, data) in enumerate(raw_messages.items()):
-                # Parse email
-                msg = email.message_from_bytes(data[b'RFC822'], policy=policy.default)
-                
-                # Extract body
-                body = ""
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == "text/plain":
-                            try:
-                                body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                                break
-                            except:
-                                pass
-                else:
-                    try:
-                        body = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    except:
-                        body = str(msg.get_payload())
-                
-                email_data = {
-                    'from': str(msg['From']),
-                    'subject': str(msg['Subject']) or "(No Subject)",
-                    'body': body[:1500]
-                }
+            live_draft = st.empty()
+            for idx, msg in enumerate(fetched):
+                with telemetry.span('process_message', uid=msg['id']):
+                    email_data = {
+                        'from': msg['from'],
+                        'subject': msg['subject'],
+                        'body': msg['body'],
+                        'thread_context': msg.get('thread_context'),
+                        'rule_classification': msg.get('rule_classification'),
+                        'local_classification': msg.get('local_classification')
+                    }
                 
-                # Classify
-                classification = classify_email(email_data)
+                    # Classify and draft
+                    if triage.streaming_enabled():
+                        # Show the draft as it is written instead of after it is done
+                        classification, chunks = triage.classify_and_draft_stream(
+                            client, email_data, classify_email, draft_response_stream
+                        )
+                        response = None
+                        if chunks is not None:
+                            with live_draft.container():
+                                st.caption(f"✍️ Drafting: {email_data['subject']}")
+                                response = st.write_stream(chunks)
+                    else:
+                        classification, response = triage.classify_and_draft(
+                            client, email_data, classify_email, draft_response
+                        )
                 
-                # Draft response
-                response = None
-                if classification['category'] not in ['spam'] and classification['needs_reply'] == 'yes':
-                    response = draft_response(email_data, classification)
+                    st.session_state.emails.append({
+                        'from': email_data['from'],
+                        'subject': email_data['subject'],
+                        'body': email_data['body'],
+                        'category': classification['category'],
+                        'priority': classification['priority'],
+                        'source': classification.get('source', 'llm'),
+                        'response': response
+                    })
                 
-                st.session_state.emails.append({
-                    'from': email_data['from'],
-                    'subject': email_data['subject'],
-                    'body': email_data['body'],
-                    'category': classification['category'],
-                    'priority': classification['priority'],
-                    'response': response
-                })
-                
-                progress.progress((idx + 1) / len(messages))
+                progress.progress((idx + 1) / len(fetched))
             
-            imap.logout()
+            live_draft.empty()
             return True
             
     except Exception as e:
         st.error(f"❌ Error: {str(e)}")
         return False
 
-def classify_email(email_data):
-    """Quick classification"""
-    prompt = f"""
-Classify this email:
-
-From: {email_data['from']}
-Subject: {email_data['subject']}
-Body: {email_data['body'][:600]}
+CLASSIFICATION_INSTRUCTION = """
+Classify each email.
 
 Reply with ONLY:
 CATEGORY: [urgent/spam/customer_support/general_inquiry]
 PRIORITY: [high/medium/low]
 NEEDS_REPLY: [yes/no]
+"""
+
+DRAFT_INSTRUCTION = """
+Draft a professional email response to each email.
+
+Write a 2-paragraph professional response. Be concise.
+"""
+
+def classify_email(email_data):
+    """Quick classification"""
+    prompt = f"""
+From: {email_data['from']}
+Subject: {email_data['subject']}
+Body: {prompt_budget.fit_body(email_data, 'classify')}
 """
     
-    response = client.models.generate_content(
+    response = llm.generate_content(
+        client,
         model="models/gemini-2.5-flash",
-        contents=prompt
+        contents=prompt,
+        instruction=CLASSIFICATION_INSTRUCTION,
+        profile='classify'
     )
     
     text = response.text.lower()
@@ -168,28 +182,46 @@ NEEDS_REPLY: [yes/no]
         'needs_reply': 'yes' if 'yes' in text else 'no'
     }
 
-def draft_response(email_data, classification):
-    """Draft response"""
-    prompt = f"""
-Draft a professional email response.
-
+def build_draft_prompt(email_data, classification):
+    return f"""
 From: {email_data['from']}
 Subject: {email_data['subject']}
-Body: {email_data['body'][:500]}
-
+Body: {prompt_budget.fit_body(email_data, 'draft')}
+{thread_index.format_context(email_data)}
 Category: {classification['category']}
 Priority: {classification['priority']}
-
-Write a 2-paragraph professional response. Be concise.
 """
-    
-    response = client.models.generate_content(
+
+def draft_response(email_data, classification):
+    """Draft response"""
+    response = llm.generate_content(
+        client,
         model="models/gemini-2.5-flash",
-        contents=prompt
+        contents=build_draft_prompt(email_data, classification),
+        instruction=DRAFT_INSTRUCTION,
+        profile='draft'
     )
     
     return response.text
 
+def draft_response_stream(email_data, classification):
+    """Draft response, yielded in chunks as it is generated"""
+    return llm.generate_content_stream(
+        client,
+        model="models/gemini-2.5-flash",
+        contents=build_draft_prompt(email_data, classification),
+        instruction=DRAFT_INSTRUCTION,
+        profile='draft'
+    )
+
+def profile_mode():
+    """?profile= as a profiler mode; an unrecognised value warns and leaves profiling off"""
+    try:
+        return profiler.parse_mode(st.query_params.get("profile"))
+    except ValueError as e:
+        st.warning(f"🔬 {e}; running without profiling")
+        return None
+
 # ============================================
 # UI
 # ============================================
@@ -208,11 +240,27 @@ if st.session_state.emails:
         responded = sum(1 for e in st.session_state.emails if e['response'])
         st.metric("✍️ Responses", responded)
     
+    local = sum(1 for e in st.session_state.emails if e.get('source') == 'local')
+    st.caption(f"🧠 {local}/{len(st.session_state.emails)} classified locally without an LLM call")
+    if profiles.latency.metrics():
+        st.caption(f"⏱️ {profiles.latency.summary()}")
+    
     st.markdown("---")
 
+generation = st.selectbox(
+    "🎛️ Generation Preset:", list(profiles.PRESETS),
+    index=list(profiles.PRESETS).index(profiles.get_preset()),
+    help="Per-stage model, thinking budget and output cap (this session only)",
+    key="generation"
+)
+profiles.use_preset(generation)  # this script run only; other sessions keep theirs
+
 # Main button
 if st.button("🚀 Fetch & Process Emails", type="primary", use_container_width=True):
-    fetch_and_process()
+    with profiler.profiling(profile_mode(), label="email_agent_simple") as profile:
+        fetch_and_process()
+    if profile:
+        st.caption(f"🔬 Profile written to {profile.output_dir}/")
 
 st.markdown("---")
 
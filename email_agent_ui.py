@@ -1,17 +1,24 @@
 import streamlit as st
-from google import genai
-from imapclient import IMAPClient
-import email
-from email import policy
-import os
+import contextlib
 from dotenv import load_dotenv
 from datetime import datetime
-import pandas as pd
-import plotly.express as px
+import csv
+import io
 import plotly.graph_objects as go
+from plotly.colors import qualitative
+import triage
+import llm
+import imap_fetch
+import thread_index
+import prompt_budget
+import profiles
+import telemetry
+import profiler
+import imap_pool
 
 load_dotenv()
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+client = llm.LazyClient()
+telemetry.serve()  # METRICS_PORT; started once, kept across reruns
 
 # Page config
 st.set_page_config(
@@ -73,59 +80,30 @@ if 'connected' not in st.session_state:
 # IMAP Connection
 # ============================================
 
-def connect_imap(email_address, password, server):
-    """Connect to IMAP server"""
+@st.cache_resource
+def get_imap_pool(server, email_address, password):
+    """Logged-in IMAP connections per account, kept across reruns"""
+    return imap_pool.IMAPPool(server, email_address, password)
+
+def connect_imap(stack, email_address, password, server):
+    """Connect to IMAP server, reusing the connection from the last fetch when it is still alive.
+    
+    The connection goes back to the pool when `stack` (an ExitStack) closes,
+    or is logged out if the block raised.
+    """
     try:
-        imap = IMAPClient(server, use_uid=True, ssl=True)
-        imap.login(email_address, password)
-        imap.select_folder('INBOX')
-        return imap, None
+        return stack.enter_context(get_imap_pool(server, email_address, password).connection()), None
     except Exception as e:
         return None, str(e)
 
-def fetch_emails(imap, limit=10):
-    """Fetch unread emails"""
+def fetch_emails(imap, account, limit=10):
+    """Stream unread emails new since the last sync of this account.
+    
+    The returned stream fetches in chunks while earlier messages are being
+    processed; len() gives the number of messages it will yield.
+    """
     try:
-        messages = imap.search(['UNSEEN'])
-        
-        if not messages:
-            return [], None
-        
-        messages = messages[:limit]
-        raw_messages = imap.fetch(messages, ['RFC822'])
-        
-        emails = []
-        for msg_id, data in raw_messages.items():
-            email_message = email.message_from_bytes(
-                data[b'RFC822'],
-                policy=policy.default
-            )
-            
-            # Extract body
-            body = ""
-            if email_message.is_multipart():
-                for part in email_message.walk():
-                    if part.get_content_type() == "text/plain":
-                        try:
-                            body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                            break
-                        except:
-                            pass
-            else:
-                try:
-                    body = email_message.get_payload(decode=True).decode('utf-8', errors='ignore')
-                except:
-                    body = str(email_message.get_payload())
-            
-            emails.append({
-                'id': msg_id,
-                'from': str(email_message['From']),
-                'subject': str(email_message['Subject']) or "(No Subject)",
-                'date': str(email_message['Date']),
-                'body': body[:2000]
-            })
-        
-        return emails, None
+        return imap_fetch.UnreadMessages(imap, account, limit=limit or None, max_chars=2000), None
     except Exception as e:
         return [], str(e)
 
@@ -133,14 +111,8 @@ def fetch_emails(imap, limit=10):
 # AI Functions
 # ============================================
 
-def classify_email(email_data):
-    """Classify email using AI"""
-    classification_prompt = f"""
-Analyze and classify this email.
-
-From: {email_data['from']}
-Subject: {email_data['subject']}
-Body: {email_data['body'][:800]}
+CLASSIFICATION_INSTRUCTION = """
+Analyze and classify each email.
 
 Provide:
 CATEGORY: [urgent/spam/customer_support/general_inquiry/internal/promotional]
@@ -148,11 +120,32 @@ PRIORITY: [high/medium/low]
 SENTIMENT: [positive/neutral/negative]
 NEEDS_REPLY: [yes/no]
 REASON: [brief explanation]
+"""
+
+DRAFT_INSTRUCTION = """
+Draft a professional email response to each email.
+
+Requirements:
+- Use the tone given with the email
+- 2-3 paragraphs
+- Include greeting and closing
+- Professional and clear
+"""
+
+def classify_email(email_data):
+    """Classify email using AI"""
+    classification_prompt = f"""
+From: {email_data['from']}
+Subject: {email_data['subject']}
+Body: {prompt_budget.fit_body(email_data, 'classify')}
 """
     
-    response = client.models.generate_content(
+    response = llm.generate_content(
+        client,
         model="models/gemini-2.5-flash",
-        contents=classification_prompt
+        contents=classification_prompt,
+        instruction=CLASSIFICATION_INSTRUCTION,
+        profile='classify'
     )
     
     result_text = response.text
@@ -185,43 +178,89 @@ REASON: [brief explanation]
     
     return classification
 
-def draft_response(email_data, classification):
-    """Draft AI response"""
-    if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
-        return None
-    
+def build_draft_prompt(email_data, classification):
     tone = "professional and helpful"
     if classification['priority'] == 'high':
         tone = "immediate and solution-focused"
     elif classification['sentiment'] == 'negative':
         tone = "empathetic and reassuring"
     
-    draft_prompt = f"""
-Draft a professional email response.
-
+    return f"""
 Original:
 From: {email_data['from']}
 Subject: {email_data['subject']}
-Body: {email_data['body'][:600]}
-
+Body: {prompt_budget.fit_body(email_data, 'draft')}
+{thread_index.format_context(email_data)}
 Context: {classification['category']} | {classification['priority']} priority
-
-Requirements:
-- Tone: {tone}
-- 2-3 paragraphs
-- Include greeting and closing
-- Professional and clear
+Tone: {tone}
 
 Draft:
 """
+
+def draft_response(email_data, classification):
+    """Draft AI response"""
+    if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
+        return None
     
-    response = client.models.generate_content(
+    response = llm.generate_content(
+        client,
         model="models/gemini-2.5-flash",
-        contents=draft_prompt
+        contents=build_draft_prompt(email_data, classification),
+        instruction=DRAFT_INSTRUCTION,
+        profile='draft'
     )
     
     return response.text
 
+def draft_response_stream(email_data, classification):
+    """Draft AI response, yielded in chunks as it is generated"""
+    return llm.generate_content_stream(
+        client,
+        model="models/gemini-2.5-flash",
+        contents=build_draft_prompt(email_data, classification),
+        instruction=DRAFT_INSTRUCTION,
+        profile='draft'
+    )
+
+def profile_mode():
+    """?profile= as a profiler mode; an unrecognised value warns and leaves profiling off"""
+    try:
+        return profiler.parse_mode(st.query_params.get("profile"))
+    except ValueError as e:
+        st.warning(f"🔬 {e}; running without profiling")
+        return None
+
+# ============================================
+# Charts
+# ============================================
+
+# Cached by the counts, so reruns (filter changes, downloads) reuse the figures
+@st.cache_resource(max_entries=32)
+def category_chart(category_counts):
+    """Category pie chart from ((category, count), ...)"""
+    fig = go.Figure(data=[
+        go.Pie(
+            labels=[category for category, _ in category_counts],
+            values=[count for _, count in category_counts],
+            marker_colors=qualitative.Set3
+        )
+    ])
+    fig.update_layout(title="📂 Email Categories")
+    return fig
+
+@st.cache_resource(max_entries=32)
+def priority_chart(high, medium, low):
+    """Priority bar chart"""
+    fig = go.Figure(data=[
+        go.Bar(
+            x=['High', 'Medium', 'Low'],
+            y=[high, medium, low],
+            marker_color=['#f44336', '#ff9800', '#4caf50']
+        )
+    ])
+    fig.update_layout(title="⚡ Priority Distribution", showlegend=False)
+    return fig
+
 # ============================================
 # UI Header
 # ============================================
@@ -254,7 +293,17 @@ with st.sidebar:
     email_address = st.text_input("📧 Email Address:", placeholder="your.email@gmail.com")
     email_password = st.text_input("🔑 Password:", type="password", placeholder="App password")
     
-    email_limit = st.slider("📬 Emails to Fetch:", min_value=1, max_value=50, value=10)
+    email_limit = st.number_input("📬 Emails to Fetch (0 = all):", min_value=0, value=10, step=10)
+    
+    generation = st.selectbox(
+        "🎛️ Generation Preset:", list(profiles.PRESETS),
+        index=list(profiles.PRESETS).index(profiles.get_preset()),
+        help="Per-stage model, thinking budget and output cap (this session only)",
+        key="generation"
+    )
+    profiles.use_preset(generation)  # this script run only; other sessions keep theirs
+    if profiles.latency.metrics():
+        st.caption(f"⏱️ {profiles.latency.summary()}")
     
     st.markdown("---")
     
@@ -292,6 +341,9 @@ with st.sidebar:
         
         with_response = sum(1 for e in st.session_state.processed_emails if e['response'])
         st.metric("Responses Drafted", with_response)
+        
+        local = sum(1 for e in st.session_state.processed_emails if e['classification'].get('source') == 'local')
+        st.metric("🧠 Classified Locally", f"{local / total:.0%}", delta=f"{local} without an LLM call")
 
 # ============================================
 # Main Content
@@ -301,8 +353,10 @@ if connect_button:
     if not email_address or not email_password:
         st.error("⚠️ Please enter email and password!")
     else:
-        with st.spinner("🔌 Connecting to email server..."):
-            imap, error = connect_imap(email_address, email_password, imap_server)
+        profiling = profiler.profiling(profile_mode(), label="email_agent_ui")
+        with profiling as profile, telemetry.span('ui.fetch'), contextlib.ExitStack() as connection, \
+                st.spinner("🔌 Connecting to email server..."):
+            imap, error = connect_imap(connection, email_address, email_password, imap_server)
             
             if error:
                 st.error(f"❌ Connection failed: {error}")
@@ -316,8 +370,8 @@ if connect_button:
                 st.success(f"✅ Connected to {email_address}")
                 
                 # Fetch emails
-                with st.spinner(f"📬 Fetching {email_limit} unread emails..."):
-                    emails, error = fetch_emails(imap, email_limit)
+                with st.spinner(f"📬 Fetching {email_limit or 'all'} unread emails..."):
+                    emails, error = fetch_emails(imap, email_address, email_limit)
                     
                     if error:
                         st.error(f"❌ Error fetching emails: {error}")
@@ -330,29 +384,46 @@ if connect_button:
                         st.session_state.processed_emails = []
                         progress_bar = st.progress(0)
                         status_text = st.empty()
+                        live_draft = st.empty()
                         
                         for idx, email_data in enumerate(emails):
-                            status_text.text(f"Processing {idx+1}/{len(emails)}: {email_data['subject'][:50]}...")
+                            with telemetry.span('process_message', uid=email_data['id']):
+                                status_text.text(f"Processing {idx+1}/{len(emails)}: {email_data['subject'][:50]}...")
                             
-                            # AI Processing
-                            classification = classify_email(email_data)
-                            response_text = draft_response(email_data, classification)
+                                # AI Processing
+                                if triage.streaming_enabled():
+                                    # Render tokens as they arrive instead of waiting for the full draft
+                                    classification, chunks = triage.classify_and_draft_stream(
+                                        client, email_data, classify_email, draft_response_stream
+                                    )
+                                    response_text = None
+                                    if chunks is not None:
+                                        with live_draft.container():
+                                            st.markdown("**✍️ Drafting response...**")
+                                            response_text = st.write_stream(chunks)
+                                else:
+                                    classification, response_text = triage.classify_and_draft(
+                                        client, email_data, classify_email, draft_response
+                                    )
                             
-                            # Store result
-                            st.session_state.processed_emails.append({
-                                'from': email_data['from'],
-                                'subject': email_data['subject'],
-                                'body': email_data['body'],
-                                'classification': classification,
-                                'response': response_text,
-                                'timestamp': datetime.now()
-                            })
+                                # Store result
+                                st.session_state.processed_emails.append({
+                                    'from': email_data['from'],
+                                    'subject': email_data['subject'],
+                                    'body': email_data['body'],
+                                    'classification': classification,
+                                    'response': response_text,
+                                    'timestamp': datetime.now()
+                                })
                             
                             progress_bar.progress((idx + 1) / len(emails))
                         
+                        live_draft.empty()
                         status_text.text("✅ Processing complete!")
-                        imap.logout()
                         st.balloons()
+        
+        if profile:
+            st.caption(f"🔬 Profile written to {profile.output_dir}/")
 
 # ============================================
 # Display Results
@@ -389,13 +460,7 @@ if st.session_state.processed_emails:
             cat = email['classification']['category']
             category_counts[cat] = category_counts.get(cat, 0) + 1
         
-        fig = px.pie(
-            values=list(category_counts.values()),
-            names=list(category_counts.keys()),
-            title="📂 Email Categories",
-            color_discrete_sequence=px.colors.qualitative.Set3
-        )
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(category_chart(tuple(category_counts.items())), use_container_width=True)
     
     with col2:
         # Priority bar chart
@@ -404,15 +469,8 @@ if st.session_state.processed_emails:
             pri = email['classification']['priority']
             priority_counts[pri] = priority_counts.get(pri, 0) + 1
         
-        fig = go.Figure(data=[
-            go.Bar(
-                x=['High', 'Medium', 'Low'],
-                y=[priority_counts['high'], priority_counts['medium'], priority_counts['low']],
-                marker_color=['#f44336', '#ff9800', '#4caf50']
-            )
-        ])
-        fig.update_layout(title="⚡ Priority Distribution", showlegend=False)
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(priority_chart(priority_counts['high'], priority_counts['medium'], priority_counts['low']),
+                        use_container_width=True)
     
     # Email List
     st.markdown("---")
@@ -495,9 +553,9 @@ if st.session_state.processed_emails:
     # Export Report
     st.markdown("---")
     if st.button("📥 Export Full Report (CSV)", use_container_width=True):
-        df_data = []
+        rows = []
         for email in st.session_state.processed_emails:
-            df_data.append({
+            rows.append({
                 'From': email['from'],
                 'Subject': email['subject'],
                 'Category': email['classification']['category'],
@@ -508,12 +566,14 @@ if st.session_state.processed_emails:
                 'Timestamp': email['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
             })
         
-        df = pd.DataFrame(df_data)
-        csv = df.to_csv(index=False)
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
         
         st.download_button(
             label="📥 Download CSV",
-            data=csv,
+            data=output.getvalue(),
             file_name=f"email_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
             mime="text/csv"
         )
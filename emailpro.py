@@ -1,18 +1,16 @@
 import streamlit as st
-from google import genai
-from imapclient import IMAPClient
-import email
-from email import policy
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import smtplib
 import os
 from dotenv import load_dotenv
 from datetime import datetime
 import json
+import smtp_pool
+import job_queue
+import profiles
+import profiler
+import telemetry
 
 load_dotenv()
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+telemetry.serve()  # METRICS_PORT; started once, kept across reruns
 
 # Page config
 st.set_page_config(
@@ -61,165 +59,70 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state
-if 'emails' not in st.session_state:
-    st.session_state.emails = []
 if 'sent_log' not in st.session_state:
     st.session_state.sent_log = []
 
+# Processed emails live in the job queue database, so every reviewer (and
+# every browser refresh) sees the same list; worker.py fills it in.
+queue = job_queue.get_queue()
+# A session that died mid-send leaves its reviews 'sending'; hand them back after a while
+queue.release_stale_claims(float(os.environ.get("EMAILPRO_SEND_TIMEOUT", job_queue.DEFAULT_CLAIM_SECONDS)))
+st.session_state.emails = queue.reviews()
+
 # ============================================
 # Email Functions
 # ============================================
 
-def fetch_emails():
-    """Fetch unread emails via IMAP"""
-    email_address = os.environ.get("EMAIL_ADDRESS")
-    password = os.environ.get("EMAIL_PASSWORD")
-    server = os.environ.get("IMAP_SERVER", "imap.gmail.com")
-    
-    if not email_address or not password:
-        st.error("⚠️ Missing credentials in .env file!")
-        return None
-    
-    try:
-        imap = IMAPClient(server, use_uid=True, ssl=True)
-        imap.login(email_address, password)
-        imap.select_folder('INBOX')
-        
-        messages = imap.search(['UNSEEN'])
-        
-        if not messages:
-            return []
-        
-        messages = messages[:10]
-        raw_messages = imap.fetch(messages, ['RFC822'])
-        
-        emails = []
-        for msg_id, data in raw_messages.items():
-            msg = email.message_from_bytes(data[b'RFC822'], policy=policy.default)
-            
-            body = ""
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_type() == "text/plain":
-                        try:
-                            body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                            break
-                        except:
-                            pass
-            else:
-                try:
-                    body = msg.get_payload(decode=True).decode('utf-8', errors='ignore')
-                except:
-                    body = str(msg.get_payload())
-            
-            emails.append({
-                'id': str(msg_id),
-                'from': str(msg['From']),
-                'from_email': email.utils.parseaddr(str(msg['From']))[1],
-                'subject': str(msg['Subject']) or "(No Subject)",
-                'body': body[:1500],
-                'status': 'pending',
-                'response': None,
-                'edited_response': None
-            })
-        
-        imap.logout()
-        return emails
-        
-    except Exception as e:
-        st.error(f"❌ Error: {str(e)}")
-        return None
-
-def classify_email(email_data):
-    """AI classification"""
-    prompt = f"""
-Classify this email:
-
-From: {email_data['from']}
-Subject: {email_data['subject']}
-Body: {email_data['body'][:600]}
-
-Reply ONLY:
-CATEGORY: [urgent/spam/customer_support/general_inquiry]
-PRIORITY: [high/medium/low]
-NEEDS_REPLY: [yes/no]
-"""
-    
-    response = client.models.generate_content(
-        model="models/gemini-2.5-flash",
-        contents=prompt
-    )
-    
-    text = response.text.lower()
-    
-    return {
-        'category': 'urgent' if 'urgent' in text else 'spam' if 'spam' in text else 'customer_support' if 'customer' in text else 'general_inquiry',
-        'priority': 'high' if 'high' in text else 'low' if 'low' in text else 'medium',
-        'needs_reply': 'yes' if 'yes' in text else 'no'
-    }
+FETCH_LIMIT = int(os.environ.get("EMAIL_FETCH_LIMIT", 10))  # 0 = no limit
+POLL_SECONDS = float(os.environ.get("EMAILPRO_POLL_SECONDS", 0.5))
 
-def draft_response(email_data, classification):
-    """AI draft response"""
-    if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
-        return None
-    
-    prompt = f"""
-Draft a professional email response.
+def request_fetch(limit=FETCH_LIMIT, generation=None):
+    """Queue a fetch for the workers; False if one is already queued or running.
 
-From: {email_data['from']}
-Subject: {email_data['subject']}
-Body: {email_data['body'][:500]}
+    `generation` (a preset name) travels with the fetch and its triage jobs,
+    so the workers draft with this session's preset.
+    """
+    if not os.environ.get("EMAIL_ADDRESS") or not os.environ.get("EMAIL_PASSWORD"):
+        st.error("⚠️ Missing credentials in .env file!")
+        return False
+    job_id = queue.enqueue('fetch', {'limit': limit, 'generation': generation},
+                           dedupe_key=f"fetch:{os.environ['EMAIL_ADDRESS']}")
+    return job_id is not None
 
-Category: {classification['category']}
-Priority: {classification['priority']}
-
-Write a professional 2-paragraph response. Be concise and helpful.
-"""
-    
-    response = client.models.generate_content(
-        model="models/gemini-2.5-flash",
-        contents=prompt
-    )
-    
-    return response.text
+@st.cache_resource
+def get_sender(email_address, password):
+    """One pooled SMTP session per account, kept across reruns"""
+    return smtp_pool.SMTPSender(email_address, password)
 
+@telemetry.traced('send_email')
 def send_email(to_email, subject, body):
     """Send email via SMTP"""
     email_address = os.environ.get("EMAIL_ADDRESS")
     password = os.environ.get("EMAIL_PASSWORD")
     
-    # SMTP servers
-    smtp_servers = {
-        'gmail.com': ('smtp.gmail.com', 587),
-        'outlook.com': ('smtp.office365.com', 587),
-        'office365.com': ('smtp.office365.com', 587)
-    }
-    
-    # Detect SMTP server
-    domain = email_address.split('@')[1].lower()
-    smtp_server, smtp_port = smtp_servers.get(domain, ('smtp.gmail.com', 587))
-    
     try:
-        # Create message
-        msg = MIMEMultipart()
-        msg['From'] = email_address
-        msg['To'] = to_email
-        msg['Subject'] = f"Re: {subject}"
-        
-        msg.attach(MIMEText(body, 'plain'))
-        
-        # Send
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(email_address, password)
-        server.send_message(msg)
-        server.quit()
-        
-        return True, None
-        
+        return get_sender(email_address, password).send(to_email, subject, body)
     except Exception as e:
         return False, str(e)
 
+def profile_mode():
+    """?profile= as a profiler mode; an unrecognised value warns and leaves profiling off"""
+    try:
+        return profiler.parse_mode(st.query_params.get("profile"))
+    except ValueError as e:
+        st.warning(f"🔬 {e}; running without profiling")
+        return None
+
+def log_send(email, success, error=None):
+    """Record a send attempt in sent_log"""
+    st.session_state.sent_log.append({
+        'to': email['from_email'],
+        'subject': email['subject'],
+        'status': 'sent' if success else 'failed',
+        'error': error,
+        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+
 # ============================================
 # UI Header
 # ============================================
@@ -243,16 +146,33 @@ with st.sidebar:
         st.metric("⏳ Pending", pending, delta=f"{pending} awaiting review")
         st.metric("✅ Sent", sent, delta=f"{sent} sent successfully")
         st.metric("❌ Rejected", rejected)
+        
+        local = sum(1 for e in st.session_state.emails if (e.get('classification') or {}).get('source') == 'local')
+        st.metric("🧠 Classified Locally", f"{local / total:.0%}", delta=f"{local} without an LLM call")
     else:
         st.info("No emails processed yet")
     
+    generation = st.selectbox(
+        "🎛️ Generation Preset:", list(profiles.PRESETS),
+        index=list(profiles.PRESETS).index(profiles.get_preset()),
+        help="Per-stage model, thinking budget and output cap for the drafts of the next fetch",
+        key="generation"
+    )
+    
+    st.caption(f"🧵 Jobs: {queue.summary()}")
+    for kind, error in queue.failures(limit=3):
+        st.caption(f"⚠️ {kind} job failed: {error}")
+    
     st.markdown("---")
     
     # Sent log
     if st.session_state.sent_log:
         st.subheader("📤 Recent Sends")
         for log in st.session_state.sent_log[-5:]:
-            st.caption(f"✉️ {log['to']}")
+            if log.get('status') == 'failed':
+                st.caption(f"⚠️ {log['to']} — {log['error']}")
+            else:
+                st.caption(f"✉️ {log['to']}")
             st.caption(f"   {log['timestamp']}")
 
 # ============================================
@@ -265,36 +185,43 @@ col1, col2 = st.columns(2)
 
 with col1:
     if st.button("📬 Fetch & Process New Emails", type="primary", use_container_width=True):
-        with st.spinner("Fetching emails..."):
-            emails = fetch_emails()
-            
-            if emails is None:
-                st.error("Failed to fetch emails")
-            elif len(emails) == 0:
-                st.info("📭 No unread emails found!")
-            else:
-                st.success(f"✅ Found {len(emails)} unread email(s)")
-                
-                # Process each
-                progress = st.progress(0)
-                for idx, email_data in enumerate(emails):
-                    classification = classify_email(email_data)
-                    response = draft_response(email_data, classification)
-                    
-                    email_data['classification'] = classification
-                    email_data['response'] = response
-                    email_data['edited_response'] = response  # Initialize editable version
-                    
-                    progress.progress((idx + 1) / len(emails))
-                
-                st.session_state.emails = emails
-                st.rerun()
+        if request_fetch(generation=generation):
+            st.success("✅ Fetch queued — drafts appear below as the workers finish them")
+        else:
+            st.info("⏳ A fetch is already in progress")
 
 with col2:
     if st.button("🔄 Clear All", use_container_width=True):
-        st.session_state.emails = []
+        queue.clear_reviews()
         st.rerun()
 
+@st.fragment(run_every=POLL_SECONDS)
+def live_updates(shown):
+    """Poll the queue: render drafts as workers stream them in, and rerun
+    the page once an email is added or changes status.
+    
+    Each poll only reads the review table's stamp; statuses and the
+    'drafting' items are loaded when it has changed.
+    """
+    counts = queue.counts()
+    active = counts.get('queued', 0) + counts.get('running', 0)
+    if active:
+        st.caption(f"⏳ Workers busy: {counts.get('running', 0)} running, {counts.get('queued', 0)} queued")
+    
+    stamp = queue.review_stamp()
+    if stamp != st.session_state.get('reviews_stamp'):
+        if queue.review_statuses() != shown:
+            st.rerun()
+        st.session_state.drafting = queue.reviews(status='drafting')
+        st.session_state.reviews_stamp = stamp
+    
+    for email in st.session_state.drafting:
+        st.markdown(f"**✍️ Drafting reply to:** {email['subject']}")
+        st.caption(f"**From:** {email['from']}")
+        st.markdown((email['response'] or '') + " ▌")
+
+live_updates([(e['id'], e['status']) for e in st.session_state.emails])
+
 st.markdown("---")
 
 # ============================================
@@ -313,6 +240,44 @@ if st.session_state.emails:
         else:
             st.write(f"**{len(pending_emails)} email(s) awaiting your review:**")
             
+            # Bulk approve: send every selected draft over one SMTP session
+            selected = [e for e in pending_emails
+                        if e['response'] and st.session_state.get(f"select_{e['id']}")]
+            if st.button(f"✅ Approve & send all selected ({len(selected)})",
+                         disabled=not selected, type="primary"):
+                with profiler.profiling(profile_mode(), label="emailpro") as profile:
+                    progress = st.progress(0)
+                    results = st.empty()
+                    sender = get_sender(os.environ.get("EMAIL_ADDRESS"), os.environ.get("EMAIL_PASSWORD"))
+                    # Claim each email first so two reviewers never send the same reply
+                    selected = [e for e in selected
+                                if queue.set_review_status(e['id'], 'sending', expected='pending')]
+                    outgoing = [
+                        (e['from_email'], e['subject'],
+                         st.session_state.get(f"edit_{e['id']}", e['edited_response']))
+                        for e in selected
+                    ]
+                    sent = failed = 0
+                    for index, success, error in sender.send_many(outgoing):
+                        email = selected[index]
+                        log_send(email, success, error)
+                        if success:
+                            queue.set_review_status(email['id'], 'sent', edited_response=outgoing[index][2],
+                                                    sent_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                            sent += 1
+                        else:
+                            queue.set_review_status(email['id'], 'pending')
+                            failed += 1
+                        progress.progress((index + 1) / len(outgoing))
+                        results.caption(f"✉️ {sent} sent, ⚠️ {failed} failed")
+                if profile:
+                    st.caption(f"🔬 Profile written to {profile.output_dir}/")
+                
+                if failed:
+                    st.error(f"❌ {failed} email(s) failed to send — see Recent Sends in the sidebar")
+                else:
+                    st.rerun()
+            
             for idx, email in enumerate(pending_emails):
                 with st.container():
                     # Status indicator
@@ -323,6 +288,8 @@ if st.session_state.emails:
                     # Email header
                     col1, col2 = st.columns([3, 1])
                     with col1:
+                        if email['response']:
+                            st.checkbox("Select for bulk send", key=f"select_{email['id']}")
                         st.markdown(f"### 📧 {email['subject']}")
                         st.caption(f"**From:** {email['from']}")
                     with col2:
@@ -343,6 +310,9 @@ if st.session_state.emails:
                     with st.expander("📄 View Original Email"):
                         st.text(email['body'][:600] + "..." if len(email['body']) > 600 else email['body'])
                     
+                    if email.get('draft_error'):
+                        st.warning(f"⚠️ Drafting stopped early: {email['draft_error']}")
+                    
                     # Drafted response
                     if email['response']:
                         st.markdown("**✍️ AI Drafted Response:**")
@@ -363,29 +333,31 @@ if st.session_state.emails:
                         
                         with col1:
                             if st.button("✅ Approve & Send", key=f"approve_{email['id']}", type="primary"):
-                                with st.spinner("Sending email..."):
+                                if not queue.set_review_status(email['id'], 'sending', expected='pending'):
+                                    st.warning("Another reviewer already handled this email")
+                                    st.rerun()
+                                with profiler.profiling(profile_mode(), label="emailpro"), \
+                                        st.spinner("Sending email..."):
                                     success, error = send_email(
                                         email['from_email'],
                                         email['subject'],
                                         edited_response
                                     )
                                     
+                                    log_send(email, success, error)
                                     if success:
-                                        email['status'] = 'sent'
-                                        st.session_state.sent_log.append({
-                                            'to': email['from_email'],
-                                            'subject': email['subject'],
-                                            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                                        })
+                                        queue.set_review_status(email['id'], 'sent', edited_response=edited_response,
+                                                                sent_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
                                         st.success("✅ Email sent successfully!")
                                         st.balloons()
                                         st.rerun()
                                     else:
+                                        queue.set_review_status(email['id'], 'pending')
                                         st.error(f"❌ Failed to send: {error}")
                         
                         with col2:
                             if st.button("❌ Reject", key=f"reject_{email['id']}"): 
-                                email['status'] = 'rejected'
+                                queue.set_review_status(email['id'], 'rejected', expected='pending')
                                 st.warning("Email rejected")
                                 st.rerun()
                         
@@ -405,7 +377,7 @@ if st.session_state.emails:
                     else:
                         st.info("⏭️ No response needed (spam/no-reply)")
                         if st.button("❌ Mark as Reviewed", key=f"mark_{email['id']}"):
-                            email['status'] = 'rejected'
+                            queue.set_review_status(email['id'], 'rejected', expected='pending')
                             st.rerun()
                     
                     st.markdown('</div>', unsafe_allow_html=True)
@@ -422,7 +394,7 @@ if st.session_state.emails:
             for email in sent_emails:
                 with st.expander(f"✉️ {email['subject']}"):
                     st.markdown(f"**To:** {email['from']}")
-                    st.markdown(f"**Sent:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+                    st.markdown(f"**Sent:** {email.get('sent_at', '')}")
                     st.markdown("**Response Sent:**")
                     st.success(email['edited_response'])
     
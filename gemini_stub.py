@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import batch_inference
+import prompt_budget
+
+# ============================================
+# Stub Gemini Model for Offline Perf Testing
+# ============================================
+#
+# Speaks enough of the Gemini REST API (generateContent,
+# streamGenerateContent with alt=sse, cachedContents) for the agents to
+# run end to end with no network. Answers come from the same keyword rules
+# as the local batch backend. Latency is `latency` to the first byte plus
+# `per_token` per output token, with +/- `jitter` (a fraction), and
+# `error_rate` of requests fail with 429/503 plus a RetryInfo delay, so
+# throughput, retries and time to first chunk can be measured
+# reproducibly (fix `seed`).
+#
+# In-process: GEMINI_TRANSPORT=stub (see llm_transport).
+# As a server: python gemini_stub.py --port 8765, then
+#              GEMINI_BASE_URL=http://127.0.0.1:8765 python gmail_agent.py
+
+DEFAULT_LATENCY = 0.2
+DEFAULT_PER_TOKEN = 0.002
+DEFAULT_JITTER = 0.2
+STREAM_CHUNK_WORDS = 12
+
+_ROUTE = re.compile(r'/(?:v1\w*/)?(?:models/(?P<model>[^:/]+):(?P<method>\w+)|(?P<caches>cachedContents)(?:/(?P<cache_id>[^/]+))?)$')
+_SUBJECT = re.compile(r'^Subject:\s*(.+)$', re.MULTILINE)
+
+def _text(content) -> str:
+    """Text parts of a Content / list of Contents (REST JSON)"""
+    if not content:
+        return ""
+    contents = content if isinstance(content, list) else [content]
+    return "\n".join(part.get('text', '') for item in contents if isinstance(item, dict)
+                     for part in item.get('parts', []))
+
+def _error(code: int, message: str, retry_delay: float = None) -> dict:
+    error = {'code': code, 'message': message,
+             'status': {429: 'RESOURCE_EXHAUSTED', 503: 'UNAVAILABLE', 404: 'NOT_FOUND'}.get(code, 'INTERNAL')}
+    if retry_delay is not None:
+        error['details'] = [{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': f"{retry_delay:g}s"}]
+    return {'error': error}
+
+class StubGemini:
+    """Canned Gemini answers with configurable latency and error injection"""
+
+    def __init__(self, latency: float = DEFAULT_LATENCY, per_token: float = DEFAULT_PER_TOKEN,
+                 jitter: float = DEFAULT_JITTER, error_rate: float = 0.0, error_codes=(429, 503),
+                 retry_delay: float = 1.0, seed: int = None):
+        self.latency = latency
+        self.per_token = per_token
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_codes = tuple(error_codes)
+        self.retry_delay = retry_delay
+        self.stats = {'requests': 0, 'errors': 0, 'caches': 0}
+        self._random = random.Random(seed)
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    # ---------- answers ----------
+
+    def answer(self, request: dict) -> str:
+        """The model's text for a generateContent request body"""
+        instruction = _text(request.get('systemInstruction') or request.get('system_instruction'))
+        cached = request.get('cachedContent') or request.get('cached_content')
+        if cached:
+            instruction = self._caches.get(cached, '')
+        config = request.get('generationConfig') or request.get('generation_config') or {}
+        prompt = _text(request.get('contents'))
+
+        triage_json = batch_inference.keyword_responder({'contents': [{'parts': [{'text': prompt}]}]})
+        if (config.get('responseMimeType') or config.get('response_mime_type')) == 'application/json':
+            return triage_json
+        if 'classify' in (instruction or prompt).lower():
+            result = json.loads(triage_json)
+            return (f"CATEGORY: {result['category']}\nPRIORITY: {result['priority']}\n"
+                    f"SENTIMENT: {result['sentiment']}\nNEEDS_REPLY: {result['needs_reply']}\n"
+                    f"REASON: stub keyword rules")
+        subject = _SUBJECT.search(prompt)
+        topic = f" about \"{subject.group(1).strip()}\"" if subject else ""
+        return (f"Hello,\n\nThank you for your email{topic}. We have received your message and a member "
+                f"of our team is looking into it now.\n\nWe will follow up with a full answer shortly. "
+                f"Please reply to this email if there is anything else we should know.\n\nBest regards")
+
+    def _delay(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + self._random.uniform(-self.jitter, self.jitter)))
+
+    def _response(self, text: str, model: str, prompt_tokens: int, final: bool = True) -> dict:
+        response = {'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}, 'index': 0}],
+                    'modelVersion': model}
+        if final:
+            output_tokens = prompt_budget.count_tokens(text)
+            response['candidates'][0]['finishReason'] = 'STOP'
+            response['usageMetadata'] = {'promptTokenCount': prompt_tokens, 'candidatesTokenCount': output_tokens,
+                                         'totalTokenCount': prompt_tokens + output_tokens}
+        return response
+
+    # ---------- routing ----------
+
+    def handle(self, method: str, path: str, content: bytes) -> dict:
+        """{'status', 'content_type', 'chunks', 'delays'}: sleep delays[i] before sending chunks[i]"""
+        match = _ROUTE.search(path)
+        try:
+            request = json.loads(content) if content else {}
+        except ValueError:
+            request = {}
+
+        if match is None:
+            return self._json(404, _error(404, f"stub has no route for {method} {path}"), 0.0)
+        if match.group('caches'):
+            return self._cache(method, match.group('cache_id'), request)
+
+        with self._lock:
+            self.stats['requests'] += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.stats['errors'] += 1
+                code = self._random.choice(self.error_codes)
+            first_byte = self._delay(self.latency)
+        if failed:
+            return self._json(code, _error(code, "stub: injected failure", self.retry_delay), first_byte)
+
+        model = match.group('model')
+        text = self.answer(request)
+        prompt_tokens = prompt_budget.count_tokens(_text(request.get('contents')))
+        generation = self._delay(self.per_token * prompt_budget.count_tokens(text))
+
+        if match.group('method') != 'streamGenerateContent':
+            return self._json(200, self._response(text, model, prompt_tokens), first_byte + generation)
+
+        words = text.split(' ')
+        pieces = [' '.join(words[i:i + STREAM_CHUNK_WORDS]) + (' ' if i + STREAM_CHUNK_WORDS < len(words) else '')
+                  for i in range(0, len(words), STREAM_CHUNK_WORDS)]
+        chunks = [f"data: {json.dumps(self._response(piece, model, prompt_tokens, i == len(pieces) - 1))}\r\n\r\n"
+                  .encode('utf-8') for i, piece in enumerate(pieces)]
+        delays = [first_byte] + [generation / len(pieces)] * (len(pieces) - 1)
+        return {'status': 200, 'content_type': 'text/event-stream', 'chunks': chunks, 'delays': delays}
+
+    def _cache(self, method: str, cache_id: str, request: dict) -> dict:
+        if method == 'DELETE':
+            with self._lock:
+                self._caches.pop(f"cachedContents/{cache_id}", None)
+            return self._json(200, {}, 0.0)
+        with self._lock:
+            self.stats['caches'] += 1
+            name = f"cachedContents/stub-{self.stats['caches']:06d}"
+            self._caches[name] = _text(request.get('systemInstruction') or request.get('system_instruction'))
+        expires = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + 3600))
+        return self._json(200, {'name': name, 'model': request.get('model', ''), 'expireTime': expires}, 0.0)
+
+    @staticmethod
+    def _json(status: int, body: dict, delay: float) -> dict:
+        return {'status': status, 'content_type': 'application/json',
+                'chunks': [json.dumps(body).encode('utf-8')], 'delays': [delay]}
+
+    def summary(self) -> str:
+        s = self.stats
+        return f"{s['requests']} request(s), {s['errors']} injected failure(s), {s['caches']} cache(s)"
+
+def from_env() -> StubGemini:
+    """StubGemini from GEMINI_STUB_LATENCY / _PER_TOKEN / _JITTER / _ERROR_RATE / _RETRY_DELAY / _SEED"""
+    seed = os.environ.get("GEMINI_STUB_SEED")
+    return StubGemini(
+        latency=float(os.environ.get("GEMINI_STUB_LATENCY", DEFAULT_LATENCY)),
+        per_token=float(os.environ.get("GEMINI_STUB_PER_TOKEN", DEFAULT_PER_TOKEN)),
+        jitter=float(os.environ.get("GEMINI_STUB_JITTER", DEFAULT_JITTER)),
+        error_rate=float(os.environ.get("GEMINI_STUB_ERROR_RATE", 0.0)),
+        retry_delay=float(os.environ.get("GEMINI_STUB_RETRY_DELAY", 1.0)),
+        seed=int(seed) if seed else None
+    )
+
+# ============================================
+# HTTP Server
+# ============================================
+
+def make_server(stub: StubGemini, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """A threading HTTP server answering from `stub` (port 0 picks a free one)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _handle(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            reply = stub.handle(self.command, self.path.split('?', 1)[0], self.rfile.read(length))
+            streaming = len(reply['chunks']) > 1 or reply['content_type'] == 'text/event-stream'
+            time.sleep(reply['delays'][0])
+            self.send_response(reply['status'])
+            self.send_header('Content-Type', reply['content_type'])
+            if streaming:
+                self.send_header('Transfer-Encoding', 'chunked')
+            else:
+                self.send_header('Content-Length', str(len(reply['chunks'][0])))
+            self.end_headers()
+            for i, chunk in enumerate(reply['chunks']):
+                if i:
+                    time.sleep(reply['delays'][i])
+                if streaming:
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode('ascii') + chunk + b"\r\n")
+                else:
+                    self.wfile.write(chunk)
+                self.wfile.flush()
+            if streaming:
+                self.wfile.write(b"0\r\n\r\n")
+
+        do_POST = do_GET = do_DELETE = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Gemini API server for offline perf testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY,
+                        help="seconds to the first byte of each response")
+    parser.add_argument("--per-token", type=float, default=DEFAULT_PER_TOKEN,
+                        help="extra seconds per output token")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER,
+                        help="random +/- fraction applied to every delay")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with 429/503")
+    parser.add_argument("--retry-delay", type=float, default=1.0,
+                        help="RetryInfo delay (seconds) sent with injected failures")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    stub = StubGemini(args.latency, args.per_token, args.jitter, args.error_rate,
+                      retry_delay=args.retry_delay, seed=args.seed)
+    server = make_server(stub, args.host, args.port)
+    print(f"🧪 Stub Gemini listening on http://{args.host}:{server.server_port} "
+          f"(latency {args.latency}s, error rate {args.error_rate:.0%})")
+    print(f"   Point the agents at it with GEMINI_BASE_URL=http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n🛑 {stub.summary()}")
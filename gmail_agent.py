@@ -1,31 +1,56 @@
-from google import genai
 from imapclient import IMAPClient
-import email
-from email import policy
 import os
 from dotenv import load_dotenv
 from datetime import datetime
+import triage
+import batch_inference
+import argparse
+import random
+import itertools
+import time
+import llm
+import imap_fetch
+import header_rules
+import local_classifier
+import near_dup
+import thread_index
+import prompt_budget
+import profiles
+import telemetry
+import profiler
 
 load_dotenv()
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+client = llm.LazyClient()
 
 # ============================================
 # Gmail IMAP Connection
 # ============================================
 
+IDLE_REFRESH_SECONDS = 29 * 60  # RFC 2177: servers may drop IDLE after 30 minutes
+IDLE_CHECK_SECONDS = 30
+MAX_RECONNECT_BACKOFF = 300
+
 class GmailAgent:
     def __init__(self, email_address, app_password):
         """Initialize Gmail IMAP connection"""
+        self.email_address = email_address
+        self.app_password = app_password
+        self.imap = None
+        self.connect()
+    
+    def connect(self):
+        """Log in and select INBOX"""
         print(f"🔌 Connecting to Gmail...")
         
         try:
-            self.imap = IMAPClient('imap.gmail.com', use_uid=True, ssl=True)
-            self.imap.login(email_address, app_password)
-            print(f"✅ Logged in as: {email_address}")
-            
-            # Select inbox
-            self.imap.select_folder('INBOX')
-            print("✅ Connected to INBOX")
+            with telemetry.span('imap.connect'):
+                self.imap = IMAPClient('imap.gmail.com', use_uid=True, ssl=True)
+                self.imap.login(self.email_address, self.app_password)
+                print(f"✅ Logged in as: {self.email_address}")
+                
+                # Select inbox
+                self.imap.select_folder('INBOX')
+                print("✅ Connected to INBOX")
             
         except Exception as e:
             print(f"❌ Login failed: {e}")
@@ -35,58 +60,27 @@ class GmailAgent:
             print("3. Enable 2-Step Verification first")
             raise
     
-    def get_unread_emails(self, limit=10):
-        """Get unread emails from Gmail"""
-        print(f"\n📬 Fetching unread emails (limit: {limit})...")
+    def get_unread_emails(self, limit=10, chunk_size=imap_fetch.DEFAULT_CHUNK_SIZE, commit=True):
+        """Get unread emails from Gmail.
+        
+        Returns a stream that fetches `chunk_size` messages at a time while
+        the previous chunk is being processed; len() gives the total. With
+        commit=False the sync checkpoint is left to the caller (see
+        imap_fetch.UnreadMessages.commit).
+        """
+        print(f"\n📬 Fetching unread emails (limit: {limit or 'none'})...")
         
         try:
-            # Search for unread emails
-            messages = self.imap.search(['UNSEEN'])
+            # Unread emails new since the last checkpoint
+            emails = imap_fetch.UnreadMessages(
+                self.imap, self.email_address,
+                limit=limit, chunk_size=chunk_size, max_chars=2000, commit=commit
+            )
             
-            if not messages:
+            if not emails:
                 print("✅ No unread emails found")
-                return []
-            
-            # Limit results
-            messages = messages[:limit]
-            
-            print(f"✅ Found {len(messages)} unread email(s)")
-            
-            # Fetch email data
-            emails = []
-            raw_messages = self.imap.fetch(messages, ['RFC822'])
-            
-            for msg_id, data in raw_messages.items():
-                email_message = email.message_from_bytes(
-                    data[b'RFC822'],
-                    policy=policy.default
-                )
-                
-                # Extract body
-                body = ""
-                if email_message.is_multipart():
-                    for part in email_message.walk():
-                        if part.get_content_type() == "text/plain":
-                            try:
-                                body = part.get_payload(decode=True).decode('utf-8', errors='ignore')
-                                break
-                            except:
-                                pass
-                else:
-                    try:
-                        body = email_message.get_payload(decode=True).decode('utf-8', errors='ignore')
-                    except:
-                        body = str(email_message.get_payload())
-                
-                email_data = {
-                    'id': msg_id,
-                    'from': str(email_message['From']),
-                    'subject': str(email_message['Subject']) or "(No Subject)",
-                    'date': str(email_message['Date']),
-                    'body': body[:2000]  # Limit length
-                }
-                
-                emails.append(email_data)
+            else:
+                print(f"✅ Found {len(emails)} unread email(s)")
             
             return emails
             
@@ -94,6 +88,79 @@ class GmailAgent:
             print(f"❌ Error fetching emails: {e}")
             return []
     
+    def watch(self, on_email, idle_refresh=IDLE_REFRESH_SECONDS):
+        """Hold the connection open and call on_email for each new unread email.
+        
+        Uses IMAP IDLE so the server wakes us when mail arrives. IDLE is
+        re-issued every `idle_refresh` seconds to keep the session alive, and
+        a dropped connection is re-established with exponential backoff.
+        Runs until interrupted.
+        """
+        backoff = 1
+        
+        while True:
+            try:
+                if self.imap is None:
+                    self.connect()
+                
+                # Catch up on anything that arrived while we were disconnected
+                self._dispatch_new(on_email)
+                backoff = 1
+                
+                while True:
+                    print(f"\n💤 Waiting for new mail (IDLE)...")
+                    if self._idle(idle_refresh):
+                        self._dispatch_new(on_email)
+                    else:
+                        # Refresh: NOOP keeps the session warm between IDLE commands
+                        self.imap.noop()
+            
+            except KeyboardInterrupt:
+                raise
+            except Exception as e:
+                print(f"\n⚠️  Connection lost: {e}")
+                self._drop_connection()
+                delay = backoff * random.uniform(0.5, 1.5)
+                print(f"🔁 Reconnecting in {delay:.1f}s...")
+                time.sleep(delay)
+                backoff = min(backoff * 2, MAX_RECONNECT_BACKOFF)
+    
+    def _idle(self, idle_refresh):
+        """IDLE until the mailbox reports new messages or idle_refresh elapses"""
+        deadline = time.monotonic() + idle_refresh
+        self.imap.idle()
+        try:
+            while time.monotonic() < deadline:
+                remaining = deadline - time.monotonic()
+                responses = self.imap.idle_check(timeout=min(IDLE_CHECK_SECONDS, max(remaining, 0.1)))
+                if any(len(r) > 1 and r[1] in (b'EXISTS', b'RECENT') for r in responses):
+                    return True
+            return False
+        finally:
+            self.imap.idle_done()
+    
+    def _dispatch_new(self, on_email):
+        """Fetch unread UIDs new since the checkpoint and hand each one to on_email.
+        
+        A message whose on_email raised stays out of the checkpoint and is
+        fetched again by the next sync.
+        """
+        messages = imap_fetch.UnreadMessages(self.imap, self.email_address, max_chars=2000)
+        for email_data in messages:
+            try:
+                on_email(email_data)
+            except Exception as e:
+                print(f"❌ Failed to process {email_data['subject'][:50]}: {e} (retried on the next sync)")
+                messages.retry_later(email_data['id'])
+    
+    def _drop_connection(self):
+        """Discard a broken connection without raising"""
+        try:
+            self.imap.shutdown()
+        except Exception:
+            pass
+        self.imap = None
+    
     def close(self):
         """Close connection"""
         try:
@@ -106,16 +173,8 @@ class GmailAgent:
 # AI Classification
 # ============================================
 
-def classify_email(email_data):
-    """Classify email"""
-    print(f"\n🤖 Analyzing: {email_data['subject'][:50]}...")
-    
-    classification_prompt = f"""
-Analyze and classify this email.
-
-From: {email_data['from']}
-Subject: {email_data['subject']}
-Body: {email_data['body'][:800]}
+CLASSIFICATION_INSTRUCTION = """
+Analyze and classify each email.
 
 Provide:
 CATEGORY: [urgent/spam/customer_support/general_inquiry/internal/promotional]
@@ -123,11 +182,34 @@ PRIORITY: [high/medium/low]
 SENTIMENT: [positive/neutral/negative]
 NEEDS_REPLY: [yes/no]
 REASON: [brief explanation]
+"""
+
+DRAFT_INSTRUCTION = """
+Draft a professional email response to each email.
+
+Requirements:
+- Use the tone given with the email
+- 2-3 concise paragraphs
+- Include greeting and closing
+- Professional and clear
+"""
+
+def classify_email(email_data):
+    """Classify email"""
+    print(f"\n🤖 Analyzing: {email_data['subject'][:50]}...")
+    
+    classification_prompt = f"""
+From: {email_data['from']}
+Subject: {email_data['subject']}
+Body: {prompt_budget.fit_body(email_data, 'classify')}
 """
     
-    response = client.models.generate_content(
+    response = llm.generate_content(
+        client,
         model="models/gemini-2.5-flash",
-        contents=classification_prompt
+        contents=classification_prompt,
+        instruction=CLASSIFICATION_INSTRUCTION,
+        profile='classify'
     )
     
     result_text = response.text
@@ -169,57 +251,187 @@ REASON: [brief explanation]
     
     return classification
 
-def draft_response(email_data, classification):
-    """Draft professional response"""
-    if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
-        return None
-    
+def build_draft_prompt(email_data, classification):
     tone = "professional and helpful"
     if classification['priority'] == 'high':
         tone = "immediate and solution-focused"
     elif classification['sentiment'] == 'negative':
         tone = "empathetic and reassuring"
     
-    draft_prompt = f"""
-Draft a professional email response.
-
+    return f"""
 Original Email:
 From: {email_data['from']}
 Subject: {email_data['subject']}
-Body: {email_data['body'][:600]}
-
+Body: {prompt_budget.fit_body(email_data, 'draft')}
+{thread_index.format_context(email_data)}
 Context:
 - Category: {classification['category']}
 - Priority: {classification['priority']}
 - Sentiment: {classification['sentiment']}
-
-Requirements:
 - Tone: {tone}
-- 2-3 concise paragraphs
-- Include greeting and closing
-- Professional and clear
 
 Draft the response:
 """
+
+def draft_response(email_data, classification):
+    """Draft professional response"""
+    if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
+        return None
     
-    response = client.models.generate_content(
+    response = llm.generate_content(
+        client,
         model="models/gemini-2.5-flash",
-        contents=draft_prompt
+        contents=build_draft_prompt(email_data, classification),
+        instruction=DRAFT_INSTRUCTION,
+        profile='draft'
     )
     
     return response.text
 
+def draft_response_stream(email_data, classification):
+    """Draft professional response, yielded in chunks as it is generated"""
+    return llm.generate_content_stream(
+        client,
+        model="models/gemini-2.5-flash",
+        contents=build_draft_prompt(email_data, classification),
+        instruction=DRAFT_INSTRUCTION,
+        profile='draft'
+    )
+
 # ============================================
 # Main Processing
 # ============================================
 
-def process_gmail():
-    """Main function to process Gmail"""
-    print("="*80)
-    print("🤖 GMAIL AUTO-RESPONDER AGENT")
-    print("="*80)
+@telemetry.traced('file.write')
+def save_gmail_response(idx, email_data, classification, response_text, echo=False):
+    """Write a drafted reply to responses/.
+    
+    response_text may also be an iterable of chunks from a streaming draft;
+    each chunk is written (and printed, with echo=True) as soon as it arrives.
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"responses/gmail_{timestamp}_{idx}.txt"
+    chunks = [response_text] if isinstance(response_text, str) else response_text
+    
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write(f"TO: {email_data['from']}\n")
+        f.write(f"RE: {email_data['subject']}\n")
+        f.write(f"CLASSIFICATION: {classification['category']}\n")
+        f.write(f"PRIORITY: {classification['priority']}\n")
+        f.write(f"SENTIMENT: {classification['sentiment']}\n")
+        f.write(f"{'='*80}\n\n")
+        for chunk in chunks:
+            f.write(chunk)
+            f.flush()
+            if echo:
+                print(chunk, end='', flush=True)
+    
+    print(f"\n💾 Saved to: {filename}")
+    return filename
+
+def handle_result(idx, total, email_data, classification, draft):
+    """Report one classified email and save its draft.
+    
+    draft is the reply text, or an iterator of chunks when streaming, in
+    which case the reply is printed and written to its file as it arrives.
+    """
+    print(f"\n{'='*80}")
+    print(f"📧 EMAIL {idx}/{total}")
+    print(f"{'='*80}")
+    print(f"From: {email_data['from']}")
+    print(f"Subject: {email_data['subject']}")
+    print(f"Preview: {email_data['body'][:100]}...")
+    
+    print(f"\n📊 CLASSIFICATION:")
+    print(f"   Category: {classification['category'].upper()}")
+    print(f"   Priority: {classification['priority'].upper()}")
+    print(f"   Sentiment: {classification['sentiment'].upper()}")
+    print(f"   Needs Reply: {classification['needs_reply'].upper()}")
+    if classification['reason']:
+        print(f"   Reason: {classification['reason']}")
+    
+    # Draft response
+    response_text = None
+    saved_to = None
+    if classification['needs_reply'] == 'yes' and classification['category'] != 'spam':
+        print(f"\n✍️  DRAFTING RESPONSE...")
+        response_text = draft
+        
+        print(f"\n{'─'*80}")
+        if response_text is not None and not isinstance(response_text, str):
+            saved_to = save_gmail_response(idx, email_data, classification, response_text, echo=True)
+            response_text = None
+        else:
+            print(response_text)
+        print(f"{'─'*80}")
+        
+        needs_review = classification['priority'] == 'high' or classification['category'] == 'urgent'
+        print(f"\n🚦 Needs Human Review: {'YES ⚠️' if needs_review else 'NO ✅'}")
+    else:
+        print(f"\n⏭️  No response needed")
+    
+    # Save to file
+    if response_text:
+        saved_to = save_gmail_response(idx, email_data, classification, response_text)
     
-    # Get credentials
+    # Keep only the file path so long runs don't hold every draft in memory
+    return {
+        'from': email_data['from'],
+        'subject': email_data['subject'],
+        'classification': classification,
+        'saved_to': saved_to
+    }
+
+def print_gmail_summary(results):
+    """Summary report by category, priority and sentiment"""
+    print(f"\n{'='*80}")
+    print("📊 PROCESSING SUMMARY")
+    print(f"{'='*80}")
+    print(f"Total Processed: {len(results)}")
+    print(f"Responses Drafted: {sum(1 for r in results if r['saved_to'])}")
+    print(f"LLM Cache: {llm.cache_summary()}")
+    print(f"LLM Calls: {llm.rate_limit_summary()}")
+    print(f"LLM Transport: {llm.transport_summary()}")
+    print(f"Static Instructions: {llm.context_cache_summary()}")
+    print(f"Prompt Bodies: {prompt_budget.summary()}")
+    print(f"Generation: {llm.profile_summary()}")
+    print(f"Header Rules: {header_rules.summary()}")
+    print(f"Local Classifier: {local_classifier.summary()}")
+    print(f"Near-Duplicates: {near_dup.summary()}")
+    print(f"Threads: {thread_index.summary()}")
+    print(f"Stages: {llm.stage_summary()}")
+    
+    categories = {}
+    priorities = {}
+    sentiments = {}
+    
+    for r in results:
+        cat = r['classification']['category']
+        pri = r['classification']['priority']
+        sent = r['classification']['sentiment']
+        
+        categories[cat] = categories.get(cat, 0) + 1
+        priorities[pri] = priorities.get(pri, 0) + 1
+        sentiments[sent] = sentiments.get(sent, 0) + 1
+    
+    print(f"\n📂 By Category:")
+    for cat, count in sorted(categories.items()):
+        print(f"   {cat:<20} {count}")
+    
+    print(f"\n⚡ By Priority:")
+    for pri in ['high', 'medium', 'low']:
+        if pri in priorities:
+            print(f"   {pri:<20} {priorities[pri]}")
+    
+    print(f"\n😊 By Sentiment:")
+    for sent in ['positive', 'neutral', 'negative']:
+        if sent in sentiments:
+            print(f"   {sent:<20} {sentiments[sent]}")
+    
+    print("\n✅ PROCESSING COMPLETE!")
+
+def get_credentials():
+    """Read EMAIL_ADDRESS / EMAIL_PASSWORD, explaining what to set if missing"""
     email_address = os.environ.get("EMAIL_ADDRESS")
     email_password = os.environ.get("EMAIL_PASSWORD")
     
@@ -229,14 +441,34 @@ def process_gmail():
         print("EMAIL_ADDRESS=your.email@gmail.com")
         print("EMAIL_PASSWORD=your-16-char-app-password")
         print("IMAP_SERVER=imap.gmail.com")
+        return None
+    
+    return email_address, email_password
+
+@telemetry.traced('process_gmail')
+def process_gmail(limit=5, batch_backend=None, poll_interval=30, chunk_size=imap_fetch.DEFAULT_CHUNK_SIZE,
+                  stream=False):
+    """Main function to process Gmail.
+    
+    With batch_backend set ('gemini' or 'local'), every fetched message is
+    triaged in a single batch job instead of one call per message. With
+    stream=True each draft is printed and saved token by token.
+    """
+    print("="*80)
+    print("🤖 GMAIL AUTO-RESPONDER AGENT")
+    print("="*80)
+    
+    credentials = get_credentials()
+    if not credentials:
         return
     
     # Connect to Gmail
-    agent = GmailAgent(email_address, email_password)
+    agent = GmailAgent(*credentials)
     
     try:
         # Get unread emails
-        emails = agent.get_unread_emails(limit=5)
+        # A batch run commits the checkpoint itself, once results are in
+        emails = agent.get_unread_emails(limit=limit, chunk_size=chunk_size, commit=not batch_backend)
         
         if not emails:
             print("\n✅ No unread emails to process!")
@@ -247,107 +479,119 @@ def process_gmail():
         
         results = []
         
-        for idx, email_data in enumerate(emails, 1):
-            print(f"\n{'='*80}")
-            print(f"📧 EMAIL {idx}/{len(emails)}")
-            print(f"{'='*80}")
-            print(f"From: {email_data['from']}")
-            print(f"Subject: {email_data['subject']}")
-            print(f"Preview: {email_data['body'][:100]}...")
-            
-            # Classify
-            classification = classify_email(email_data)
-            
-            print(f"\n📊 CLASSIFICATION:")
-            print(f"   Category: {classification['category'].upper()}")
-            print(f"   Priority: {classification['priority'].upper()}")
-            print(f"   Sentiment: {classification['sentiment'].upper()}")
-            print(f"   Needs Reply: {classification['needs_reply'].upper()}")
-            if classification['reason']:
-                print(f"   Reason: {classification['reason']}")
-            
-            # Draft response
-            response_text = None
-            if classification['needs_reply'] == 'yes' and classification['category'] != 'spam':
-                print(f"\n✍️  DRAFTING RESPONSE...")
-                response_text = draft_response(email_data, classification)
-                
-                print(f"\n{'─'*80}")
-                print(response_text)
-                print(f"{'─'*80}")
-                
-                needs_review = classification['priority'] == 'high' or classification['category'] == 'urgent'
-                print(f"\n🚦 Needs Human Review: {'YES ⚠️' if needs_review else 'NO ✅'}")
-            else:
-                print(f"\n⏭️  No response needed")
-            
-            # Save result
-            result = {
-                'from': email_data['from'],
-                'subject': email_data['subject'],
-                'classification': classification,
-                'response': response_text
-            }
-            results.append(result)
-            
-            # Save to file
-            if response_text:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"responses/gmail_{timestamp}_{idx}.txt"
-                
-                with open(filename, 'w', encoding='utf-8') as f:
-                    f.write(f"TO: {email_data['from']}\n")
-                    f.write(f"RE: {email_data['subject']}\n")
-                    f.write(f"CLASSIFICATION: {classification['category']}\n")
-                    f.write(f"PRIORITY: {classification['priority']}\n")
-                    f.write(f"SENTIMENT: {classification['sentiment']}\n")
-                    f.write(f"{'='*80}\n\n")
-                    f.write(response_text)
-                
-                print(f"\n💾 Saved to: {filename}")
-        
-        # Summary report
-        print(f"\n{'='*80}")
-        print("📊 PROCESSING SUMMARY")
-        print(f"{'='*80}")
-        print(f"Total Processed: {len(results)}")
-        print(f"Responses Drafted: {sum(1 for r in results if r['response'])}")
-        
-        categories = {}
-        priorities = {}
-        sentiments = {}
-        
-        for r in results:
-            cat = r['classification']['category']
-            pri = r['classification']['priority']
-            sent = r['classification']['sentiment']
-            
-            categories[cat] = categories.get(cat, 0) + 1
-            priorities[pri] = priorities.get(pri, 0) + 1
-            sentiments[sent] = sentiments.get(sent, 0) + 1
-        
-        print(f"\n📂 By Category:")
-        for cat, count in sorted(categories.items()):
-            print(f"   {cat:<20} {count}")
+        if batch_backend:
+            unread, emails = emails, list(emails)
+            print(f"\n📦 Submitting {len(emails)} email(s) as one batch job...")
+            backend = batch_inference.get_backend(batch_backend, client)
+            triaged = batch_inference.run_batch(
+                backend, {str(e['id']): e for e in emails}, poll_interval
+            )
+            handled = []
+            for idx, email_data in enumerate(emails, 1):
+                result = triaged.get(str(email_data['id']))
+                if result is None:
+                    print(f"\n❌ No batch result for: {email_data['subject'][:50]}")
+                    continue
+                with telemetry.span('process_message', uid=email_data['id']):
+                    results.append(handle_result(idx, len(emails), email_data, *result))
+                handled.append(email_data['id'])
+            # Messages without a result stay unsynced and go into the next run
+            unread.commit(handled)
+        else:
+            for idx, email_data in enumerate(emails, 1):
+                with telemetry.span('process_message', uid=email_data['id']):
+                    # Classify (and draft, in combined mode)
+                    if stream:
+                        classification, draft = triage.classify_and_draft_stream(
+                            client, email_data, classify_email, draft_response_stream
+                        )
+                    else:
+                        classification, draft = triage.classify_and_draft(
+                            client, email_data, classify_email, draft_response
+                        )
+                    results.append(handle_result(idx, len(emails), email_data, classification, draft))
         
-        print(f"\n⚡ By Priority:")
-        for pri in ['high', 'medium', 'low']:
-            if pri in priorities:
-                print(f"   {pri:<20} {priorities[pri]}")
-        
-        print(f"\n😊 By Sentiment:")
-        for sent in ['positive', 'neutral', 'negative']:
-            if sent in sentiments:
-                print(f"   {sent:<20} {sentiments[sent]}")
-        
-        print("\n✅ PROCESSING COMPLETE!")
+        print_gmail_summary(results)
         
     finally:
         agent.close()
 
+def watch_gmail(idle_refresh=IDLE_REFRESH_SECONDS):
+    """Daemon mode: classify and draft each new email as soon as it arrives"""
+    print("="*80)
+    print("🤖 GMAIL AUTO-RESPONDER AGENT (daemon)")
+    print("="*80)
+    
+    credentials = get_credentials()
+    if not credentials:
+        return
+    
+    agent = GmailAgent(*credentials)
+    os.makedirs('responses', exist_ok=True)
+    counter = itertools.count(1)
+    
+    @telemetry.traced('process_message')
+    def on_email(email_data):
+        classification, draft = triage.classify_and_draft(
+            client, email_data, classify_email, draft_response
+        )
+        idx = next(counter)
+        handle_result(idx, idx, email_data, classification, draft)
+    
+    try:
+        agent.watch(on_email, idle_refresh=idle_refresh)
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping daemon")
+    finally:
+        agent.close()
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gmail auto-responder agent")
+    parser.add_argument("--limit", type=int, default=5,
+                        help="max unread emails to fetch (0 = all)")
+    parser.add_argument("--chunk-size", type=int, default=imap_fetch.DEFAULT_CHUNK_SIZE,
+                        help="messages per IMAP FETCH; the next chunk is fetched while one is processed")
+    parser.add_argument("--batch", action="store_true",
+                        help="triage all fetched emails as one batch inference job")
+    parser.add_argument("--batch-backend", choices=["gemini", "local"],
+                        default=os.environ.get("EMAIL_AGENT_BATCH_BACKEND", "gemini"),
+                        help="'local' runs the batch offline with keyword rules")
+    parser.add_argument("--poll-interval", type=float, default=None,
+                        help="seconds between batch job status checks")
+    parser.add_argument("--stream", action=argparse.BooleanOptionalAction,
+                        default=triage.streaming_enabled(),
+                        help="print and save each draft as it is generated (EMAIL_AGENT_STREAM=0 turns it off)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="stay connected and process new mail as it arrives (IMAP IDLE)")
+    parser.add_argument("--idle-refresh", type=float, default=IDLE_REFRESH_SECONDS,
+                        help="seconds before IDLE is re-issued in daemon mode")
+    parser.add_argument("--generation", choices=list(profiles.PRESETS), default=profiles.get_preset(),
+                        help="per-stage model / thinking budget / output cap preset (GENERATION_PRESET)")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT") or 0),
+                        help="serve Prometheus metrics on this port at /metrics (0 = off)")
+    parser.add_argument("--trace", choices=list(telemetry.TRACE_FORMATS),
+                        default=os.environ.get("TRACE_EXPORT", "none"),
+                        help="append a span per stage to TRACE_PATH as JSON or OTLP/JSON lines")
+    parser.add_argument("--profile", nargs="?", const="all", choices=list(profiler.MODES),
+                        help="sample CPU per stage and/or trace allocations (default: both); "
+                             "flamegraph-ready files go to profiling/")
+    args = parser.parse_args()
+    profiles.set_preset(args.generation)
+    telemetry.configure_tracing(args.trace)
+    telemetry.serve(args.metrics_port)
+    
     try:
-        process_gmail()
+        with profiler.profiling(args.profile, label="gmail_agent"):
+            if args.daemon:
+                watch_gmail(idle_refresh=args.idle_refresh)
+            else:
+                process_gmail(
+                    limit=args.limit or None,
+                    batch_backend=args.batch_backend if args.batch else None,
+                    poll_interval=args.poll_interval or (1 if args.batch_backend == "local" else 30),
+                    chunk_size=args.chunk_size,
+                    stream=args.stream
+                )
     except Exception as e:
         print(f"\n❌ Error: {e}")
         import traceback
@@ -0,0 +1,108 @@
+import json
+import os
+import re
+
+# ============================================
+# Header-Only Triage Rules
+# ============================================
+#
+# Newsletters, auto-replies, bounces and list traffic can be recognised
+# from a handful of headers. Matching messages are classified here and
+# never reach the body fetch or the LLM.
+
+# Each rule matches when `header` is present (pattern None) or matches
+# `pattern` (case-insensitive regex search). First match wins.
+DEFAULT_RULES = [
+    {'name': 'bounce', 'header': 'Return-Path', 'pattern': r'^\s*<>\s*$',
+     'category': 'spam', 'reason': 'delivery status notification'},
+    {'name': 'mailer-daemon', 'header': 'From', 'pattern': r'\b(mailer-daemon|postmaster)@',
+     'category': 'spam', 'reason': 'delivery status notification'},
+    {'name': 'auto-submitted', 'header': 'Auto-Submitted', 'pattern': r'^\s*(?!no\b)\S',
+     'category': 'general_inquiry', 'reason': 'automatic reply or notification'},
+    {'name': 'x-autoreply', 'header': 'X-Autoreply', 'pattern': None,
+     'category': 'general_inquiry', 'reason': 'automatic reply'},
+    {'name': 'x-autorespond', 'header': 'X-Autorespond', 'pattern': None,
+     'category': 'general_inquiry', 'reason': 'automatic reply'},
+    {'name': 'bulk-precedence', 'header': 'Precedence', 'pattern': r'\b(bulk|list|junk)\b',
+     'category': 'spam', 'reason': 'bulk mail'},
+    {'name': 'list-unsubscribe', 'header': 'List-Unsubscribe', 'pattern': None,
+     'category': 'spam', 'reason': 'newsletter or marketing list'},
+    {'name': 'mailing-list', 'header': 'List-Id', 'pattern': None,
+     'category': 'general_inquiry', 'reason': 'mailing list traffic'},
+    {'name': 'no-reply-sender', 'header': 'From',
+     'pattern': r'\b(no-?reply|do-?not-?reply|donotreply|notifications?|alerts?)@',
+     'category': 'general_inquiry', 'reason': 'sent from a no-reply address'},
+]
+
+def rules_enabled() -> bool:
+    """Header rules are on unless HEADER_RULES_DISABLED=1"""
+    return os.environ.get("HEADER_RULES_DISABLED", "").lower() not in ("1", "true", "yes")
+
+class HeaderRules:
+    """Compiled rule list plus counters of how many messages it settled"""
+
+    def __init__(self, rules: list = None):
+        self.rules = []
+        for rule in rules if rules is not None else DEFAULT_RULES:
+            pattern = rule.get('pattern')
+            self.rules.append(dict(rule, regex=re.compile(pattern, re.IGNORECASE) if pattern else None))
+        self.stats = {'checked': 0, 'matched': 0}
+
+    def fields(self) -> list:
+        """Header names the rules read, for the IMAP header fetch"""
+        return sorted({rule['header'].upper() for rule in self.rules})
+
+    def match(self, headers):
+        """Return the first rule matching a Message-like `headers`, or None"""
+        self.stats['checked'] += 1
+        for rule in self.rules:
+            value = headers.get(rule['header'])
+            if value is None:
+                continue
+            if rule['regex'] is None or rule['regex'].search(str(value)):
+                self.stats['matched'] += 1
+                return rule
+        return None
+
+    def classify(self, headers):
+        """Classification dict for a message settled by headers alone, else None"""
+        rule = self.match(headers)
+        if rule is None:
+            return None
+        return {
+            'category': rule.get('category', 'spam'),
+            'priority': rule.get('priority', 'low'),
+            'sentiment': 'neutral',
+            'needs_reply': 'no',
+            'reason': f"header rule '{rule['name']}': {rule.get('reason', '')}".strip(': '),
+            'rule': rule['name']
+        }
+
+    def summary(self) -> str:
+        """One-line report of LLM calls avoided"""
+        checked, matched = self.stats['checked'], self.stats['matched']
+        rate = (matched / checked * 100) if checked else 0.0
+        return f"{matched}/{checked} settled from headers ({rate:.0f}%), no LLM call"
+
+_rules = None
+
+def get_rules():
+    """Process-wide rules; HEADER_RULES_PATH points at a JSON list replacing DEFAULT_RULES.
+
+    Returns None when rules are disabled.
+    """
+    global _rules
+    if not rules_enabled():
+        return None
+    if _rules is None:
+        path = os.environ.get("HEADER_RULES_PATH")
+        if path:
+            with open(path, encoding='utf-8') as f:
+                _rules = HeaderRules(json.load(f))
+        else:
+            _rules = HeaderRules()
+    return _rules
+
+def summary() -> str:
+    rules = get_rules()
+    return rules.summary() if rules else "disabled"
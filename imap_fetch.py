@@ -0,0 +1,355 @@
+import contextvars
+import queue
+import threading
+from email import policy
+from email.parser import BytesHeaderParser
+import header_rules
+import local_classifier
+import mailbox_sync
+import mime_extract
+import telemetry
+import thread_index
+
+# ============================================
+# Structure-Aware Partial IMAP Fetch
+# ============================================
+
+HEADER_FIELDS = ['FROM', 'SUBJECT', 'DATE', 'MESSAGE-ID']
+HEADER_ITEM = f"BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})]"
+THREAD_HEADER_ITEM = "BODY.PEEK[HEADER.FIELDS (MESSAGE-ID IN-REPLY-TO REFERENCES)]"
+THREAD_FETCH_SIZE = 500
+DEFAULT_MAX_CHARS = 2000
+
+def header_item(rules=None) -> str:
+    """HEADER.FIELDS fetch item covering the base fields plus those the rules read"""
+    if rules is None:
+        return HEADER_ITEM
+    fields = HEADER_FIELDS + [f for f in rules.fields() if f not in HEADER_FIELDS]
+    return f"BODY.PEEK[HEADER.FIELDS ({' '.join(fields)})]"
+
+def find_text_section(structure, prefix=''):
+    """Return (section, encoding, charset, subtype) of the best text part in a BODYSTRUCTURE.
+
+    Prefers the first text/plain part, then the first other text/* part.
+    Attachments (Content-Disposition: attachment) and nested
+    message/rfc822 parts are skipped. Returns None when there is no text.
+    """
+    plain, fallback = _walk_structure(structure, prefix)
+    return plain or fallback
+
+def _walk_structure(node, prefix):
+    if isinstance(node[0], list):
+        # multipart: ([part, part, ...], b'ALTERNATIVE', ...)
+        fallback = None
+        for index, part in enumerate(node[0], 1):
+            section = f"{prefix}.{index}" if prefix else str(index)
+            plain, other = _walk_structure(part, section)
+            if plain:
+                return plain, None
+            fallback = fallback or other
+        return None, fallback
+
+    maintype = _text(node[0]).lower()
+    subtype = _text(node[1]).lower()
+    if maintype != 'text' or _is_attachment(node):
+        return None, None
+
+    params = _params(node[2])
+    found = (prefix or '1', _text(node[5]).lower() or '7bit', params.get('charset', 'utf-8'), subtype)
+    if subtype == 'plain':
+        return found, None
+    return None, found
+
+def _text(value) -> str:
+    if value is None:
+        return ''
+    return value.decode('ascii', errors='ignore') if isinstance(value, bytes) else str(value)
+
+def _params(raw) -> dict:
+    """(b'CHARSET', b'utf-8', ...) -> {'charset': 'utf-8'}"""
+    if not raw:
+        return {}
+    items = [_text(v) for v in raw]
+    return {items[i].lower(): items[i + 1] for i in range(0, len(items) - 1, 2)}
+
+def _is_attachment(node) -> bool:
+    # text/* bodies: type, subtype, params, id, desc, encoding, size, lines, md5, disposition
+    disposition = node[9] if len(node) > 9 else None
+    return bool(disposition) and isinstance(disposition, tuple) and \
+        _text(disposition[0]).lower() == 'attachment'
+
+def _section_data(fetched: dict, section: str):
+    """Find the BODY[section]<0> item regardless of how the server echoes it"""
+    wanted = f"BODY[{section}]".encode()
+    for key, value in fetched.items():
+        if isinstance(key, bytes) and key.startswith(wanted):
+            return value
+    return None
+
+def _header_data(fetched: dict) -> bytes:
+    for key, value in fetched.items():
+        if isinstance(key, bytes) and key.startswith(b'BODY[HEADER'):
+            return value or b''
+    return b''
+
+def fetch_messages(imap, uids, max_chars: int = DEFAULT_MAX_CHARS, rules=None, classifier=None) -> list:
+    """Fetch headers and a byte-limited text body for each UID.
+
+    Round trip 1 asks for BODYSTRUCTURE plus a few header fields; round
+    trip 2 asks only for the chosen text section of each message with
+    BODY.PEEK[section]<0.N>, grouped so each distinct section is one FETCH.
+    Attachments are never downloaded and \\Seen is never set. HTML-only
+    messages are converted to text.
+
+    With `rules` (a header_rules.HeaderRules), messages the rules settle
+    from headers alone (bulk mail, auto-replies, bounces...) skip round
+    trip 2 and come back with an empty body and a 'rule_classification'.
+    With `classifier` (a local_classifier.LocalClassifier), the rest are
+    scored in one batch and get a 'local_classification' (None when the
+    classifier is not confident).
+    """
+    if not uids:
+        return []
+
+    max_bytes = max_chars * 4  # room for multi-byte charsets and base64 overhead
+    with telemetry.span('imap.fetch', messages=len(uids), round_trip='structure'):
+        overview = imap.fetch(uids, ['BODYSTRUCTURE', header_item(rules)])
+
+    with telemetry.span('mime.parse', messages=len(overview), part='headers'):
+        parser = BytesHeaderParser(policy=policy.default)
+        headers = {uid: parser.parsebytes(_header_data(data)) for uid, data in overview.items()}
+    ruled = {}
+    if rules is not None:
+        for uid in overview:
+            classification = rules.classify(headers[uid])
+            if classification is not None:
+                ruled[uid] = classification
+
+    by_section = {}
+    targets = {}
+    unstructured = []
+    for uid, data in overview.items():
+        if uid in ruled:
+            continue
+        structure = data.get(b'BODYSTRUCTURE')
+        if not structure:
+            unstructured.append(uid)
+            continue
+        target = find_text_section(structure)
+        if target:
+            targets[uid] = target
+            by_section.setdefault(target[0], []).append(uid)
+
+    raw_sections = {}
+    raw_messages = {}
+    with telemetry.span('imap.fetch', messages=len(targets) + len(unstructured), round_trip='bodies'):
+        for section, section_uids in by_section.items():
+            fetched = imap.fetch(section_uids, [f'BODY.PEEK[{section}]<0.{max_bytes}>'])
+            for uid, data in fetched.items():
+                raw_sections[uid] = _section_data(data, section)
+
+        if unstructured:
+            # No usable BODYSTRUCTURE: stream the head of the raw message instead
+            fetched = imap.fetch(unstructured, [f'BODY.PEEK[]<0.{max_bytes * 4}>'])
+            for uid, data in fetched.items():
+                raw_messages[uid] = _section_data(data, '')
+
+    bodies = {}
+    with telemetry.span('mime.parse', messages=len(raw_sections) + len(raw_messages), part='bodies'):
+        for uid, raw in raw_sections.items():
+            if raw is not None:
+                _, encoding, charset, subtype = targets[uid]
+                text = mime_extract.decode_payload(raw, encoding, charset)
+                bodies[uid] = mime_extract.html_to_text(text) if subtype == 'html' else text
+        for uid, raw in raw_messages.items():
+            if raw is not None:
+                bodies[uid] = mime_extract.extract_text(raw, max_bytes=max_bytes)
+
+    emails = []
+    # policy.default parses each header field when it is first read, so this is parsing too
+    with telemetry.span('mime.parse', messages=len(overview), part='fields'):
+        for uid in uids:
+            if uid not in overview:
+                continue
+            message = {
+                'id': uid,
+                'from': str(headers[uid]['From']),
+                'subject': str(headers[uid]['Subject'] or '') or "(No Subject)",
+                'date': str(headers[uid]['Date']),
+                'message_id': str(headers[uid]['Message-ID'] or ''),
+                'body': bodies.get(uid, '')[:max_chars]
+            }
+            if uid in ruled:
+                message['rule_classification'] = ruled[uid]
+            emails.append(message)
+
+    if classifier is not None:
+        unresolved = [message for message in emails if 'rule_classification' not in message]
+        with telemetry.span('classify.local', messages=len(unresolved)):
+            for message, classification in zip(unresolved, classifier.predict_batch(unresolved)):
+                message['local_classification'] = classification
+    return emails
+
+# ============================================
+# Thread Grouping
+# ============================================
+
+def fetch_threads(imap, uids, index) -> dict:
+    """Map each UID to its conversation thread id, in UID (arrival) order.
+
+    Costs one small FETCH of the threading headers per THREAD_FETCH_SIZE
+    UIDs, plus X-GM-THRID when the server is Gmail. Messages without a
+    Message-ID form a thread of their own.
+    """
+    gmail = b'X-GM-EXT-1' in imap.capabilities()
+    items = [THREAD_HEADER_ITEM] + (['X-GM-THRID'] if gmail else [])
+    parser = BytesHeaderParser(policy=policy.compat32)
+    threads = {}
+    for start in range(0, len(uids), THREAD_FETCH_SIZE):
+        chunk = uids[start:start + THREAD_FETCH_SIZE]
+        fetched = imap.fetch(chunk, items)
+        for uid in chunk:
+            data = fetched.get(uid)
+            if data is None:
+                continue
+            headers = parser.parsebytes(_header_data(data))
+            own = thread_index.message_ids(headers['Message-ID'])
+            thread_id = index.resolve(
+                own[0] if own else '',
+                in_reply_to=headers['In-Reply-To'],
+                references=headers['References'],
+                gm_thread_id=data.get(b'X-GM-THRID')
+            )
+            threads[uid] = thread_id or f"uid:{uid}"
+    return threads
+
+# ============================================
+# Pipelined, Paginated Fetching
+# ============================================
+
+DEFAULT_CHUNK_SIZE = 50
+
+def iter_messages(imap, uids, chunk_size: int = DEFAULT_CHUNK_SIZE, max_chars: int = DEFAULT_MAX_CHARS,
+                  rules=None, classifier=None):
+    """Yield messages chunk by chunk, fetching the next chunk while this one is handled.
+
+    A background thread owns the IMAP connection for the duration of the
+    iteration and stays at most one chunk ahead, so memory is bounded by
+    about two chunks however many UIDs are passed. Do not issue other
+    commands on `imap` until the generator is exhausted or closed.
+    """
+    chunks = [uids[i:i + chunk_size] for i in range(0, len(uids), chunk_size)]
+    if not chunks:
+        return
+
+    ready = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    def producer():
+        for chunk in chunks:
+            try:
+                item = fetch_messages(imap, chunk, max_chars=max_chars, rules=rules, classifier=classifier)
+            except Exception as e:
+                item = e
+            while not stop.is_set():
+                try:
+                    ready.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set() or isinstance(item, Exception):
+                return
+
+    # Run in a copy of this context so the fetch spans nest under the caller's
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(producer,), daemon=True)
+    worker.start()
+    try:
+        for _ in chunks:
+            item = ready.get()
+            if isinstance(item, Exception):
+                raise item
+            yield from item
+    finally:
+        stop.set()
+        worker.join()
+
+class UnreadMessages:
+    """Unread messages new since the sync checkpoint, streamed in chunks.
+
+    len() is the number of messages that will be yielded (after `limit`).
+    Iterating yields each message and commits the checkpoint after every
+    chunk, so an interrupted run resumes where it stopped; a message passed
+    to retry_later() is left out and fetched again by the next sync. With
+    `commit=False` nothing is committed while iterating and the caller
+    commits the UIDs it finished with commit(uids). Header rules
+    from header_rules.get_rules() and the shared local classifier are
+    applied unless `rules=False` / `classifier=False`.
+
+    With the thread index (thread_index.get_index(), off with
+    `threads=False`), only the newest unread message of each conversation
+    is yielded. It carries 'thread_id' and a 'thread_context' digest of the
+    earlier messages; those are recorded in the index but not yielded.
+    """
+
+    def __init__(self, imap, account: str, folder: str = 'INBOX', limit: int = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, max_chars: int = DEFAULT_MAX_CHARS, rules=None,
+                 classifier=None, threads=None, commit=True):
+        self.imap = imap
+        self.auto_commit = commit
+        self.failed = set()
+        self.rules = header_rules.get_rules() if rules is None else (rules or None)
+        self.classifier = local_classifier.get_classifier() if classifier is None else (classifier or None)
+        self.threads = thread_index.get_index() if threads is None else (threads or None)
+        with telemetry.span('imap.search', folder=folder) as span:
+            self.plan = mailbox_sync.plan_sync(imap, account, folder)
+            span.set(messages=len(self.plan.uids))
+        self.uids = self.plan.uids[:limit] if limit else self.plan.uids
+        self.chunk_size = chunk_size
+        self.max_chars = max_chars
+        self.thread_of = {}
+        self.superseded = set()
+        self.fetched = []
+        if self.threads is not None and self.uids:
+            with telemetry.span('imap.threads', messages=len(self.uids)):
+                self.thread_of = fetch_threads(imap, self.uids, self.threads)
+            latest = {}
+            for uid in self.uids:
+                if uid in self.thread_of:
+                    latest[self.thread_of[uid]] = uid
+            self.superseded = set(self.thread_of) - set(latest.values())
+        if not self.uids:
+            self.plan.commit()
+
+    def __len__(self):
+        return len(self.uids) - len(self.superseded)
+
+    def retry_later(self, uid):
+        """Keep a yielded message out of the checkpoint (e.g. its processing failed)"""
+        self.failed.add(uid)
+
+    def commit(self, uids=None):
+        """Advance the checkpoint past `uids` (default: every planned UID) and the
+        superseded thread messages fetched so far, minus those passed to retry_later()"""
+        uids = set(self.uids if uids is None else uids) | (self.superseded & set(self.fetched))
+        self.plan.commit(uids - self.failed)
+
+    def __iter__(self):
+        handled = self.fetched = []
+        for email_data in iter_messages(self.imap, self.uids, self.chunk_size, self.max_chars,
+                                        self.rules, self.classifier):
+            thread_id = self.thread_of.get(email_data['id'])
+            if thread_id is not None:
+                self.threads.record(email_data, thread_id)
+                if email_data['id'] in self.superseded:
+                    # An older message of a thread answered further down; it becomes context
+                    self.threads.stats['superseded'] += 1
+                else:
+                    email_data['thread_id'] = thread_id
+                    email_data['thread_context'] = self.threads.context(thread_id, exclude=email_data['message_id'])
+            if email_data['id'] not in self.superseded:
+                yield email_data
+            handled.append(email_data['id'])
+            if self.auto_commit and len(handled) % self.chunk_size == 0:
+                self.commit(handled)
+        if self.auto_commit:
+            self.commit()
@@ -0,0 +1,124 @@
+from imapclient import IMAPClient
+import contextlib
+import imaplib
+import threading
+import time
+import telemetry
+
+# ============================================
+# Pooled IMAP Connections
+# ============================================
+#
+# A TLS handshake plus LOGIN costs most of a second against Gmail, on
+# every fetch. An IMAPPool keeps logged-in connections between fetches:
+# acquire() hands out an idle connection (checked with NOOP once it has
+# been idle a while) or opens a new one, and release() puts it back. A
+# connection that is never released (the run raised) is simply dropped,
+# and two sessions fetching at once each get their own connection.
+#
+# The Streamlit apps keep one pool per account with st.cache_resource;
+# long-running processes (worker.py) share them through get_pool().
+
+# Most servers drop idle sessions after a few minutes (Gmail: ~10); check before reuse
+IDLE_TIMEOUT = 240
+MAX_IDLE = 2
+
+imap_connects = telemetry.counter(f"{telemetry.PREFIX}_imap_connects_total",
+                                  "IMAP logins, by whether a pooled connection was reused", ('result',))
+
+class IMAPPool:
+    """Logged-in IMAP connections for one account, reused across fetches"""
+
+    def __init__(self, host: str, email_address: str, password: str, ssl: bool = True, port: int = None,
+                 idle_timeout: float = IDLE_TIMEOUT, max_idle: int = MAX_IDLE):
+        self.host = host
+        self.email_address = email_address
+        self.password = password
+        self.ssl = ssl
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self.connects = 0
+        self.reuses = 0
+        self._idle = []  # (connection, released at)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        with telemetry.span('imap.connect', host=self.host):
+            imap = IMAPClient(self.host, port=self.port, use_uid=True, ssl=self.ssl)
+            try:
+                imap.login(self.email_address, self.password)
+            except Exception:
+                _logout(imap)
+                raise
+        self.connects += 1
+        imap_connects.inc(result='new')
+        return imap
+
+    def acquire(self):
+        """A logged-in connection: an idle one that still answers, or a new login"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                imap, released = self._idle.pop()
+            if time.monotonic() - released <= self.idle_timeout or _alive(imap):
+                self.reuses += 1
+                imap_connects.inc(result='reused')
+                return imap
+            _logout(imap)
+        return self._connect()
+
+    def release(self, imap):
+        """Return a connection after a successful fetch; extras beyond max_idle are logged out"""
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((imap, time.monotonic()))
+                return
+        _logout(imap)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """acquire() for a with block: released when it succeeds, logged out when it raises"""
+        imap = self.acquire()
+        try:
+            yield imap
+        except BaseException:
+            _logout(imap)
+            raise
+        self.release(imap)
+
+    def close(self):
+        """Log out every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for imap, _ in idle:
+            _logout(imap)
+
+    def summary(self) -> str:
+        return f"IMAP: {self.connects} login(s), {self.reuses} reused"
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host: str, email_address: str, password: str) -> IMAPPool:
+    """Process-wide pool for an account"""
+    key = (host, email_address, password)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = IMAPPool(host, email_address, password)
+        return _pools[key]
+
+def _alive(imap) -> bool:
+    try:
+        imap.noop()
+        return True
+    except (imaplib.IMAP4.error, OSError):
+        return False
+
+def _logout(imap):
+    """Log out, ignoring errors from a dead connection"""
+    try:
+        imap.logout()
+    except Exception:
+        pass
@@ -0,0 +1,287 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import telemetry
+
+# ============================================
+# Durable Job Queue
+# ============================================
+
+DEFAULT_PATH = os.path.join(".cache", "jobs.sqlite3")
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_CLAIM_SECONDS = 300  # a review left 'sending' this long belongs to a session that died mid-send
+ACTIVE_STATES = ('queued', 'running')
+
+class JobQueue:
+    """SQLite-backed job queue shared by the UI and worker processes.
+
+    Jobs move queued -> running -> done | failed. A running job holds a
+    lease; if its worker dies the lease runs out and another worker picks
+    the job up again. Finished review items live in a second table so the
+    UI can rebuild its lists from disk after a browser refresh.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                dedupe_key TEXT,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                error TEXT,
+                worker TEXT,
+                run_after REAL NOT NULL,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, run_after)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (dedupe_key)")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS reviews (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    # ---------- jobs ----------
+
+    def enqueue(self, kind: str, payload: dict = None, dedupe_key: str = None,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS):
+        """Add a job; returns its id, or None if an active job has the same dedupe_key"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if dedupe_key is not None:
+                    existing = self._db.execute(
+                        "SELECT id FROM jobs WHERE dedupe_key = ? AND state IN (?, ?)",
+                        (dedupe_key, *ACTIVE_STATES)
+                    ).fetchone()
+                    if existing:
+                        self._db.execute("COMMIT")
+                        return None
+                cur = self._db.execute(
+                    "INSERT INTO jobs (kind, payload, dedupe_key, state, max_attempts, run_after, "
+                    "created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                    (kind, json.dumps(payload or {}), dedupe_key, max_attempts, now, now, now)
+                )
+                self._db.execute("COMMIT")
+                return cur.lastrowid
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def claim(self, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        """Take the oldest runnable job (or one whose lease expired); None when idle"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, kind, payload, attempts, max_attempts FROM jobs "
+                    "WHERE (state = 'queued' AND run_after <= ?) "
+                    "   OR (state = 'running' AND lease_until < ?) "
+                    "ORDER BY id LIMIT 1",
+                    (now, now)
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                job_id, kind, payload, attempts, max_attempts = row
+                self._db.execute(
+                    "UPDATE jobs SET state = 'running', attempts = ?, worker = ?, lease_until = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (attempts + 1, worker, now + lease_seconds, now, job_id)
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return {'id': job_id, 'kind': kind, 'payload': json.loads(payload), 'attempts': attempts + 1,
+                'max_attempts': max_attempts}
+
+    def heartbeat(self, job_id: int, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        """Extend the lease of a long-running job"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND state = 'running'",
+                (now + lease_seconds, now, job_id)
+            )
+
+    def complete(self, job_id: int):
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET state = 'done', error = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE id = ?",
+                (time.time(), job_id)
+            )
+
+    def fail(self, job_id: int, error: str):
+        """Retry with exponential backoff until max_attempts, then mark failed"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return
+            attempts, max_attempts = row
+            if attempts < max_attempts:
+                state, run_after = 'queued', now + 2 ** attempts
+            else:
+                state, run_after = 'failed', now
+            self._db.execute(
+                "UPDATE jobs SET state = ?, error = ?, run_after = ?, lease_until = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (state, error, run_after, now, job_id)
+            )
+
+    def counts(self) -> dict:
+        """{state: number of jobs}"""
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return dict(rows)
+
+    def failures(self, limit: int = 5) -> list:
+        """Most recent permanently failed jobs as (kind, error)"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT kind, error FROM jobs WHERE state = 'failed' ORDER BY updated_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+
+    # ---------- review items ----------
+
+    def add_review(self, item: dict) -> bool:
+        """Store a processed email for review; False if it is already there"""
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO reviews (id, data, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (item['id'], json.dumps(item), item.get('status', 'pending'), now, now)
+            )
+        return cur.rowcount == 1
+
+    def reviews(self, status: str = None) -> list:
+        """Every review item (or those in `status`) in arrival order, with its current status"""
+        with self._lock:
+            if status is None:
+                rows = self._db.execute(
+                    "SELECT data, status FROM reviews ORDER BY created_at"
+                ).fetchall()
+            else:
+                rows = self._db.execute(
+                    "SELECT data, status FROM reviews WHERE status = ? ORDER BY created_at", (status,)
+                ).fetchall()
+        items = []
+        for data, status in rows:
+            item = json.loads(data)
+            item['status'] = status
+            items.append(item)
+        return items
+
+    def review_stamp(self) -> tuple:
+        """(count, last update time) of the review table; changes whenever any review does"""
+        with self._lock:
+            return tuple(self._db.execute("SELECT COUNT(*), MAX(updated_at) FROM reviews").fetchone())
+
+    def review_statuses(self) -> list:
+        """[(id, status)] in arrival order, without decoding the stored items"""
+        with self._lock:
+            return self._db.execute("SELECT id, status FROM reviews ORDER BY created_at").fetchall()
+
+    def release_stale_claims(self, max_age: float = DEFAULT_CLAIM_SECONDS) -> int:
+        """Put reviews stuck in 'sending' for max_age seconds (their session crashed mid-send) back to 'pending'"""
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE reviews SET status = 'pending', updated_at = ? WHERE status = 'sending' AND updated_at < ?",
+                (time.time(), time.time() - max_age)
+            )
+        return cur.rowcount
+
+    def set_review_status(self, review_id: str, status: str, expected: str = None, **fields) -> bool:
+        """Change a review's status (only from `expected`, if given) and merge extra fields.
+
+        Returns False when another reviewer changed it first, which lets
+        concurrent sessions claim an email before sending it.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT data, status FROM reviews WHERE id = ?", (review_id,)
+                ).fetchone()
+                if row is None or (expected is not None and row[1] != expected):
+                    self._db.execute("COMMIT")
+                    return False
+                data = dict(json.loads(row[0]), **fields)
+                self._db.execute(
+                    "UPDATE reviews SET data = ?, status = ?, updated_at = ? WHERE id = ?",
+                    (json.dumps(data), status, time.time(), review_id)
+                )
+                self._db.execute("COMMIT")
+                return True
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def supersede_thread(self, thread_id: str, latest_id: str) -> int:
+        """Retire unsent reviews of older messages in a thread once a newer one arrives"""
+        with self._lock:
+            cur = self._db.execute(
+                "UPDATE reviews SET status = 'superseded', updated_at = ? "
+                "WHERE status IN ('pending', 'drafting') AND id != ? AND json_extract(data, '$.thread_id') = ?",
+                (time.time(), latest_id, thread_id)
+            )
+        return cur.rowcount
+
+    def clear_reviews(self):
+        with self._lock:
+            self._db.execute("DELETE FROM reviews")
+
+    def summary(self) -> str:
+        """One-line queue report"""
+        counts = self.counts()
+        return ", ".join(f"{counts.get(state, 0)} {state}" for state in ('queued', 'running', 'done', 'failed'))
+
+    def metrics(self) -> list:
+        """Queue depth by state and review items by status, read on each /metrics scrape"""
+        counts = self.counts()
+        with self._lock:
+            reviews = self._db.execute("SELECT status, COUNT(*) FROM reviews GROUP BY status").fetchall()
+        return [
+            (f"{telemetry.PREFIX}_jobs", 'gauge', "Jobs in the queue by state",
+             [({'state': state}, counts.get(state, 0)) for state in ('queued', 'running', 'done', 'failed')]),
+            (f"{telemetry.PREFIX}_reviews", 'gauge', "Review items by status",
+             [({'status': status}, count) for status, count in sorted(reviews)])
+        ]
+
+_queue = None
+
+def get_queue():
+    """Process-wide queue (JOB_QUEUE_PATH overrides the location)"""
+    global _queue
+    if _queue is None:
+        _queue = JobQueue(os.environ.get("JOB_QUEUE_PATH", DEFAULT_PATH))
+        telemetry.register_collector(_queue.metrics)
+    return _queue
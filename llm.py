@@ -0,0 +1,207 @@
+import time
+import llm_cache
+import rate_limit
+import context_cache
+import profiles
+import llm_transport
+import telemetry
+
+# ============================================
+# Shared Gemini Call Wrapper
+# ============================================
+#
+# Every call goes through the result cache, then the per-model rate
+# limiter (see rate_limit), which also retries 429/5xx responses. A static
+# `instruction` (categories, guidelines, output format) is sent as a
+# system instruction or explicit context cache (see context_cache). A
+# `profile` names the stage (classify, triage, draft, summarize) whose
+# model / thinking budget / output cap apply and whose latency is recorded.
+# get_client() is the one genai.Client every module shares; its HTTP
+# transport is live, record, replay or stub (see llm_transport). The
+# agents hold a LazyClient instead, so google.genai is only imported and
+# the client only built by the first call that misses the cache. Uncached
+# calls are traced as llm.<stage> spans (see telemetry).
+
+llm_calls = telemetry.counter(f"{telemetry.PREFIX}_llm_calls_total",
+                              "LLM calls per stage, answered by the API or the result cache", ('stage', 'source'))
+llm_tokens = telemetry.counter(f"{telemetry.PREFIX}_llm_tokens_total",
+                               "Tokens reported by the API per stage", ('stage', 'direction'))
+
+_client = None
+
+def get_client():
+    """Process-wide genai.Client on the GEMINI_TRANSPORT transport"""
+    global _client
+    if _client is None:
+        _client = llm_transport.make_client()
+    return _client
+
+class LazyClient:
+    """Stand-in for get_client() that builds the client on first attribute access"""
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+def cache_key(model: str, contents, config=None, instruction: str = None) -> str:
+    """Result-cache key; uses the instruction text, not the per-run cache name it is sent as"""
+    return llm_cache.make_key(model, [instruction, contents] if instruction else contents, config)
+
+def _record_usage(span, stage: str, response):
+    """Token counts of an API answer onto its span and the per-stage counters"""
+    input_tokens, output_tokens, _ = rate_limit.usage(response)
+    span.set(input_tokens=input_tokens or 0, output_tokens=output_tokens or 0)
+    llm_calls.inc(stage=stage, source='api')
+    llm_tokens.inc(input_tokens or 0, stage=stage, direction='input')
+    llm_tokens.inc(output_tokens or 0, stage=stage, direction='output')
+
+class CachedResponse:
+    """Stand-in for a GenerateContentResponse served from the cache"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.cached = True
+
+def generate_content(client, model: str, contents, config=None, instruction: str = None,
+                     profile: str = None, validate=None):
+    """client.models.generate_content with the persistent result cache in front.
+
+    validate(text) decides whether an answer is worth caching: a falsy
+    result keeps it out of the cache, and a cached answer that fails it is
+    treated as a miss, so one malformed response is not replayed forever.
+    """
+    if profile:
+        model, config = profiles.get_profile(profile).apply(model, config)
+    cache = llm_cache.get_cache()
+    key = cache_key(model, contents, config, instruction) if cache else None
+
+    stage = profile or 'unprofiled'
+
+    if cache:
+        text = cache.get(key)
+        if text is not None and (validate is None or validate(text)):
+            llm_calls.inc(stage=stage, source='cache')
+            return CachedResponse(text)
+
+    with telemetry.span(f"llm.{stage}", model=model) as span:
+        contents, config = context_cache.get_prefix_cache().apply(client, model, contents, config, instruction)
+        started = time.perf_counter()
+        response = rate_limit.get_limiter(model).call(
+            lambda: client.models.generate_content(model=model, contents=contents, config=config),
+            rate_limit.estimate_tokens(contents, config)
+        )
+        profiles.latency.record(stage, time.perf_counter() - started)
+        _record_usage(span, stage, response)
+
+    if cache and response.text is not None and (validate is None or validate(response.text)):
+        cache.put(key, response.text)
+    return response
+
+async def generate_content_async(client, model: str, contents, config=None, instruction: str = None,
+                                 profile: str = None, validate=None):
+    """Async variant of generate_content using client.aio"""
+    if profile:
+        model, config = profiles.get_profile(profile).apply(model, config)
+    cache = llm_cache.get_cache()
+    key = cache_key(model, contents, config, instruction) if cache else None
+
+    stage = profile or 'unprofiled'
+
+    if cache:
+        text = cache.get(key)
+        if text is not None and (validate is None or validate(text)):
+            llm_calls.inc(stage=stage, source='cache')
+            return CachedResponse(text)
+
+    with telemetry.span(f"llm.{stage}", model=model) as span:
+        contents, config = context_cache.get_prefix_cache().apply(client, model, contents, config, instruction)
+        started = time.perf_counter()
+        response = await rate_limit.get_limiter(model).call_async(
+            lambda: client.aio.models.generate_content(model=model, contents=contents, config=config),
+            rate_limit.estimate_tokens(contents, config)
+        )
+        profiles.latency.record(stage, time.perf_counter() - started)
+        _record_usage(span, stage, response)
+
+    if cache and response.text is not None and (validate is None or validate(response.text)):
+        cache.put(key, response.text)
+    return response
+
+def generate_content_stream(client, model: str, contents, config=None, instruction: str = None,
+                            profile: str = None, validate=None):
+    """Yield response text chunks as they arrive from client.models.generate_content_stream.
+
+    A cache hit yields the whole cached text as one chunk; a streamed answer
+    is cached once it has been read to the end and passes validate (see
+    generate_content). Failures before the first
+    chunk are retried; a stream cut off midway raises.
+    """
+    if profile:
+        model, config = profiles.get_profile(profile).apply(model, config)
+    cache = llm_cache.get_cache()
+    key = cache_key(model, contents, config, instruction) if cache else None
+
+    stage = profile or 'unprofiled'
+
+    if cache:
+        text = cache.get(key)
+        if text is not None and (validate is None or validate(text)):
+            llm_calls.inc(stage=stage, source='cache')
+            yield text
+            return
+
+    # Not telemetry.span(): the consumer runs between chunks and must not become a child
+    span = telemetry.start_span(f"llm.{stage}", model=model, stream=True)
+    error = None
+    try:
+        contents, config = context_cache.get_prefix_cache().apply(client, model, contents, config, instruction)
+        parts = []
+        started = time.perf_counter()
+        first_chunk = None
+        last = None
+        chunks = rate_limit.get_limiter(model).stream(
+            lambda: client.models.generate_content_stream(model=model, contents=contents, config=config),
+            rate_limit.estimate_tokens(contents, config)
+        )
+        for chunk in chunks:
+            last = chunk
+            if chunk.text:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                    span.set(first_chunk=round(first_chunk, 4))
+                parts.append(chunk.text)
+                yield chunk.text
+        profiles.latency.record(stage, time.perf_counter() - started, first_chunk)
+        _record_usage(span, stage, last)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        span.end(error)
+
+    text = ''.join(parts)
+    if cache and text and (validate is None or validate(text)):
+        cache.put(key, text)
+
+def cache_summary() -> str:
+    """Hit/miss line for CLI summaries and UI sidebars"""
+    cache = llm_cache.get_cache()
+    return cache.summary() if cache else "disabled"
+
+def rate_limit_summary() -> str:
+    """Requests, retries and throttling per model"""
+    return rate_limit.summary()
+
+def context_cache_summary() -> str:
+    """How static instructions were sent"""
+    return context_cache.summary()
+
+def profile_summary() -> str:
+    """Active generation preset and latency per stage"""
+    return profiles.summary()
+
+def transport_summary() -> str:
+    return llm_transport.summary()
+
+def stage_summary() -> str:
+    """Time per traced stage (see telemetry)"""
+    return telemetry.summary()
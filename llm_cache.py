@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ============================================
+# Persistent LLM Result Cache
+# ============================================
+
+DEFAULT_PATH = os.path.join(".cache", "llm_cache.sqlite3")
+DEFAULT_MAX_MB = 256
+DEFAULT_TTL_DAYS = 30
+
+def make_key(model: str, contents, config=None) -> str:
+    """Content address of a request: hash of model, prompt and generation config"""
+    if config is not None and hasattr(config, 'model_dump'):
+        config = config.model_dump(mode='json', exclude_none=True)
+    payload = json.dumps(
+        {'model': model, 'contents': contents, 'config': config},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class LLMCache:
+    """SQLite-backed response cache with size-based LRU and TTL eviction"""
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024,
+                 ttl_seconds: float = DEFAULT_TTL_DAYS * 86400):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)")
+        self._total_bytes = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, key: str):
+        """Return the cached text for key, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, size, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            value, size, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.stats['hits'] += 1
+            return value
+
+    def put(self, key: str, value: str):
+        """Store value under key, then evict least recently used entries over the size cap"""
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            old = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then oldest-accessed ones until under max_bytes"""
+        if self.ttl_seconds:
+            cur = self._db.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            self.stats['expired'] += cur.rowcount
+        self._total_bytes = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+        # Trim to 90% of the cap so we don't evict on every single put
+        target = self.max_bytes * 0.9
+        rows = self._db.execute("SELECT key, size FROM responses ORDER BY accessed_at")
+        doomed = []
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            doomed.append((key,))
+            self._total_bytes -= size
+        if doomed:
+            self._db.executemany("DELETE FROM responses WHERE key = ?", doomed)
+            self.stats['evictions'] += len(doomed)
+
+    def clear(self):
+        """Remove every cached response"""
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._total_bytes = 0
+
+    def summary(self) -> str:
+        """One-line hit/miss report"""
+        lookups = self.stats['hits'] + self.stats['misses']
+        rate = (self.stats['hits'] / lookups * 100) if lookups else 0.0
+        return (f"{self.stats['hits']} hits / {self.stats['misses']} misses ({rate:.0f}% hit rate), "
+                f"{self.stats['evictions']} evicted, {self._total_bytes / 1024:.0f} KB on disk")
+
+_cache = None
+
+def get_cache():
+    """Process-wide cache configured from the environment; None when disabled"""
+    global _cache
+    if os.environ.get("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes"):
+        return None
+    if _cache is None:
+        _cache = LLMCache(
+            path=os.environ.get("LLM_CACHE_PATH", DEFAULT_PATH),
+            max_bytes=int(float(os.environ.get("LLM_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024),
+            ttl_seconds=float(os.environ.get("LLM_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS)) * 86400
+        )
+    return _cache
@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import httpx
+import json
+import os
+import threading
+import time
+
+# ============================================
+# Pluggable HTTP Transport for the Gemini Client
+# ============================================
+#
+# Every genai.Client comes from make_client(), which puts one of these
+# httpx transports underneath it:
+#
+# GEMINI_TRANSPORT:
+#   live   - the real API (GEMINI_BASE_URL may point it at `python gemini_stub.py`)
+#   record - the real API, appending each request/response pair to GEMINI_RECORDING_PATH
+#   replay - serve recorded responses only; an unrecorded request raises LookupError
+#   stub   - answer in-process from gemini_stub.StubGemini (GEMINI_STUB_* settings)
+#
+# Recordings are keyed by method, URL path and canonical JSON body, so a
+# replay is deterministic as long as the prompts are. No headers are
+# stored, so the API key never reaches the file.
+
+DEFAULT_PATH = os.path.join(".cache", "gemini_recordings.jsonl")
+MODES = ('live', 'record', 'replay', 'stub')
+
+def mode() -> str:
+    value = os.environ.get("GEMINI_TRANSPORT", "live").lower()
+    if value not in MODES:
+        raise ValueError(f"Unknown GEMINI_TRANSPORT '{value}' (choose from {', '.join(MODES)})")
+    return value
+
+def request_key(method: str, url, content: bytes) -> str:
+    """Identity of a request for replay: method, path + query and the JSON body with sorted keys"""
+    url = httpx.URL(str(url))
+    try:
+        body = json.dumps(json.loads(content), sort_keys=True, separators=(',', ':'))
+    except ValueError:
+        body = (content or b'').decode('utf-8', 'replace')
+    target = url.raw_path.decode('ascii')
+    return hashlib.sha256(f"{method} {target} {body}".encode('utf-8')).hexdigest()
+
+def _response(request, status: int, content_type: str, content) -> httpx.Response:
+    return httpx.Response(status, headers={'content-type': content_type}, content=content, request=request)
+
+class RecordingTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Forwards to the network and appends every exchange to a JSONL file"""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self.recorded = 0
+        self._sync = httpx.HTTPTransport()
+        self._async = httpx.AsyncHTTPTransport()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _write(self, request, response, content: bytes, elapsed: float):
+        entry = {
+            'key': request_key(request.method, request.url, request.content),
+            'method': request.method,
+            'path': request.url.raw_path.decode('ascii'),
+            'status': response.status_code,
+            'content_type': response.headers.get('content-type', 'application/json'),
+            'elapsed': round(elapsed, 4),
+            'request': request.content.decode('utf-8', 'replace'),
+            'response': content.decode('utf-8', 'replace')
+        }
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+            self.recorded += 1
+
+    def handle_request(self, request):
+        started = time.perf_counter()
+        response = self._sync.handle_request(request)
+        content = response.read()  # decoded, so it is re-served without content-encoding
+        self._write(request, response, content, time.perf_counter() - started)
+        return _response(request, response.status_code, response.headers.get('content-type', ''), content)
+
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        response = await self._async.handle_async_request(request)
+        content = await response.aread()
+        self._write(request, response, content, time.perf_counter() - started)
+        return _response(request, response.status_code, response.headers.get('content-type', ''), content)
+
+    def summary(self) -> str:
+        return f"recording — {self.recorded} exchange(s) appended to {self.path}"
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Serves recorded responses; repeated requests get their recordings in order.
+
+    With `timing` the recorded latency is slept before answering, so a
+    replayed run keeps the shape of the original one.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, timing: bool = False):
+        self.path = path
+        self.timing = timing
+        self.stats = {'served': 0, 'missing': 0}
+        self._entries = {}
+        self._next = {}
+        self._lock = threading.Lock()
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry['key'], []).append(entry)
+
+    def _lookup(self, request) -> dict:
+        key = request_key(request.method, request.url, request.content)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self.stats['missing'] += 1
+                raise LookupError(f"No recorded response for {request.method} {request.url.path} "
+                                  f"in {self.path}; record it with GEMINI_TRANSPORT=record")
+            position = self._next.get(key, 0)
+            self._next[key] = position + 1
+            self.stats['served'] += 1
+        return entries[min(position, len(entries) - 1)]
+
+    def handle_request(self, request):
+        entry = self._lookup(request)
+        if self.timing:
+            time.sleep(entry['elapsed'])
+        return _response(request, entry['status'], entry['content_type'], entry['response'].encode('utf-8'))
+
+    async def handle_async_request(self, request):
+        entry = self._lookup(request)
+        if self.timing:
+            await asyncio.sleep(entry['elapsed'])
+        return _response(request, entry['status'], entry['content_type'], entry['response'].encode('utf-8'))
+
+    def summary(self) -> str:
+        return f"replay — {self.stats['served']} served, {self.stats['missing']} missing from {self.path}"
+
+class StubTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """In-process stub model: gemini_stub.StubGemini answers without any socket"""
+
+    def __init__(self, stub):
+        self.stub = stub
+
+    def handle_request(self, request):
+        reply = self.stub.handle(request.method, request.url.path, request.content)
+
+        def chunks():
+            for delay, chunk in zip(reply['delays'], reply['chunks']):
+                time.sleep(delay)
+                yield chunk
+        return _response(request, reply['status'], reply['content_type'], chunks())
+
+    async def handle_async_request(self, request):
+        reply = self.stub.handle(request.method, request.url.path, request.content)
+
+        async def chunks():
+            for delay, chunk in zip(reply['delays'], reply['chunks']):
+                await asyncio.sleep(delay)
+                yield chunk
+        return _response(request, reply['status'], reply['content_type'], chunks())
+
+    def summary(self) -> str:
+        return f"stub — {self.stub.summary()}"
+
+# ============================================
+# Client Factory
+# ============================================
+
+_transport = None
+
+def get_transport():
+    """The transport for GEMINI_TRANSPORT, or None for the SDK's own (live)"""
+    global _transport
+    current = mode()
+    if _transport is None and current != 'live':
+        path = os.environ.get("GEMINI_RECORDING_PATH", DEFAULT_PATH)
+        if current == 'record':
+            _transport = RecordingTransport(path)
+        elif current == 'replay':
+            timing = os.environ.get("GEMINI_REPLAY_TIMING", "").lower() in ("1", "true", "yes")
+            _transport = ReplayTransport(path, timing=timing)
+        else:
+            import gemini_stub
+            _transport = StubTransport(gemini_stub.from_env())
+    return _transport
+
+def make_client(api_key: str = None):
+    """genai.Client wired to the configured transport"""
+    # google.genai (pydantic models for the whole API) is by far the slowest
+    # import here; only pay for it once a client is actually needed
+    from google import genai
+    from google.genai import types
+    transport = get_transport()
+    options = {}
+    if os.environ.get("GEMINI_BASE_URL"):
+        options['base_url'] = os.environ["GEMINI_BASE_URL"]
+    if transport is not None:
+        options['httpx_client'] = httpx.Client(transport=transport)
+        options['httpx_async_client'] = httpx.AsyncClient(transport=transport)
+    api_key = api_key or os.environ.get("GEMINI_API_KEY")
+    if transport is not None and not isinstance(transport, RecordingTransport):
+        api_key = api_key or "offline"  # never sent anywhere
+    return genai.Client(api_key=api_key, http_options=types.HttpOptions(**options) if options else None)
+
+def summary() -> str:
+    return _transport.summary() if _transport is not None else "live"
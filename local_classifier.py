@@ -0,0 +1,326 @@
+import argparse
+import atexit
+import json
+import math
+import os
+import re
+import threading
+import zlib
+import numpy as np
+
+# ============================================
+# Local TF-IDF Naive Bayes Classifier
+# ============================================
+#
+# Learns category / priority / sentiment / needs_reply from past LLM
+# answers and the labeled files in responses/. Confident predictions
+# replace the classification call; the rest go to the LLM, whose answer
+# is then learned, so the share handled locally grows over time.
+
+DEFAULT_PATH = os.path.join(".cache", "local_classifier.npz")
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_MIN_EXAMPLES = 30
+N_FEATURES = 2 ** 16
+FIELDS = ('category', 'priority', 'sentiment', 'needs_reply')
+DEFAULTS = {'category': 'general_inquiry', 'priority': 'medium', 'sentiment': 'neutral', 'needs_reply': 'yes'}
+SAVE_EVERY = 25
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9'$]+")
+
+def email_text(email_data: dict) -> str:
+    return f"{email_data.get('subject', '')}\n{email_data.get('body', '')[:2000]}"
+
+class _NaiveBayesHead:
+    """Multinomial naive Bayes over hashed term weights for one label field"""
+
+    def __init__(self, n_features: int):
+        self.labels = []
+        self.class_counts = np.zeros(0, dtype=np.float64)
+        self.feature_counts = np.zeros((0, n_features), dtype=np.float32)
+        self._log_likelihood = None
+
+    def _row(self, label: str) -> int:
+        if label not in self.labels:
+            self.labels.append(label)
+            self.class_counts = np.append(self.class_counts, 0.0)
+            self.feature_counts = np.vstack([self.feature_counts, np.zeros((1, self.feature_counts.shape[1]), np.float32)])
+        return self.labels.index(label)
+
+    def partial_fit(self, indices, values, offsets, labels):
+        for row, label in enumerate(labels):
+            if label is None:
+                continue
+            c = self._row(label)
+            start, end = offsets[row], offsets[row + 1]
+            np.add.at(self.feature_counts[c], indices[start:end], values[start:end])
+            self.class_counts[c] += 1
+        self._log_likelihood = None
+
+    def log_proba(self, indices, weights, offsets):
+        """(n_docs, n_classes) log posteriors, scored for the whole batch at once"""
+        log_prior = np.log(self.class_counts / self.class_counts.sum())
+        if self._log_likelihood is None:
+            smoothed = self.feature_counts + 1.0
+            self._log_likelihood = np.log(smoothed) - np.log(smoothed.sum(axis=1, keepdims=True))
+        log_likelihood = self._log_likelihood
+        # Gather the columns of every token in the batch, weight them, sum per document
+        scores = np.add.reduceat(log_likelihood[:, indices] * weights, offsets[:-1], axis=1).T
+        scores += log_prior
+        return scores - np.logaddexp.reduce(scores, axis=1, keepdims=True)
+
+class LocalClassifier:
+    """One naive Bayes head per field, with a shared hashed TF-IDF vocabulary.
+
+    Predictions whose category posterior is below `threshold`, or made
+    before `min_examples` documents have been learned, return None so the
+    caller falls back to the LLM.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, threshold: float = DEFAULT_THRESHOLD,
+                 min_examples: int = DEFAULT_MIN_EXAMPLES, n_features: int = N_FEATURES):
+        self.path = path
+        self.threshold = threshold
+        self.min_examples = min_examples
+        self.n_features = n_features
+        self.heads = {field: _NaiveBayesHead(n_features) for field in FIELDS}
+        self.doc_freq = np.zeros(n_features, dtype=np.float32)
+        self.n_docs = 0
+        self.learned_files = set()  # responses/ file names already fitted by train_from_responses
+        self.stats = {'local': 0, 'llm': 0}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    # ---------- features ----------
+
+    def vectorize(self, texts):
+        """Hashed log-TF vectors for a batch as flat (indices, values, offsets) arrays.
+
+        Every document gets a zero-weight entry at column 0 so reduceat
+        never sees an empty row.
+        """
+        indices, values, offsets = [], [], [0]
+        for text in texts:
+            counts = {}
+            for token in _TOKEN.findall(text.lower()):
+                column = zlib.crc32(token.encode('utf-8')) % self.n_features
+                counts[column] = counts.get(column, 0) + 1
+            indices.append(0)
+            values.append(0.0)
+            for column, count in counts.items():
+                indices.append(column)
+                values.append(1.0 + math.log(count))
+            offsets.append(len(indices))
+        return np.array(indices, dtype=np.int64), np.array(values, dtype=np.float32), np.array(offsets)
+
+    def _tfidf(self, indices, values):
+        """Log-TF values weighted by the current IDF; the same weighting for fitting and scoring"""
+        idf = np.log((1.0 + self.n_docs) / (1.0 + self.doc_freq[indices])) + 1.0
+        return values * idf
+
+    # ---------- training ----------
+
+    def learn_many(self, examples):
+        """Incrementally fit on (email_data, classification) pairs; missing fields are skipped"""
+        examples = list(examples)
+        if not examples:
+            return
+        indices, values, offsets = self.vectorize(email_text(e) for e, _ in examples)
+        with self._lock:
+            for row in range(len(examples)):
+                self.doc_freq[indices[offsets[row] + 1:offsets[row + 1]]] += 1
+            self.n_docs += len(examples)
+            weights = self._tfidf(indices, values)
+            for field, head in self.heads.items():
+                head.partial_fit(indices, weights, offsets, [c.get(field) for _, c in examples])
+            self._unsaved += len(examples)
+            save_now = self._unsaved >= SAVE_EVERY
+        if save_now:
+            self.save()
+
+    def learn(self, email_data: dict, classification: dict):
+        self.learn_many([(email_data, classification)])
+
+    # ---------- prediction ----------
+
+    def predict_batch(self, emails: list) -> list:
+        """Classification dict (or None when not confident) for each email, in one pass"""
+        if not emails:
+            return []
+        category_head = self.heads['category']
+        if self.n_docs < self.min_examples or len(category_head.labels) < 2:
+            return [None] * len(emails)
+
+        indices, values, offsets = self.vectorize(email_text(e) for e in emails)
+        with self._lock:
+            weights = self._tfidf(indices, values)
+            posteriors = {
+                field: head.log_proba(indices, weights, offsets)
+                for field, head in self.heads.items() if len(head.labels) >= 1
+            }
+
+        results = []
+        for row in range(len(emails)):
+            confidence = float(np.exp(posteriors['category'][row].max()))
+            if confidence < self.threshold:
+                results.append(None)
+                continue
+            classification = dict(DEFAULTS, reason='', source='local', confidence=round(confidence, 3))
+            for field, log_post in posteriors.items():
+                classification[field] = self.heads[field].labels[int(log_post[row].argmax())]
+            results.append(classification)
+        return results
+
+    def predict(self, email_data: dict):
+        return self.predict_batch([email_data])[0]
+
+    # ---------- persistence ----------
+
+    def save(self):
+        """Write the model atomically (temp file, then rename)"""
+        with self._lock:
+            arrays = {'doc_freq': self.doc_freq, 'n_docs': np.array(self.n_docs)}
+            labels = {}
+            for field, head in self.heads.items():
+                arrays[f'{field}_class_counts'] = head.class_counts
+                arrays[f'{field}_feature_counts'] = head.feature_counts
+                labels[field] = head.labels
+            arrays['labels'] = np.array(json.dumps(labels))
+            arrays['learned_files'] = np.array(json.dumps(sorted(self.learned_files)))
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+            np.savez_compressed(tmp_path, **arrays)
+            os.replace(tmp_path, self.path)
+            self._unsaved = 0
+
+    def load(self):
+        """Load a saved model if one exists and matches n_features"""
+        try:
+            data = np.load(self.path)
+        except (OSError, ValueError):
+            return self
+        if data['doc_freq'].shape[0] != self.n_features:
+            return self
+        labels = json.loads(str(data['labels']))
+        self.doc_freq = data['doc_freq']
+        self.n_docs = int(data['n_docs'])
+        if 'learned_files' in data.files:
+            self.learned_files = set(json.loads(str(data['learned_files'])))
+        for field, head in self.heads.items():
+            head.labels = labels.get(field, [])
+            head.class_counts = data[f'{field}_class_counts']
+            head.feature_counts = data[f'{field}_feature_counts']
+            head._log_likelihood = None
+        return self
+
+    def summary(self) -> str:
+        """Share of classifications resolved without the LLM"""
+        total = self.stats['local'] + self.stats['llm']
+        rate = (self.stats['local'] / total * 100) if total else 0.0
+        return f"{self.stats['local']}/{total} classified locally ({rate:.0f}%), trained on {self.n_docs}"
+
+# ============================================
+# Training From History
+# ============================================
+
+def read_response_file(path: str, emails_dir: str = os.path.join("emails", "processed")):
+    """(email_data, classification) from a file in responses/, or None.
+
+    Only files whose original email is still in emails_dir (email_agent.py
+    output) are usable: the model predicts on incoming mail, so it must not
+    learn from our own drafted replies (gmail_agent.py output keeps none).
+    """
+    with open(path, encoding='utf-8', errors='ignore') as f:
+        text = f.read()
+    head, _, reply = text.partition('=' * 60)
+    fields = {}
+    for line in head.splitlines():
+        key, sep, value = line.partition(':')
+        if sep:
+            fields[key.strip().upper()] = value.strip().lower()
+    if 'CLASSIFICATION' not in fields:
+        return None
+
+    reply = reply.lstrip('=').strip()
+    classification = {
+        'category': fields['CLASSIFICATION'],
+        'priority': fields.get('PRIORITY'),
+        'sentiment': fields.get('SENTIMENT'),
+        'needs_reply': 'no' if reply.startswith('[NO RESPONSE') or not reply else 'yes'
+    }
+
+    match = re.match(r'\d{8}_\d{6}_(.+)$', os.path.basename(path))
+    source = os.path.join(emails_dir, match.group(1)) if match else None
+    if not source or not os.path.exists(source):
+        return None
+    with open(source, encoding='utf-8', errors='ignore') as f:
+        raw = f.read()
+    subject = re.search(r'^Subject:(.*)$', raw, re.MULTILINE)
+    email_data = {'subject': subject.group(1).strip() if subject else '', 'body': raw}
+    return email_data, classification
+
+def train_from_responses(classifier, responses_dir: str = "responses",
+                         emails_dir: str = os.path.join("emails", "processed")) -> int:
+    """Fit on the labeled files in responses_dir not learned before; returns the number learned.
+
+    File names are remembered in the model, so running this again on the
+    same folder only adds the new files instead of counting the old ones twice.
+    """
+    examples, names = [], []
+    for name in sorted(os.listdir(responses_dir)):
+        if name in classifier.learned_files:
+            continue
+        example = read_response_file(os.path.join(responses_dir, name), emails_dir)
+        if example:
+            examples.append(example)
+            names.append(name)
+    classifier.learn_many(examples)
+    classifier.learned_files.update(names)
+    return len(examples)
+
+# ============================================
+# Process-Wide Instance
+# ============================================
+
+_classifier = None
+
+def enabled() -> bool:
+    """The local classifier is on unless LOCAL_CLASSIFIER_DISABLED=1"""
+    return os.environ.get("LOCAL_CLASSIFIER_DISABLED", "").lower() not in ("1", "true", "yes")
+
+def get_classifier():
+    """Shared classifier loaded from LOCAL_CLASSIFIER_PATH; None when disabled.
+
+    LOCAL_CLASSIFIER_THRESHOLD sets the confidence needed to skip the LLM.
+    The model is saved every SAVE_EVERY updates and at exit.
+    """
+    global _classifier
+    if not enabled():
+        return None
+    if _classifier is None:
+        _classifier = LocalClassifier(
+            path=os.environ.get("LOCAL_CLASSIFIER_PATH", DEFAULT_PATH),
+            threshold=float(os.environ.get("LOCAL_CLASSIFIER_THRESHOLD", DEFAULT_THRESHOLD))
+        ).load()
+        atexit.register(lambda: _classifier._unsaved and _classifier.save())
+    return _classifier
+
+def summary() -> str:
+    classifier = get_classifier()
+    return classifier.summary() if classifier else "disabled"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the local email classifier from past responses")
+    parser.add_argument("--responses", default="responses", help="folder of labeled response files")
+    parser.add_argument("--emails", default=os.path.join("emails", "processed"),
+                        help="folder holding the original emails of email_agent.py responses")
+    parser.add_argument("--reset", action="store_true",
+                        help="start from an empty model (otherwise only files not learned before are added)")
+    args = parser.parse_args()
+
+    classifier = LocalClassifier(path=os.environ.get("LOCAL_CLASSIFIER_PATH", DEFAULT_PATH))
+    if not args.reset:
+        classifier.load()
+    learned = train_from_responses(classifier, args.responses, args.emails)
+    classifier.save()
+    print(f"🧠 Learned {learned} example(s); model now trained on {classifier.n_docs} → {classifier.path}")
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+
+# ============================================
+# Incremental Mailbox Sync Checkpoints
+# ============================================
+
+DEFAULT_PATH = os.path.join(".cache", "imap_checkpoints.json")
+
+def incremental_enabled() -> bool:
+    """Incremental sync is on unless IMAP_FULL_SYNC=1"""
+    return os.environ.get("IMAP_FULL_SYNC", "").lower() not in ("1", "true", "yes")
+
+class CheckpointStore:
+    """Per-account, per-folder UIDVALIDITY / last UID / HIGHESTMODSEQ, persisted as JSON"""
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+
+    @staticmethod
+    def _key(account: str, folder: str) -> str:
+        return f"{account}|{folder}"
+
+    def get(self, account: str, folder: str):
+        return self._data.get(self._key(account, folder))
+
+    def save(self, account: str, folder: str, checkpoint: dict):
+        """Persist a checkpoint atomically (write temp file, then rename)"""
+        with self._lock:
+            self._data[self._key(account, folder)] = dict(checkpoint, updated_at=time.time())
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, indent=2)
+            os.replace(tmp_path, self.path)
+
+_store = None
+
+def get_store():
+    """Process-wide checkpoint store (IMAP_CHECKPOINT_PATH overrides the location)"""
+    global _store
+    if _store is None:
+        _store = CheckpointStore(os.environ.get("IMAP_CHECKPOINT_PATH", DEFAULT_PATH))
+    return _store
+
+# ============================================
+# Sync
+# ============================================
+
+class SyncPlan:
+    """UIDs to fetch for one folder plus the checkpoint to commit once they are handled"""
+
+    def __init__(self, account, folder, uids, uidvalidity, highestmodseq, previous, uidnext=None):
+        self.account = account
+        self.folder = folder
+        self.uids = uids
+        self.uidvalidity = uidvalidity
+        self.highestmodseq = highestmodseq
+        self.uidnext = uidnext
+        self.previous = previous or {}
+
+    def commit(self, processed_uids=None, store=None):
+        """Advance the checkpoint past processed_uids (default: every planned UID).
+
+        When only part of the plan was processed (a fetch limit, or messages
+        that failed and should be retried), the old HIGHESTMODSEQ is kept so
+        flag changes are looked at again, last_uid stops below the first
+        unprocessed UID, and the processed UIDs are recorded so the next
+        search skips them (fetching with BODY.PEEK leaves them UNSEEN). A complete run clears
+        that list and moves last_uid up to UIDNEXT - 1, so the next run can
+        skip the SEARCH when nothing arrived, even if the newest message was
+        already read.
+        """
+        store = store or get_store()
+        processed = set(self.uids if processed_uids is None else processed_uids)
+        pending = [uid for uid in self.uids if uid not in processed]
+        complete = not pending
+        # A planned UID that was skipped (failed, no result) stays above last_uid to be searched again
+        last_uid = max((uid for uid in processed if not pending or uid < pending[0]), default=0)
+        same_mailbox = self.previous.get('uidvalidity') == self.uidvalidity
+        if same_mailbox:
+            last_uid = max(last_uid, self.previous.get('last_uid', 0))
+
+        if complete:
+            if self.uidnext:
+                last_uid = max(last_uid, self.uidnext - 1)
+            highestmodseq, done = self.highestmodseq, []
+        else:
+            highestmodseq = self.previous.get('highestmodseq') if same_mailbox else None
+            done = sorted(set(self.previous.get('processed', []) if same_mailbox else []) | set(processed))
+
+        store.save(self.account, self.folder, {
+            'uidvalidity': self.uidvalidity,
+            'last_uid': last_uid,
+            'highestmodseq': highestmodseq,
+            'processed': done
+        })
+
+def plan_sync(imap, account: str, folder: str = 'INBOX', store=None) -> SyncPlan:
+    """Work out which unread UIDs are new since the last checkpoint.
+
+    - No checkpoint, or UIDVALIDITY changed: full UNSEEN search.
+    - UIDNEXT and HIGHESTMODSEQ unchanged: nothing new, no SEARCH is sent.
+    - CONDSTORE available: UNSEEN MODSEQ > checkpoint, which also catches
+      older messages marked unread again, minus the UIDs an interrupted or
+      limited run already processed.
+    - Otherwise: UNSEEN in the UID range above the last seen UID, minus
+      the same processed UIDs.
+    """
+    store = store or get_store()
+    status = imap.select_folder(folder)
+    uidvalidity = status.get(b'UIDVALIDITY')
+    uidnext = status.get(b'UIDNEXT')
+    highestmodseq = status.get(b'HIGHESTMODSEQ')
+
+    checkpoint = store.get(account, folder) if incremental_enabled() else None
+
+    if not checkpoint or checkpoint.get('uidvalidity') != uidvalidity:
+        uids = imap.search(['UNSEEN'])
+    else:
+        last_uid = checkpoint.get('last_uid', 0)
+        last_modseq = checkpoint.get('highestmodseq')
+        nothing_new = uidnext is not None and uidnext <= last_uid + 1
+        flags_unchanged = highestmodseq is None or highestmodseq == last_modseq
+
+        if nothing_new and flags_unchanged:
+            uids = []
+        elif highestmodseq is not None and last_modseq is not None:
+            done = set(checkpoint.get('processed', []))
+            uids = [uid for uid in imap.search(['UNSEEN', 'MODSEQ', str(last_modseq + 1)]) if uid not in done]
+        else:
+            done = set(checkpoint.get('processed', []))
+            uids = [uid for uid in imap.search(['UNSEEN', 'UID', f'{last_uid + 1}:*'])
+                    if uid > last_uid and uid not in done]
+
+    return SyncPlan(account, folder, sorted(uids), uidvalidity, highestmodseq, checkpoint, uidnext)
@@ -0,0 +1,185 @@
+import base64
+import binascii
+import codecs
+import quopri
+import re
+from email import policy
+from email.parser import BytesHeaderParser
+from html import unescape
+
+# ============================================
+# Streaming MIME Text Extraction
+# ============================================
+
+DEFAULT_MAX_BYTES = 8192
+CHUNK_SIZE = 8192
+
+_header_parser = BytesHeaderParser(policy=policy.compat32)
+
+def decode_payload(data: bytes, encoding: str, charset: str) -> str:
+    """Undo the transfer encoding and decode with the declared charset.
+
+    Tolerates truncated input: a partial base64 quantum is dropped and an
+    unknown charset falls back to UTF-8.
+    """
+    encoding = (encoding or '7bit').strip().lower()
+    if encoding == 'base64':
+        compact = b''.join(data.split())
+        compact = compact[:len(compact) - len(compact) % 4]
+        try:
+            data = base64.b64decode(compact)
+        except (binascii.Error, ValueError):
+            data = b''
+    elif encoding == 'quoted-printable':
+        data = quopri.decodestring(data)
+
+    charset = (charset or 'utf-8').strip().strip('"').lower()
+    try:
+        codecs.lookup(charset)
+    except LookupError:
+        charset = 'utf-8'
+    return data.decode(charset, errors='ignore')
+
+# ============================================
+# HTML to Text
+# ============================================
+
+_SKIP_BLOCKS = re.compile(r'<(script|style|head|title)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_BLOCK_TAGS = re.compile(r'<\s*/?\s*(p|div|br|li|tr|table|h[1-6]|blockquote|hr)\b[^>]*>', re.IGNORECASE)
+_ANY_TAG = re.compile(r'<[^>]*>|<!--.*?-->', re.DOTALL)
+
+def html_to_text(html: str) -> str:
+    """Cheap HTML to text: drop script/style, keep block breaks, collapse whitespace.
+    
+    Regex based rather than html.parser, which is several times slower and
+    not needed for feeding a prompt.
+    """
+    text = _SKIP_BLOCKS.sub(' ', html)
+    text = _BLOCK_TAGS.sub('\n', text)
+    text = _ANY_TAG.sub('', text)
+    text = unescape(text).replace('\xa0', ' ')
+    text = re.sub(r'[ \t\r\f\v]+', ' ', text)
+    text = re.sub(r' *\n[ \n]*', '\n', text)
+    return text.strip()
+
+# ============================================
+# Streaming Extractor
+# ============================================
+
+def _iter_lines(source, chunk_size=CHUNK_SIZE):
+    """Yield lines (with their endings) from bytes, a binary file or an iterable of chunks"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = bytes(source)
+        chunks = (source[i:i + chunk_size] for i in range(0, len(source), chunk_size))
+    elif hasattr(source, 'read'):
+        chunks = iter(lambda: source.read(chunk_size), b'')
+    else:
+        chunks = source
+
+    pending = b''
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+    if pending:
+        yield pending
+
+class _Part:
+    """Headers of the MIME part currently being read"""
+
+    def __init__(self, header_bytes: bytes):
+        headers = _header_parser.parsebytes(header_bytes)
+        self.content_type = headers.get_content_type()
+        self.boundary = headers.get_param('boundary')
+        self.charset = headers.get_content_charset() or 'utf-8'
+        self.encoding = str(headers.get('Content-Transfer-Encoding', '7bit'))
+        disposition = str(headers.get('Content-Disposition', '')).split(';')[0].strip().lower()
+        self.is_attachment = disposition == 'attachment'
+
+def extract_text(source, max_bytes: int = DEFAULT_MAX_BYTES) -> str:
+    """Return the first usable text body of a raw RFC 822 message.
+
+    `source` is bytes, a binary file object or an iterable of byte chunks;
+    it is consumed incrementally and reading stops as soon as the first
+    text/plain part is complete (or `max_bytes` of it have been read).
+    When the message has no text/plain part, the first text/html part is
+    converted to text instead. Attachments are skipped without being
+    buffered, so memory stays around `max_bytes` whatever the message size.
+    """
+    boundaries = []          # open multipart boundaries, innermost last
+    header_lines = []
+    state = 'headers'        # headers | collect | skip
+    part = None
+    collected = []
+    collected_size = 0
+    html_fallback = None     # (bytes, encoding, charset)
+
+    def finish():
+        """Close the part being collected; return text if it was text/plain"""
+        nonlocal html_fallback
+        if state != 'collect':
+            return None
+        data = b''.join(collected)
+        if part.content_type == 'text/plain':
+            return decode_payload(data, part.encoding, part.charset)
+        if html_fallback is None:
+            html_fallback = (data, part.encoding, part.charset)
+        return None
+
+    for line in _iter_lines(source):
+        stripped = line.rstrip()
+
+        # Boundary lines switch parts at any nesting level
+        if boundaries and stripped.startswith(b'--'):
+            marker = stripped[2:]
+            matched = None
+            for depth in range(len(boundaries) - 1, -1, -1):
+                if marker == boundaries[depth] or marker == boundaries[depth] + b'--':
+                    matched = depth
+                    break
+            if matched is not None:
+                text = finish()
+                if text is not None:
+                    return text.strip()
+                collected, collected_size = [], 0
+                if marker.endswith(b'--') and marker != boundaries[matched]:
+                    del boundaries[matched:]
+                    state = 'skip'
+                else:
+                    del boundaries[matched + 1:]
+                    state = 'headers'
+                    header_lines = []
+                continue
+
+        if state == 'headers':
+            if stripped:
+                header_lines.append(line)
+                continue
+            part = _Part(b''.join(header_lines))
+            if part.content_type.startswith('multipart/') and part.boundary:
+                boundaries.append(part.boundary.encode('ascii', errors='ignore'))
+                state = 'skip'  # preamble until the first boundary
+            elif part.is_attachment:
+                state = 'skip'
+            elif part.content_type == 'text/plain' or (
+                    part.content_type == 'text/html' and html_fallback is None):
+                state = 'collect'
+            else:
+                state = 'skip'
+            continue
+
+        if state == 'collect':
+            if collected_size < max_bytes:
+                collected.append(line[:max_bytes - collected_size])
+                collected_size += len(collected[-1])
+            if collected_size >= max_bytes and part.content_type == 'text/plain':
+                return finish().strip()
+
+    text = finish()
+    if text is not None:
+        return text.strip()
+    if html_fallback is not None:
+        return html_to_text(decode_payload(*html_fallback))
+    return ''
@@ -0,0 +1,235 @@
+from email.utils import parseaddr
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import numpy as np
+
+# ============================================
+# Near-Duplicate Detection (MinHash + LSH)
+# ============================================
+#
+# Bursts of near-identical emails ("payment not working" from hundreds of
+# customers during an outage) reuse the classification and draft of the
+# first one instead of each costing fresh LLM calls.
+#
+# Each email gets a NUM_PERM-value MinHash signature of its normalized
+# word bigrams; the share of equal values estimates Jaccard similarity.
+# Signatures are split into BANDS bands of ROWS values, and only emails
+# sharing a whole band are compared (LSH), via an indexed SQLite table so
+# millions of entries stay on disk. Recent signatures are also kept in a
+# fixed-size in-memory ring, scanned first in one vectorized comparison.
+# (SimHash was tried first but is too noisy on texts this short.)
+
+DEFAULT_PATH = os.path.join(".cache", "near_dup.sqlite3")
+DEFAULT_THRESHOLD = 0.6
+DEFAULT_MAX_ENTRIES = 1_000_000
+MEMORY_ENTRIES = 10_000
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MIN_SHINGLES = 8  # very short emails ("thanks!") are too generic to reuse a reply for
+
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(20240601)
+_PERM_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.uint64)
+_PERM_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.uint64)
+
+_QUOTED = re.compile(r'^\s*>.*$', re.MULTILINE)
+_URL = re.compile(r'https?://\S+|www\.\S+')
+_ADDRESS = re.compile(r'\S+@\S+')
+_NUMBER = re.compile(r'\d+')
+_WORD = re.compile(r"[a-z#][a-z#']*")
+_SUBJECT_PREFIX = re.compile(r'^\s*((re|fwd?|aw)\s*:\s*)+', re.IGNORECASE)
+
+def normalize(email_data: dict) -> list:
+    """Subject + body as a word list with quotes, URLs, addresses and numbers masked"""
+    subject = _SUBJECT_PREFIX.sub('', email_data.get('subject', '') or '')
+    body = _QUOTED.sub(' ', email_data.get('body', '') or '')
+    text = f"{subject} {body}".lower()
+    text = _URL.sub(' url ', text)
+    text = _ADDRESS.sub(' address ', text)
+    text = _NUMBER.sub('#', text)
+    return _WORD.findall(text)
+
+def minhash(words: list):
+    """MinHash signature (uint32[NUM_PERM]) of word bigrams; None when the text is too short"""
+    shingles = {f"{words[i]} {words[i + 1]}" for i in range(len(words) - 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in shingles],
+        dtype=np.uint64
+    )
+    # One universal hash per permutation, all shingles at once: (a*h + b) mod p
+    return ((hashes[:, None] * _PERM_A + _PERM_B) % _PRIME).min(axis=0).astype(np.uint32)
+
+def band_keys(signature: np.ndarray) -> list:
+    """One signed 64-bit key per band (SQLite integers are signed)"""
+    keys = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS].tobytes() + bytes([band])
+        keys.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), 'little', signed=True))
+    return keys
+
+def first_name(address: str) -> str:
+    name = parseaddr(address or '')[0].strip().strip('"')
+    return name.split()[0] if name else ''
+
+def adapt_draft(draft: str, old_from: str, new_from: str) -> str:
+    """Light personalisation: swap the original sender's first name for the new one"""
+    old_name, new_name = first_name(old_from), first_name(new_from)
+    if not draft or not old_name or old_name == new_name:
+        return draft
+    return re.sub(rf'\b{re.escape(old_name)}\b', new_name or 'there', draft)
+
+class NearDupIndex:
+    """Persisted MinHash LSH index of drafted emails with an in-memory ring of recent ones"""
+
+    def __init__(self, path: str = DEFAULT_PATH, threshold: float = DEFAULT_THRESHOLD,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, memory_entries: int = MEMORY_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.stats = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        self._ring = np.zeros((memory_entries, NUM_PERM), dtype=np.uint32)
+        self._ring_ids = np.full(memory_entries, -1, dtype=np.int64)
+        self._ring_pos = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                signature BLOB NOT NULL,
+                sender TEXT,
+                classification TEXT NOT NULL,
+                draft TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS bands (
+                key INTEGER NOT NULL,
+                entry_id INTEGER NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_bands_key ON bands (key)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_bands_entry ON bands (entry_id)")
+        self._count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def _remember(self, row_id: int, signature: np.ndarray):
+        self._ring[self._ring_pos] = signature
+        self._ring_ids[self._ring_pos] = row_id
+        self._ring_pos = (self._ring_pos + 1) % len(self._ring_ids)
+
+    def _nearest(self, signature: np.ndarray):
+        """(entry id, estimated Jaccard) of the most similar indexed email above threshold"""
+        valid = self._ring_ids >= 0
+        if valid.any():
+            similarity = (self._ring[valid] == signature).mean(axis=1)
+            best = int(similarity.argmax())
+            if similarity[best] >= self.threshold:
+                return int(self._ring_ids[valid][best]), float(similarity[best])
+
+        keys = band_keys(signature)
+        rows = self._db.execute(
+            f"SELECT id, signature FROM entries WHERE id IN "
+            f"(SELECT entry_id FROM bands WHERE key IN ({', '.join('?' * len(keys))}))",
+            keys
+        ).fetchall()
+        best = None
+        for row_id, stored in rows:
+            similarity = float((np.frombuffer(stored, dtype=np.uint32) == signature).mean())
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (row_id, similarity)
+        return best
+
+    def lookup(self, email_data: dict):
+        """(classification, adapted draft, similarity) of a near-duplicate, or None"""
+        signature = minhash(normalize(email_data))
+        if signature is None:
+            return None
+        with self._lock:
+            match = self._nearest(signature)
+            row = match and self._db.execute(
+                "SELECT sender, classification, draft FROM entries WHERE id = ?", (match[0],)
+            ).fetchone()
+            if not row:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+        sender, classification, draft = row
+        classification = dict(json.loads(classification), source='near_duplicate')
+        return classification, adapt_draft(draft, sender, email_data.get('from', '')), match[1]
+
+    def add(self, email_data: dict, classification: dict, draft):
+        """Index a drafted email so later near-duplicates can reuse its result"""
+        signature = minhash(normalize(email_data))
+        if signature is None:
+            return
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                cur = self._db.execute(
+                    "INSERT INTO entries (signature, sender, classification, draft, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (signature.tobytes(), email_data.get('from', ''), json.dumps(classification), draft, time.time())
+                )
+                self._db.executemany(
+                    "INSERT INTO bands (key, entry_id) VALUES (?, ?)",
+                    [(key, cur.lastrowid) for key in band_keys(signature)]
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._remember(cur.lastrowid, signature)
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """Drop the oldest entries down to 90% of max_entries, keeping disk use bounded"""
+        cutoff = self._db.execute(
+            "SELECT id FROM entries ORDER BY id DESC LIMIT 1 OFFSET ?", (int(self.max_entries * 0.9),)
+        ).fetchone()
+        if cutoff is None:
+            return
+        self._db.execute("DELETE FROM bands WHERE entry_id <= ?", cutoff)
+        self._db.execute("DELETE FROM entries WHERE id <= ?", cutoff)
+        self._count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def summary(self) -> str:
+        lookups = self.stats['hits'] + self.stats['misses']
+        rate = (self.stats['hits'] / lookups * 100) if lookups else 0.0
+        return f"{self.stats['hits']}/{lookups} drafts reused ({rate:.0f}%), {self._count} indexed"
+
+_index = None
+
+def enabled() -> bool:
+    """Draft reuse is on unless NEAR_DUP_DISABLED=1"""
+    return os.environ.get("NEAR_DUP_DISABLED", "").lower() not in ("1", "true", "yes")
+
+def get_index():
+    """Process-wide index (NEAR_DUP_PATH, NEAR_DUP_THRESHOLD, NEAR_DUP_MAX_ENTRIES); None when disabled"""
+    global _index
+    if not enabled():
+        return None
+    if _index is None:
+        _index = NearDupIndex(
+            path=os.environ.get("NEAR_DUP_PATH", DEFAULT_PATH),
+            threshold=float(os.environ.get("NEAR_DUP_THRESHOLD", DEFAULT_THRESHOLD)),
+            max_entries=int(os.environ.get("NEAR_DUP_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        )
+    return _index
+
+def summary() -> str:
+    index = get_index()
+    return index.summary() if index else "disabled"
@@ -0,0 +1,315 @@
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+import telemetry
+
+# ============================================
+# Built-in CPU and Memory Profiling
+# ============================================
+#
+# `--profile` on the CLIs (or ?profile=1 on the Streamlit apps) runs the
+# whole pass under a Profiler; `--profile cpu` / `--profile memory` (or
+# ?profile=cpu) keep just one half. worker.py profiles each process until
+# it stops, emailpro.py each send it makes:
+#
+# - A sampling thread reads every thread's Python stack each
+#   PROFILE_INTERVAL seconds and files it under that thread's current
+#   telemetry stage (imap.fetch, mime.parse, llm.draft...). Samples are
+#   weighted by the CPU time the thread used since the previous sample, so
+#   time blocked on IMAP, SMTP or the LLM drops out of the CPU profile; the
+#   wall-clock profile keeps it.
+# - tracemalloc records allocations (PROFILE_MEMORY_FRAMES deep) and a
+#   snapshot is kept from the point where traced memory peaked. It slows
+#   allocation-heavy code several times over, which also skews the CPU
+#   profile towards it; use `cpu` alone for CPU shares you can trust.
+#
+# Written to profiling/<label>_<timestamp>/ (PROFILE_DIR overrides the
+# parent directory):
+#   cpu.folded, wall.folded           all stages, stage name as the root frame
+#   cpu_<stage>.folded                one flamegraph per stage
+#   memory.folded                     live bytes at the peak, by allocation stack
+#   report.txt                        top stages, functions and allocators
+# Folded stacks load in speedscope, or: flamegraph.pl cpu.folded > cpu.svg
+
+DEFAULT_DIR = "profiling"
+DEFAULT_INTERVAL = 0.005
+DEFAULT_MEMORY_FRAMES = 12  # deep enough to reach the repo's caller of most email/ allocations
+MODES = ('all', 'cpu', 'memory')
+ON = ('1', 'true', 'yes', 'on')  # ?profile=true etc. mean 'all'
+OFF = ('', '0', 'false', 'no', 'off')
+SNAPSHOT_SECONDS = 5.0  # how often the sampler checks for a new memory peak
+UNTRACED = 'untraced'
+TOP = 15
+
+# Allocation stacks through these files count as the fetch/parse path
+FETCH_PARSE_FILES = ('imap_fetch.py', 'mime_extract.py', 'mailbox_sync.py', 'imapclient', 'imaplib.py',
+                     os.path.join('email', ''))
+
+_labels = {}
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+def _fold(frame) -> list:
+    """Frame labels from the outermost call to the innermost"""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+def _thread_cpu(thread_id: int):
+    """CPU seconds used by a thread, or None where the platform cannot tell"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError, OverflowError, ValueError):
+        return None
+
+def _safe(name: str) -> str:
+    return "".join(c if c.isalnum() or c in '._-' else '_' for c in name)
+
+class Profiler:
+    """Sampling CPU profile per telemetry stage plus tracemalloc peak snapshot"""
+
+    def __init__(self, output_dir: str, cpu: bool = True, memory: bool = True, interval: float = DEFAULT_INTERVAL,
+                 memory_frames: int = DEFAULT_MEMORY_FRAMES):
+        self.output_dir = output_dir
+        self.profile_cpu = cpu
+        self.profile_memory = memory
+        self.interval = interval
+        self.memory_frames = memory_frames
+        self.cpu = collections.defaultdict(collections.Counter)   # stage -> {stack: microseconds}
+        self.wall = collections.defaultdict(collections.Counter)  # stage -> {stack: samples}
+        self.samples = 0
+        self.started = None
+        self.elapsed = 0.0
+        self.peak_memory = 0
+        self.snapshot = None
+        self.allocations = []  # snapshot statistics by traceback, computed once at stop()
+        self._snapshot_size = 0
+        self._stages = {}  # thread id -> stages entered, innermost last
+        self._last_cpu = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._owns_tracemalloc = False
+        self._switch_interval = None
+
+    # ---------- stage tracking ----------
+
+    def _on_span(self, event: str, span):
+        stages = self._stages.setdefault(threading.get_ident(), [])
+        if event == 'start':
+            stages.append(span.name)
+        elif span.name in stages:
+            # The last entry of that name, not pop(): async tasks sharing a thread finish out of order
+            del stages[len(stages) - 1 - stages[::-1].index(span.name)]
+
+    # ---------- sampling ----------
+
+    def _sample(self):
+        me = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            stages = self._stages.get(thread_id)
+            stage = stages[-1] if stages else UNTRACED
+            stack = ';'.join([stage] + _fold(frame))
+            self.wall[stage][stack] += 1
+            cpu = _thread_cpu(thread_id)
+            previous = self._last_cpu.get(thread_id)
+            self._last_cpu[thread_id] = cpu
+            if cpu is not None and previous is not None and cpu > previous:
+                self.cpu[stage][stack] += int((cpu - previous) * 1e6)
+        self.samples += 1
+
+    def _check_memory(self):
+        """Keep a snapshot from the highest point of traced memory seen so far"""
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak_memory = max(self.peak_memory, peak)
+        if current > self._snapshot_size * 1.1:
+            self.snapshot = tracemalloc.take_snapshot()
+            self._snapshot_size = current
+
+    def _run(self):
+        next_check = time.monotonic() + SNAPSHOT_SECONDS
+        while not self._stop.wait(self.interval):
+            if self.profile_cpu:
+                self._sample()
+            if self.profile_memory and time.monotonic() >= next_check:
+                self._check_memory()
+                next_check = time.monotonic() + SNAPSHOT_SECONDS
+
+    def start(self):
+        # The sampler can only look at a stack when it gets the GIL; a short switch interval
+        # keeps samples from piling up on calls that release it (socket reads, os.urandom)
+        self._switch_interval = sys.getswitchinterval()
+        if self.profile_cpu:
+            sys.setswitchinterval(min(self._switch_interval, self.interval / 10))
+        if self.profile_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.memory_frames)
+            self._owns_tracemalloc = True
+        telemetry.add_listener(self._on_span)
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        telemetry.remove_listener(self._on_span)
+        sys.setswitchinterval(self._switch_interval)
+        self.elapsed = time.perf_counter() - self.started
+        if not self.profile_memory:
+            return
+        self._check_memory()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+        if self.snapshot is not None:
+            self.snapshot = self.snapshot.filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__)
+            ])
+            self.allocations = self.snapshot.statistics('traceback')
+
+    # ---------- analysis ----------
+
+    def stage_cpu(self) -> list:
+        """[(stage, cpu seconds, wall samples)], busiest first"""
+        stages = set(self.cpu) | set(self.wall)
+        rows = [(stage, sum(self.cpu[stage].values()) / 1e6, sum(self.wall[stage].values())) for stage in stages]
+        return sorted(rows, key=lambda row: (-row[1], -row[2]))
+
+    def top_functions(self, limit: int = TOP) -> list:
+        """[(cpu seconds, stage, innermost Python function)] by self time"""
+        totals = collections.Counter()
+        for stage, stacks in self.cpu.items():
+            for stack, micros in stacks.items():
+                totals[(stage, stack.rsplit(';', 1)[-1])] += micros
+        return [(micros / 1e6, stage, function) for (stage, function), micros in totals.most_common(limit)]
+
+    def top_allocators(self, limit: int = TOP, files: tuple = None) -> list:
+        """[(bytes, blocks, allocation site, nearest caller in this repo)] at the memory peak.
+
+        With `files`, only allocations whose stack passes through one of
+        them (e.g. FETCH_PARSE_FILES) are counted.
+        """
+        here = os.path.dirname(os.path.abspath(__file__))
+        totals = collections.defaultdict(lambda: [0, 0])
+        for stat in self.allocations:
+            frames = list(stat.traceback)  # oldest call first
+            if files and not any(part in frame.filename for frame in frames for part in files):
+                continue
+            site = frames[-1]
+            caller = next((f for f in reversed(frames[:-1])
+                           if f.filename.startswith(here) and 'site-packages' not in f.filename), None)
+            key = (f"{site.filename}:{site.lineno}",
+                   f"{os.path.basename(caller.filename)}:{caller.lineno}" if caller else "-")
+            totals[key][0] += stat.size
+            totals[key][1] += stat.count
+        rows = sorted(((size, count, site, caller) for (site, caller), (size, count) in totals.items()),
+                      reverse=True)
+        return rows[:limit]
+
+    # ---------- output ----------
+
+    def _write_folded(self, filename: str, stacks):
+        with open(os.path.join(self.output_dir, filename), 'w', encoding='utf-8') as f:
+            for stack, weight in sorted(stacks.items()):
+                if weight:
+                    f.write(f"{stack} {weight}\n")
+
+    def report(self) -> str:
+        lines = [f"Profiled {self.elapsed:.1f}s"]
+        if self.profile_cpu:
+            lines[0] += f", {self.samples} samples every {self.interval * 1000:g} ms"
+            lines += ["", "CPU by stage (on-CPU seconds, wall-clock samples):"]
+            for stage, seconds, samples in self.stage_cpu():
+                lines.append(f"  {stage:<24} {seconds:9.3f}s {samples:9d}")
+            lines += ["", "Top functions by CPU (innermost Python frame):"]
+            for seconds, stage, function in self.top_functions():
+                lines.append(f"  {seconds:9.3f}s  {stage:<20} {function}")
+        if not self.profile_memory:
+            return "\n".join(lines) + "\n"
+        lines[0] += f", peak traced memory {self.peak_memory / 1e6:.1f} MB"
+        for title, files in (("Top allocators at the memory peak:", None),
+                             ("Top allocators in the fetch/parse path:", FETCH_PARSE_FILES)):
+            lines += ["", title, f"  {'KB':>10} {'blocks':>8}  allocation site  (called from)"]
+            for size, count, site, caller in self.top_allocators(files=files):
+                lines.append(f"  {size / 1024:10.1f} {count:8d}  {site}  ({caller})")
+        return "\n".join(lines) + "\n"
+
+    def write(self) -> str:
+        """Write the folded stacks and report.txt; returns the report"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        all_cpu = collections.Counter()
+        all_wall = collections.Counter()
+        for stage in set(self.cpu) | set(self.wall):
+            all_cpu.update(self.cpu[stage])
+            all_wall.update(self.wall[stage])
+            if self.cpu[stage]:
+                self._write_folded(f"cpu_{_safe(stage)}.folded", self.cpu[stage])
+        if self.profile_cpu:
+            self._write_folded("cpu.folded", all_cpu)
+            self._write_folded("wall.folded", all_wall)
+        if self.allocations:
+            memory = collections.Counter()
+            for stat in self.allocations:
+                memory[';'.join(f"{os.path.basename(f.filename)}:{f.lineno}" for f in stat.traceback)] += stat.size
+            self._write_folded("memory.folded", memory)
+        report = self.report()
+        with open(os.path.join(self.output_dir, "report.txt"), 'w', encoding='utf-8') as f:
+            f.write(report)
+        return report
+
+def output_dir(label: str) -> str:
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(os.environ.get("PROFILE_DIR", DEFAULT_DIR), f"{label}_{stamp}")
+
+def parse_mode(value):
+    """A MODES entry for a --profile / ?profile= value, None when off; ValueError if unrecognised"""
+    if value in (None, False) or str(value).strip().lower() in OFF:
+        return None
+    if value is True or str(value).strip().lower() in ON:
+        return 'all'
+    mode = str(value).strip().lower()
+    if mode not in MODES:
+        raise ValueError(f"Unknown profile mode '{value}' (choose from {', '.join(MODES)})")
+    return mode
+
+@contextlib.contextmanager
+def profiling(mode: str = 'all', label: str = "run"):
+    """Profile the block in `mode` (anything parse_mode accepts: 'all'/'1'/'true', 'cpu', 'memory').
+
+    Yields the Profiler (None when off) and writes its output on exit.
+    """
+    mode = parse_mode(mode)
+    if mode is None:
+        yield None
+        return
+    profiler = Profiler(
+        output_dir(label),
+        cpu=mode in ('all', 'cpu'),
+        memory=mode in ('all', 'memory'),
+        interval=float(os.environ.get("PROFILE_INTERVAL", DEFAULT_INTERVAL)),
+        memory_frames=int(os.environ.get("PROFILE_MEMORY_FRAMES", DEFAULT_MEMORY_FRAMES))
+    )
+    if profiler.profile_memory:
+        print("🔬 Profiling (tracemalloc slows the run down; compare timings within this run only)")
+    else:
+        print("🔬 Profiling CPU")
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        report = profiler.write()
+        print(f"\n{report}🔬 Profile written to {profiler.output_dir}/")
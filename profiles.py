@@ -0,0 +1,180 @@
+import collections
+import contextvars
+import json
+import os
+import threading
+
+# ============================================
+# Per-Stage Generation Profiles
+# ============================================
+#
+# Each LLM call names its stage (classify, triage, draft, summarize) and
+# gets that stage's model, thinking budget, output cap and temperature
+# from the active preset. Classification needs a handful of tokens and no
+# reasoning, so every preset but 'default' runs it with thinking off and a
+# tiny output cap. Measured latency is recorded per stage.
+#
+# Pick a preset with GENERATION_PRESET, the --generation CLI flag or the
+# UI sidebar; GENERATION_PROFILES='{"draft": {"temperature": 0.2}}'
+# overrides single fields on top of it. The CLIs set the process-wide
+# preset (set_preset); the Streamlit apps and worker jobs, which share a
+# process with other sessions, set it for their own context (use_preset).
+
+STAGES = ('classify', 'triage', 'draft', 'summarize')
+FIELDS = ('model', 'thinking_budget', 'max_output_tokens', 'temperature')
+DEFAULT_PRESET = 'balanced'
+
+_CLASSIFY = {'thinking_budget': 0, 'max_output_tokens': 96, 'temperature': 0.0}
+
+PRESETS = {
+    # Model defaults everywhere: the behaviour before profiles existed
+    'default': {},
+    'fast': {
+        'classify': _CLASSIFY,
+        'triage': {'thinking_budget': 0, 'max_output_tokens': 1024, 'temperature': 0.3},
+        'draft': {'thinking_budget': 0, 'max_output_tokens': 768, 'temperature': 0.5},
+        'summarize': {'thinking_budget': 0, 'max_output_tokens': 256, 'temperature': 0.2},
+    },
+    'balanced': {
+        'classify': _CLASSIFY,
+        'triage': {'thinking_budget': 512, 'max_output_tokens': 1024, 'temperature': 0.5},
+        'draft': {'thinking_budget': 512, 'max_output_tokens': 768, 'temperature': 0.7},
+        'summarize': {'thinking_budget': 0, 'max_output_tokens': 384, 'temperature': 0.2},
+    },
+    'quality': {
+        'classify': _CLASSIFY,
+        'triage': {'thinking_budget': 2048, 'max_output_tokens': 1536, 'temperature': 0.5},
+        'draft': {'model': 'models/gemini-2.5-pro', 'thinking_budget': 2048, 'max_output_tokens': 1024,
+                  'temperature': 0.7},
+        'summarize': {'thinking_budget': 1024, 'max_output_tokens': 512, 'temperature': 0.2},
+    },
+}
+
+class Profile:
+    """Generation settings for one stage; None fields keep the caller's / model's default"""
+
+    def __init__(self, stage: str, model: str = None, thinking_budget: int = None,
+                 max_output_tokens: int = None, temperature: float = None):
+        self.stage = stage
+        self.model = model
+        self.thinking_budget = thinking_budget
+        self.max_output_tokens = max_output_tokens
+        self.temperature = temperature
+
+    def apply(self, model: str, config=None):
+        """(model, config) for a call, with this profile's settings merged over `config`"""
+        from google.genai import types
+        fields = {}
+        if self.thinking_budget is not None:
+            fields['thinking_config'] = types.ThinkingConfig(thinking_budget=self.thinking_budget)
+        if self.max_output_tokens is not None:
+            # Gemini 2.5 counts thinking tokens against max_output_tokens; the cap is for the answer
+            fields['max_output_tokens'] = self.max_output_tokens + (self.thinking_budget or 0)
+        if self.temperature is not None:
+            fields['temperature'] = self.temperature
+        if fields:
+            config = types.GenerateContentConfig(**fields) if config is None else config.model_copy(update=fields)
+        return self.model or model, config
+
+    def describe(self) -> str:
+        settings = ", ".join(f"{field}={getattr(self, field)}" for field in FIELDS
+                             if getattr(self, field) is not None)
+        return f"{self.stage}: {settings or 'model defaults'}"
+
+# ============================================
+# Active Preset
+# ============================================
+
+_preset = None
+_context_preset = contextvars.ContextVar('generation_preset', default=None)
+
+def _check(name: str):
+    if name not in PRESETS:
+        raise ValueError(f"Unknown generation preset '{name}' (choose from {', '.join(PRESETS)})")
+
+def set_preset(name: str):
+    """Switch every stage to a preset for the whole process (CLI flag)"""
+    global _preset
+    _check(name)
+    _preset = name
+
+def use_preset(name: str = None):
+    """Preset for the current context only: one Streamlit script run or one worker job.
+
+    None falls back to the process-wide preset. Returns a token for reset_preset().
+    """
+    if name is not None:
+        _check(name)
+    return _context_preset.set(name)
+
+def reset_preset(token):
+    _context_preset.reset(token)
+
+def get_preset() -> str:
+    return _context_preset.get() or _preset or os.environ.get("GENERATION_PRESET", DEFAULT_PRESET)
+
+def get_profile(stage: str) -> Profile:
+    """The active preset's profile for a stage, with GENERATION_PROFILES overrides"""
+    preset = PRESETS.get(get_preset(), PRESETS[DEFAULT_PRESET])
+    settings = dict(preset.get(stage, {}))
+    overrides = json.loads(os.environ.get("GENERATION_PROFILES") or "{}")
+    settings.update({k: v for k, v in overrides.get(stage, {}).items() if k in FIELDS})
+    return Profile(stage, **settings)
+
+def describe() -> str:
+    return f"{get_preset()} — " + "; ".join(get_profile(stage).describe() for stage in STAGES)
+
+# ============================================
+# Latency per Stage
+# ============================================
+
+LATENCY_WINDOW = 500  # most recent calls kept per stage for percentiles
+
+class LatencyStats:
+    """Wall-clock latency of uncached calls, and time to first chunk for streams"""
+
+    def __init__(self):
+        self.totals = {}
+        self.first_chunk = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, first_chunk: float = None):
+        with self._lock:
+            self.totals.setdefault(stage, collections.deque(maxlen=LATENCY_WINDOW)).append(seconds)
+            if first_chunk is not None:
+                self.first_chunk.setdefault(stage, collections.deque(maxlen=LATENCY_WINDOW)).append(first_chunk)
+
+    @staticmethod
+    def _percentile(values, fraction: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def metrics(self) -> dict:
+        """{stage: {'calls', 'p50', 'p95', 'first_chunk_p50'}} over the recent window"""
+        with self._lock:
+            totals = {stage: list(values) for stage, values in self.totals.items()}
+            first = {stage: list(values) for stage, values in self.first_chunk.items()}
+        result = {}
+        for stage, values in totals.items():
+            result[stage] = {'calls': len(values), 'p50': self._percentile(values, 0.5),
+                             'p95': self._percentile(values, 0.95)}
+            if first.get(stage):
+                result[stage]['first_chunk_p50'] = self._percentile(first[stage], 0.5)
+        return result
+
+    def summary(self) -> str:
+        metrics = self.metrics()
+        if not metrics:
+            return "no calls"
+        parts = []
+        for stage, m in sorted(metrics.items()):
+            line = f"{stage}: {m['calls']} call(s), p50 {m['p50']:.2f}s, p95 {m['p95']:.2f}s"
+            if 'first_chunk_p50' in m:
+                line += f", first chunk p50 {m['first_chunk_p50']:.2f}s"
+            parts.append(line)
+        return "; ".join(parts)
+
+latency = LatencyStats()
+
+def summary() -> str:
+    return f"{get_preset()} preset — {latency.summary()}"
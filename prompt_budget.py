@@ -0,0 +1,163 @@
+import os
+import re
+import threading
+
+# ============================================
+# Token-Budgeted Email Bodies for Prompts
+# ============================================
+#
+# Each prompt stage gets a budget of body tokens instead of a fixed
+# character slice. Bodies over budget lose their lowest-value parts first
+# (legal disclaimers, quoted history, signature) and are only then cut,
+# at a sentence boundary.
+
+STAGE_BUDGETS = {
+    'classify': 160,  # a category needs the gist, not the details
+    'draft': 240,
+    'triage': 240,   # classify + draft in one call
+}
+TRUNCATION_MARK = " […]"
+
+_TOKEN = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+def count_tokens(text: str) -> int:
+    """Fast local estimate of Gemini tokens (~4 characters each for English prose).
+
+    Short words are one token, longer ones one per 6 letters; digits go in
+    threes and each punctuation mark counts alone.
+    """
+    total = 0
+    for token in _TOKEN.findall(text or ''):
+        if token[0].isalpha():
+            total += (len(token) + 5) // 6
+        elif token[0].isdigit():
+            total += (len(token) + 2) // 3
+        else:
+            total += 1
+    return total
+
+def budget_for(stage: str) -> int:
+    """Body tokens for a stage; PROMPT_BUDGET_<STAGE> overrides the default"""
+    return int(os.environ.get(f"PROMPT_BUDGET_{stage.upper()}", STAGE_BUDGETS[stage]))
+
+# ---------- low-value content, cheapest to lose first ----------
+
+_BLANK_LINES = re.compile(r'\n\s*\n\s*(\n\s*)+')
+_TRAILING_SPACE = re.compile(r'[ \t]+$', re.MULTILINE)
+_DISCLAIMER = re.compile(
+    r'confidential|privileged|intended (solely )?for the|if you (are not|have received this)'
+    r'|disclaimer|virus(es)? (free|checked)|please consider the environment before printing',
+    re.IGNORECASE
+)
+_HISTORY_START = re.compile(
+    r'^(On .{0,200}wrote:\s*$|-{2,}\s*Original Message\s*-{2,}|_{10,}\s*$'
+    r'|From: .*\n(Sent|Date): )',
+    re.MULTILINE | re.IGNORECASE
+)
+_QUOTED = re.compile(r'^\s*>.*\n?', re.MULTILINE)
+_SIGNATURE_START = re.compile(
+    r'^(-- ?$|Sent from my \w+|(Best|Kind|Warm)?\s*regards,?\s*$|Thanks,?\s*$|Thank you,?\s*$'
+    r'|Cheers,?\s*$|Sincerely,?\s*$|Best,?\s*$)',
+    re.MULTILINE | re.IGNORECASE
+)
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+
+def drop_disclaimers(text: str) -> str:
+    paragraphs = re.split(r'\n\s*\n', text)
+    return '\n\n'.join(p for p in paragraphs if not (len(p) > 80 and _DISCLAIMER.search(p)))
+
+def drop_quoted_history(text: str) -> str:
+    match = _HISTORY_START.search(text)
+    if match and match.start() > 0:
+        text = text[:match.start()]
+    return _QUOTED.sub('', text)
+
+def drop_signature(text: str) -> str:
+    """Cut from the last sign-off, if it is near the end of the message"""
+    matches = list(_SIGNATURE_START.finditer(text))
+    if matches and matches[-1].start() > 0 and text.count('\n', matches[-1].start()) <= 8:
+        return text[:matches[-1].start()]
+    return text
+
+def truncate(text: str, budget: int) -> str:
+    """Whole sentences up to `budget` tokens; words only if the first sentence is too long.
+
+    If not even the first word fits (a long URL, base64 residue), its
+    first ~4 characters per token are kept instead of nothing.
+    """
+    kept, used = [], 0
+    position = 0
+    for match in list(_SENTENCE_END.finditer(text)) + [None]:
+        end = match.start() if match else len(text)
+        sentence = text[position:end]
+        cost = count_tokens(sentence)
+        if used + cost > budget:
+            break
+        kept.append(text[position:match.end() if match else end])
+        used += cost
+        position = match.end() if match else end
+    if kept:
+        return ''.join(kept).rstrip() + TRUNCATION_MARK
+
+    words, used = [], 0
+    for word in text.split():
+        used += count_tokens(word)
+        if used > budget:
+            break
+        words.append(word)
+    if words:
+        return ' '.join(words) + TRUNCATION_MARK
+
+    cut = text[:budget * 4]
+    while cut and count_tokens(cut) > budget:
+        cut = cut[:len(cut) * budget // count_tokens(cut)]
+    return cut.rstrip() + TRUNCATION_MARK
+
+REDUCTIONS = (drop_disclaimers, drop_quoted_history, drop_signature)
+
+# ---------- fitting ----------
+
+class BudgetStats:
+    """Estimated body tokens before and after fitting, per stage"""
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, before: int, after: int):
+        with self._lock:
+            entry = self.stats.setdefault(stage, {'bodies': 0, 'tokens_in': 0, 'tokens_sent': 0})
+            entry['bodies'] += 1
+            entry['tokens_in'] += before
+            entry['tokens_sent'] += after
+
+    def summary(self) -> str:
+        with self._lock:
+            items = sorted(self.stats.items())
+        if not items:
+            return "no prompts built"
+        return "; ".join(f"{stage}: {s['tokens_in']}→{s['tokens_sent']} body tokens over {s['bodies']}"
+                         for stage, s in items)
+
+budget_stats = BudgetStats()
+
+def fit(text: str, budget: int) -> str:
+    """Shrink text to at most `budget` estimated tokens, dropping low-value parts first"""
+    text = _BLANK_LINES.sub('\n\n', _TRAILING_SPACE.sub('', text or '')).strip()
+    for reduce in REDUCTIONS:
+        if count_tokens(text) <= budget:
+            return text
+        text = reduce(text).strip()
+    if count_tokens(text) <= budget:
+        return text
+    return truncate(text, budget)
+
+def fit_body(email_data: dict, stage: str, budget: int = None) -> str:
+    """The email's body fitted to the stage's budget (or an explicit one), with stats recorded"""
+    body = email_data.get('body', '') or ''
+    fitted = fit(body, budget_for(stage) if budget is None else budget)
+    budget_stats.record(stage, count_tokens(body), count_tokens(fitted))
+    return fitted
+
+def summary() -> str:
+    return budget_stats.summary()
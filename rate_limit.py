@@ -0,0 +1,322 @@
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+import telemetry
+
+# ============================================
+# Adaptive Rate Limiting for Gemini Calls
+# ============================================
+#
+# One RateLimiter per model holds a requests/min and a tokens/min token
+# bucket plus an AIMD concurrency limit: every success widens the window a
+# little, every 429/503 halves it. Throttled and transient errors are
+# retried with full-jitter exponential backoff (or the server's
+# RetryInfo delay), so long runs settle right under the quota instead of
+# dying on the first quota error.
+
+DEFAULT_RPM = 1000
+DEFAULT_TPM = 1_000_000
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+DEFAULT_OUTPUT_TOKENS = 512
+
+THROTTLE_CODES = {429, 503}
+RETRY_CODES = THROTTLE_CODES | {500, 502, 504}
+
+_DELAY = re.compile(r'^([\d.]+)s$')
+
+def error_code(exc):
+    """HTTP status of an API error (google.genai errors carry it as .code)"""
+    code = getattr(exc, 'code', None) or getattr(exc, 'status_code', None)
+    return code if isinstance(code, int) else None
+
+def is_retryable(exc) -> bool:
+    return error_code(exc) in RETRY_CODES or isinstance(exc, (ConnectionError, TimeoutError))
+
+def retry_after(exc):
+    """Seconds from a google.rpc.RetryInfo detail ('retryDelay': '23s'), or None"""
+    details = getattr(exc, 'details', None)
+    if isinstance(details, dict):
+        details = details.get('error', details).get('details')
+    for detail in details if isinstance(details, list) else []:
+        match = isinstance(detail, dict) and _DELAY.match(str(detail.get('retryDelay', '')))
+        if match:
+            return float(match.group(1))
+    return None
+
+def estimate_tokens(contents, config=None) -> int:
+    """Rough request cost for the tokens/min bucket: prompt chars / 4 plus expected output"""
+    output = getattr(config, 'max_output_tokens', None) or DEFAULT_OUTPUT_TOKENS
+    return len(str(contents)) // 4 + output
+
+def usage(response) -> tuple:
+    """(input, output, total) tokens from a response's usage_metadata; None where missing"""
+    metadata = getattr(response, 'usage_metadata', None)
+    return (getattr(metadata, 'prompt_token_count', None),
+            getattr(metadata, 'candidates_token_count', None),
+            getattr(metadata, 'total_token_count', None))
+
+class TokenBucket:
+    """Refills at `per_minute` / 60 per second up to one minute's worth.
+
+    reserve() takes the amount at once, letting the balance go negative,
+    and returns how long the caller must wait before using it; this works
+    the same for threads and coroutines.
+    """
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount: float):
+        """Give back (or, when negative, charge) the difference once the real cost is known"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+class AIMDLimit:
+    """Concurrency window: +1/limit per success, halved on throttling"""
+
+    def __init__(self, initial: int = DEFAULT_CONCURRENCY, maximum: int = DEFAULT_MAX_CONCURRENCY):
+        self.maximum = maximum
+        self.limit = float(min(initial, maximum))
+        self.active = 0
+        self._completed = 0  # calls finished since the last decrease
+        self._cond = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.active >= int(self.limit):
+                return False
+            self.active += 1
+            return True
+
+    def acquire(self):
+        with self._cond:
+            while self.active >= int(self.limit):
+                self._cond.wait()
+            self.active += 1
+
+    async def acquire_async(self):
+        # Coroutines must not block the event loop on the condition variable
+        while not self.try_acquire():
+            await asyncio.sleep(0.05)
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def on_success(self):
+        with self._cond:
+            self._completed += 1
+            if self.limit < self.maximum:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+                self._cond.notify()
+
+    def on_throttle(self):
+        # Halve at most once per window of calls, so one burst of 429s counts once
+        with self._cond:
+            self._completed += 1
+            if self._completed >= int(self.limit):
+                self.limit = max(1.0, self.limit / 2)
+                self._completed = 0
+
+class RateLimiter:
+    """Buckets, concurrency window, retries and counters for one model"""
+
+    def __init__(self, model: str, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM,
+                 concurrency: int = DEFAULT_CONCURRENCY, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                 max_retries: int = DEFAULT_MAX_RETRIES):
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.window = AIMDLimit(concurrency, max_concurrency)
+        self.max_retries = max_retries
+        self.stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0, 'wait_seconds': 0.0,
+                      'input_tokens': 0, 'output_tokens': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def _reserve(self, estimate: int) -> float:
+        return max(self.requests.reserve(1), self.tokens.reserve(estimate))
+
+    def _settle(self, estimate: int, response):
+        input_tokens, output_tokens, total = usage(response)
+        if total is not None:
+            self.tokens.refund(estimate - total)
+        self._count('input_tokens', input_tokens or 0)
+        self._count('output_tokens', output_tokens or 0)
+        self.window.on_success()
+
+    def _backoff(self, exc, attempt: int):
+        """Seconds to sleep before retry `attempt`, or None to give up and re-raise"""
+        if not is_retryable(exc) or attempt >= self.max_retries:
+            self._count('errors')
+            return None
+        if error_code(exc) in THROTTLE_CODES:
+            self._count('throttled')
+            self.window.on_throttle()
+        self._count('retries')
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        return max(delay, retry_after(exc) or 0.0)
+
+    def call(self, fn, estimate: int):
+        """fn() under the limits, retried on throttling and transient errors"""
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(estimate)
+            if wait:
+                self._count('wait_seconds', wait)
+                time.sleep(wait)
+            self.window.acquire()
+            try:
+                self._count('requests')
+                response = fn()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                self._settle(estimate, response)
+                return response
+            finally:
+                self.window.release()
+            time.sleep(delay)
+
+    async def call_async(self, fn, estimate: int):
+        """Async variant of call; fn() returns an awaitable"""
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(estimate)
+            if wait:
+                self._count('wait_seconds', wait)
+                await asyncio.sleep(wait)
+            await self.window.acquire_async()
+            try:
+                self._count('requests')
+                response = await fn()
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+            else:
+                self._settle(estimate, response)
+                return response
+            finally:
+                self.window.release()
+            await asyncio.sleep(delay)
+
+    def stream(self, fn, estimate: int):
+        """Yield chunks of fn()'s stream; retried only until the first chunk arrives"""
+        for attempt in range(self.max_retries + 1):
+            wait = self._reserve(estimate)
+            if wait:
+                self._count('wait_seconds', wait)
+                time.sleep(wait)
+            self.window.acquire()
+            started = False
+            try:
+                self._count('requests')
+                last = None
+                for chunk in fn():
+                    started = True
+                    last = chunk
+                    yield chunk
+            except Exception as e:
+                delay = None if started else self._backoff(e, attempt)
+                if delay is None:
+                    if started:
+                        self._count('errors')
+                    raise
+            else:
+                self._settle(estimate, last)
+                return
+            finally:
+                self.window.release()
+            time.sleep(delay)
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"{s['requests']} requests, {s['input_tokens']} in / {s['output_tokens']} out tokens, "
+                f"{s['retries']} retries, {s['throttled']} throttled, {s['errors']} failed, "
+                f"{s['wait_seconds']:.1f}s queued, concurrency {int(self.window.limit)}")
+
+# ============================================
+# Per-Model Limiters
+# ============================================
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def _model_settings(model: str) -> dict:
+    """LLM_RPM / LLM_TPM / LLM_CONCURRENCY / LLM_MAX_CONCURRENCY / LLM_MAX_RETRIES,
+    overridden per model by LLM_RATE_LIMITS='{"models/...": {"rpm": 10, "tpm": 250000}}'"""
+    settings = {
+        'rpm': float(os.environ.get("LLM_RPM", DEFAULT_RPM)),
+        'tpm': float(os.environ.get("LLM_TPM", DEFAULT_TPM)),
+        'concurrency': int(os.environ.get("LLM_CONCURRENCY", DEFAULT_CONCURRENCY)),
+        'max_concurrency': int(os.environ.get("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+        'max_retries': int(os.environ.get("LLM_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+    }
+    overrides = json.loads(os.environ.get("LLM_RATE_LIMITS") or "{}")
+    settings.update(overrides.get(model, {}))
+    return settings
+
+def get_limiter(model: str) -> RateLimiter:
+    """Process-wide limiter for a model, created from the environment on first use"""
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = RateLimiter(model, **_model_settings(model))
+        return _limiters[model]
+
+def metrics() -> dict:
+    """Counters and current concurrency limit per model"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {l.model: dict(l.stats, concurrency=l.window.limit, in_flight=l.window.active) for l in limiters}
+
+_FAMILIES = (
+    # (metrics() key, name, kind, help)
+    ('requests', 'llm_requests_total', 'counter', "API requests sent, retries included"),
+    ('retries', 'llm_retries_total', 'counter', "Requests retried after a throttle or transient error"),
+    ('throttled', 'llm_throttled_total', 'counter', "429/503 answers"),
+    ('errors', 'llm_failures_total', 'counter', "Calls that failed after their retries"),
+    ('wait_seconds', 'llm_queue_wait_seconds_total', 'counter', "Time spent waiting for the rate buckets"),
+    ('in_flight', 'llm_in_flight', 'gauge', "Requests currently in flight"),
+    ('concurrency', 'llm_concurrency_limit', 'gauge', "Current AIMD concurrency window"),
+)
+
+def collect() -> list:
+    """Per-model counters and windows as metric families for telemetry's /metrics"""
+    per_model = metrics()
+    return [(f"{telemetry.PREFIX}_{name}", kind, help,
+             [({'model': model}, values[key]) for model, values in sorted(per_model.items())])
+            for key, name, kind, help in _FAMILIES]
+
+telemetry.register_collector(collect)
+
+def summary() -> str:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    if not limiters:
+        return "no calls"
+    return "; ".join(f"{l.model.rsplit('/', 1)[-1]}: {l.summary()}" for l in limiters)
@@ -0,0 +1,124 @@
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import smtplib
+import threading
+import time
+import telemetry
+
+# ============================================
+# Pooled SMTP Sender
+# ============================================
+
+SMTP_SERVERS = {
+    'gmail.com': ('smtp.gmail.com', 587),
+    'outlook.com': ('smtp.office365.com', 587),
+    'office365.com': ('smtp.office365.com', 587)
+}
+
+# Most servers drop idle sessions after a few minutes; reconnect before that
+IDLE_TIMEOUT = 240
+
+messages_sent = telemetry.counter(f"{telemetry.PREFIX}_smtp_messages_total",
+                                  "Replies handed to SMTP, by result", ('result',))
+
+def smtp_server_for(email_address: str):
+    """Detect the SMTP server from the sender's domain"""
+    domain = email_address.split('@')[1].lower()
+    return SMTP_SERVERS.get(domain, ('smtp.gmail.com', 587))
+
+def build_reply(from_email: str, to_email: str, subject: str, body: str):
+    """Create the reply message"""
+    msg = MIMEMultipart()
+    msg['From'] = from_email
+    msg['To'] = to_email
+    msg['Subject'] = f"Re: {subject}"
+    msg.attach(MIMEText(body, 'plain'))
+    return msg
+
+class SMTPSender:
+    """One authenticated SMTP session per account, reused across sends.
+
+    The session is opened lazily, re-opened when it has been idle longer
+    than `idle_timeout` or fails a send, and guarded by a lock so it can be
+    shared between threads (e.g. Streamlit sessions).
+    """
+
+    def __init__(self, email_address: str, password: str, host: str = None, port: int = None,
+                 idle_timeout: float = IDLE_TIMEOUT):
+        self.email_address = email_address
+        self.password = password
+        default_host, default_port = smtp_server_for(email_address)
+        self.host = host or default_host
+        self.port = port or default_port
+        self.idle_timeout = idle_timeout
+        self.server = None
+        self.last_used = 0.0
+        self.connects = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self.close_session()
+        with telemetry.span('smtp.connect', host=self.host):
+            server = smtplib.SMTP(self.host, self.port, timeout=30)
+            server.starttls()
+            server.login(self.email_address, self.password)
+        self.server = server
+        self.connects += 1
+
+    def _ensure_session(self):
+        """Reuse the open session unless it is missing or has been idle too long"""
+        idle = time.monotonic() - self.last_used
+        if self.server is None or idle > self.idle_timeout:
+            self._connect()
+
+    def send(self, to_email: str, subject: str, body: str):
+        """Send one reply; returns (success, error)"""
+        msg = build_reply(self.email_address, to_email, subject, body)
+        with telemetry.span('smtp.send') as span:
+            with self._lock:
+                success, error = self._deliver(msg)
+            span.set(success=success)
+            if error:
+                span.set(error=error)
+        messages_sent.inc(result='sent' if success else 'failed')
+        return success, error
+
+    def _deliver(self, msg):
+        """send_message over the session, reconnecting once if it went stale; caller holds the lock"""
+        for attempt in range(2):
+            try:
+                self._ensure_session()
+                self.server.send_message(msg)
+                self.last_used = time.monotonic()
+                return True, None
+            except smtplib.SMTPServerDisconnected as e:
+                # Stale session: reconnect once and retry
+                self.close_session()
+                error = e
+            except smtplib.SMTPException as e:
+                # Refused recipient, auth failure, etc.: retrying won't help
+                return False, str(e)
+            except OSError as e:
+                # Broken socket (SMTPException is also an OSError, handled above)
+                self.close_session()
+                error = e
+        return False, str(error)
+
+    def send_many(self, messages):
+        """Send (to_email, subject, body) tuples over the shared session.
+
+        Yields (index, success, error) as each message goes out, so callers
+        can report progress while the rest are still sending.
+        """
+        for index, (to_email, subject, body) in enumerate(messages):
+            success, error = self.send(to_email, subject, body)
+            yield index, success, error
+
+    def close_session(self):
+        """Quit the current session, ignoring errors from a dead connection"""
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
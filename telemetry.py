@@ -0,0 +1,414 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ============================================
+# Stage Tracing and Prometheus Metrics
+# ============================================
+#
+# Each stage of a run (IMAP fetch, MIME parsing, classification, drafting,
+# file writes, SMTP) is a span:
+#
+#     with telemetry.span('imap.fetch', messages=len(uids)):
+#         ...
+#
+# Spans nest through a context variable, so async tasks and threads started
+# with contextvars.copy_context() keep their parent. Every finished span is
+# observed in the emailagent_stage_seconds histogram and, when it raised,
+# counted in emailagent_stage_errors_total. Modules add their own counters
+# and gauges, and register collectors for numbers they already keep
+# (rate_limit's per-model counters, job_queue's depth), read at scrape time.
+#
+# METRICS_PORT (or --metrics-port) serves it all in the Prometheus text
+# format on http://127.0.0.1:PORT/metrics. TRACE_EXPORT=json|otlp (or
+# --trace) appends each finished span to TRACE_PATH, one per line: a plain
+# JSON object, or an OTLP/JSON ExportTraceServiceRequest as read by the
+# OpenTelemetry collector's otlpjsonfile receiver.
+
+PREFIX = "emailagent"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_TRACE_PATH = os.path.join(".cache", "traces.jsonl")
+TRACE_FORMATS = ('none', 'json', 'otlp')
+
+# ============================================
+# Metrics
+# ============================================
+
+def _key(names: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, '')) for name in names)
+
+class Counter:
+    """Monotonic count per label set"""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(self.labels, labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield '', dict(zip(self.labels, key)), value
+
+class Gauge(Counter):
+    """Current value per label set"""
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self.values[_key(self.labels, labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram:
+    """Cumulative buckets, sum and count per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # key -> [count per bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _key(self.labels, labels)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def totals(self) -> dict:
+        """{label values: (count, sum)}"""
+        with self._lock:
+            return {key: (entry[-1], entry[-2]) for key, entry in self.values.items()}
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(entry) for key, entry in self.values.items()}
+        for key, entry in sorted(values.items()):
+            labels = dict(zip(self.labels, key))
+            for bound, count in zip(self.buckets, entry):
+                yield '_bucket', dict(labels, le=f"{bound:g}"), count
+            yield '_bucket', dict(labels, le='+Inf'), entry[-1]
+            yield '_sum', labels, entry[-2]
+            yield '_count', labels, entry[-1]
+
+_metrics = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+def _register(cls, name: str, help: str, labels: tuple, **kwargs):
+    # Same name, same metric: modules re-executed by Streamlit reruns keep their counts
+    with _registry_lock:
+        if name not in _metrics:
+            _metrics[name] = cls(name, help, labels, **kwargs)
+        return _metrics[name]
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    return _register(Counter, name, help, labels)
+
+def gauge(name: str, help: str, labels: tuple = ()) -> Gauge:
+    return _register(Gauge, name, help, labels)
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram, name, help, labels, buckets=buckets)
+
+def register_collector(collect):
+    """Add a callable returning [(name, kind, help, [(labels, value), ...]), ...], read on every scrape"""
+    with _registry_lock:
+        if collect not in _collectors:
+            _collectors.append(collect)
+
+stage_seconds = histogram(f"{PREFIX}_stage_seconds", "Wall-clock time per pipeline stage", ('stage',))
+stage_errors = counter(f"{PREFIX}_stage_errors_total", "Stages that raised, by exception type", ('stage', 'error'))
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format(name: str, labels: dict, value) -> str:
+    label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    number = f"{value:g}" if isinstance(value, float) else str(value)
+    return f"{name}{{{label_text}}} {number}" if label_text else f"{name} {number}"
+
+def render() -> str:
+    """All metrics and collector output in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(_format(metric.name + suffix, labels, value) for suffix, labels, value in metric.samples())
+    for collect in collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            # A broken collector must not take the whole scrape down with it
+            lines.append(f"# collector {getattr(collect, '__qualname__', collect)} failed: {_escape(e)}")
+            continue
+        for name, kind, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(_format(name, labels, value) for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+# ============================================
+# Spans
+# ============================================
+
+_current = contextvars.ContextVar('telemetry_span', default=None)
+_listeners = []
+
+def add_listener(listener):
+    """Call listener('start' | 'end', span) around every span() block, in the thread running it"""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+class Span:
+    """One timed stage; end() records it and hands it to the trace exporter"""
+
+    def __init__(self, name: str, attributes: dict = None, parent=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_time = time.time()
+        self.duration = None
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: BaseException = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        stage_seconds.observe(self.duration, stage=self.name)
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+            stage_errors.inc(stage=self.name, error=type(error).__name__)
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export(self)
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Time the block as a child of the current span"""
+    current = Span(name, attributes, _current.get())
+    token = _current.set(current)
+    for listener in _listeners:
+        listener('start', current)
+    try:
+        yield current
+    except Exception as e:
+        current.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+        for listener in _listeners:
+            listener('end', current)
+
+def start_span(name: str, **attributes) -> Span:
+    """A child of the current span that is ended explicitly and never becomes current.
+
+    For generators and streams: a context variable set before a yield
+    would leak into whatever the consumer does between chunks.
+    """
+    return Span(name, attributes, _current.get())
+
+def traced(name: str):
+    """Decorator: run every call of a function (or coroutine function) inside span(name)"""
+
+    def decorate(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return run_async
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return run
+    return decorate
+
+# ============================================
+# Span Export (JSON / OTLP file)
+# ============================================
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+class SpanExporter:
+    """Appends finished spans to a file, one JSON line each.
+
+    Every line is written and flushed in one go, so worker processes can
+    share the file without interleaving.
+    """
+
+    def __init__(self, path: str = DEFAULT_TRACE_PATH, format: str = 'json', service: str = None):
+        self.path = path
+        self.format = format
+        self.service = service or os.environ.get("OTEL_SERVICE_NAME", "email-agent")
+        self.exported = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def _json(self, span: Span) -> dict:
+        record = {'trace_id': span.trace_id, 'span_id': span.span_id, 'parent_id': span.parent_id,
+                  'name': span.name, 'start': span.start_time, 'duration': round(span.duration, 6),
+                  'attributes': span.attributes, 'service': self.service, 'pid': os.getpid()}
+        if span.error:
+            record['error'] = span.error
+        return record
+
+    def _otlp(self, span: Span) -> dict:
+        start = int(span.start_time * 1e9)
+        otlp_span = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': 1,  # SPAN_KIND_INTERNAL
+            'startTimeUnixNano': str(start),
+            'endTimeUnixNano': str(start + int(span.duration * 1e9)),
+            'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in span.attributes.items()],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}
+        }
+        if span.parent_id:
+            otlp_span['parentSpanId'] = span.parent_id
+        resource = [{'key': 'service.name', 'value': {'stringValue': self.service}},
+                    {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}}]
+        return {'resourceSpans': [{'resource': {'attributes': resource},
+                                   'scopeSpans': [{'scope': {'name': PREFIX}, 'spans': [otlp_span]}]}]}
+
+    def export(self, span: Span):
+        record = self._otlp(span) if self.format == 'otlp' else self._json(span)
+        line = json.dumps(record, separators=(',', ':'), default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.exported += 1
+
+    def summary(self) -> str:
+        return f"{self.exported} span(s) as {self.format} to {self.path}"
+
+_UNSET = object()
+_exporter = _UNSET
+_exporter_lock = threading.Lock()
+
+def configure_tracing(format: str = None, path: str = None):
+    """Start (or, with 'none', stop) exporting spans; defaults come from TRACE_EXPORT / TRACE_PATH"""
+    global _exporter
+    format = (format or os.environ.get("TRACE_EXPORT") or 'none').lower()
+    if format not in TRACE_FORMATS:
+        raise ValueError(f"Unknown trace export '{format}' (choose from {', '.join(TRACE_FORMATS)})")
+    path = path or os.environ.get("TRACE_PATH", DEFAULT_TRACE_PATH)
+    with _exporter_lock:
+        _exporter = None if format == 'none' else SpanExporter(path, format)
+    return _exporter
+
+def get_exporter():
+    """The process-wide SpanExporter, configured from the environment on first use; None when off"""
+    if _exporter is _UNSET:
+        configure_tracing()
+    return _exporter
+
+# ============================================
+# /metrics Endpoint
+# ============================================
+
+_server = None
+
+def serve(port: int = None, host: str = None):
+    """Serve /metrics from a daemon thread on METRICS_PORT (0 or unset: off).
+
+    Only the first call starts a server; later calls (Streamlit reruns)
+    return it.
+    """
+    global _server
+    port = int(port if port is not None else os.environ.get("METRICS_PORT") or 0)
+    if _server is not None or not port:
+        return _server
+    host = host or os.environ.get("METRICS_HOST", DEFAULT_HOST)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = ThreadingHTTPServer((host, port), Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics on http://{host}:{_server.server_port}/metrics")
+    return _server
+
+def summary() -> str:
+    """Stages by total time spent, plus where spans went"""
+    totals = stage_seconds.totals()
+    if not totals:
+        return "no stages recorded"
+    errors = {}
+    for _, labels, count in stage_errors.samples():
+        errors[labels['stage']] = errors.get(labels['stage'], 0) + count
+    parts = []
+    for (stage,), (count, seconds) in sorted(totals.items(), key=lambda item: -item[1][1]):
+        part = f"{stage} {seconds:.2f}s/{count} (avg {seconds / count:.3f}s)"
+        if errors.get(stage):
+            part += f", {errors[stage]} failed"
+        parts.append(part)
+    exporter = get_exporter()
+    if exporter is not None:
+        parts.append(f"traces: {exporter.summary()}")
+    return "; ".join(parts)
@@ -1,9 +1,9 @@
-from google import genai
+import llm
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
-client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+client = llm.get_client()
 
 print("Making API call with Gemini 2.5 Flash...")
 
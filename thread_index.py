@@ -0,0 +1,173 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# ============================================
+# Conversation Threads
+# ============================================
+#
+# Groups messages into conversations from Message-ID / In-Reply-To /
+# References (or Gmail's X-GM-THRID). Only the newest message of each
+# thread is drafted; earlier ones become a few lines of context in its
+# prompt. The message -> thread map is kept on disk so a reply arriving in
+# a later run attaches to its thread with one indexed lookup.
+
+DEFAULT_PATH = os.path.join(".cache", "threads.sqlite3")
+DEFAULT_MAX_MESSAGES = 200_000
+CONTEXT_MESSAGES = 4
+SNIPPET_CHARS = 240
+
+_MESSAGE_ID = re.compile(r'<[^<>\s]+>')
+_QUOTED = re.compile(r'^\s*>.*$', re.MULTILINE)
+_REPLY_HEADER = re.compile(r'^On .{0,200}wrote:\s*$', re.MULTILINE)
+_SPACE = re.compile(r'\s+')
+
+def message_ids(value) -> list:
+    """<id> tokens from a Message-ID / In-Reply-To / References header, in order"""
+    return _MESSAGE_ID.findall(str(value or ''))
+
+def snippet(body: str, limit: int = SNIPPET_CHARS) -> str:
+    """The new text of a message: quoted history dropped, whitespace collapsed"""
+    body = _REPLY_HEADER.split(body or '')[0]
+    text = _SPACE.sub(' ', _QUOTED.sub(' ', body)).strip()
+    return text if len(text) <= limit else text[:limit].rstrip() + '…'
+
+class ThreadIndex:
+    """Persisted Message-ID -> thread map with a short digest of each message"""
+
+    def __init__(self, path: str = DEFAULT_PATH, max_messages: int = DEFAULT_MAX_MESSAGES):
+        self.path = path
+        self.max_messages = max_messages
+        self.stats = {'messages': 0, 'superseded': 0}
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id TEXT PRIMARY KEY,
+                thread_id TEXT NOT NULL,
+                sender TEXT,
+                date TEXT,
+                snippet TEXT,
+                seen_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (thread_id, seen_at)")
+        self._count = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def resolve(self, message_id: str, in_reply_to=None, references=None, gm_thread_id=None) -> str:
+        """Thread id of a message, recording it so its replies resolve too.
+
+        X-GM-THRID wins when present. Otherwise the nearest known ancestor
+        (In-Reply-To, then References newest first) gives the thread; with
+        none known, the root of References names it, so siblings whose
+        parent was never seen still end up together.
+        """
+        ancestors = message_ids(in_reply_to) + message_ids(references)[::-1]
+        with self._lock:
+            existing = message_id and self._db.execute(
+                "SELECT thread_id FROM messages WHERE message_id = ?", (message_id,)
+            ).fetchone()
+            if existing:
+                return existing[0]
+
+            if gm_thread_id:
+                thread_id = f"gm:{gm_thread_id}"
+            else:
+                thread_id = None
+                for ancestor in ancestors:
+                    row = self._db.execute(
+                        "SELECT thread_id FROM messages WHERE message_id = ?", (ancestor,)
+                    ).fetchone()
+                    if row:
+                        thread_id = row[0]
+                        break
+                if thread_id is None:
+                    roots = message_ids(references) or message_ids(in_reply_to)
+                    thread_id = roots[0] if roots else message_id
+
+            if message_id:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO messages (message_id, thread_id, seen_at) VALUES (?, ?, ?)",
+                    (message_id, thread_id, time.time())
+                )
+                self._count += 1
+                if self._count > self.max_messages:
+                    self._evict()
+        return thread_id
+
+    def record(self, email_data: dict, thread_id: str):
+        """Store the sender, date and snippet used as context for later messages"""
+        own = message_ids(email_data.get('message_id'))
+        if not own:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO messages (message_id, thread_id, sender, date, snippet, seen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (message_id) DO UPDATE SET "
+                "sender = excluded.sender, date = excluded.date, snippet = excluded.snippet",
+                (own[0], thread_id, email_data.get('from', ''), email_data.get('date', ''),
+                 snippet(email_data.get('body', '')), time.time())
+            )
+            self.stats['messages'] += 1
+
+    def context(self, thread_id: str, exclude: str = None, limit: int = CONTEXT_MESSAGES) -> str:
+        """The last `limit` earlier messages of a thread, oldest first, one line each"""
+        exclude = (message_ids(exclude) or [''])[0]
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT sender, date, snippet FROM messages "
+                "WHERE thread_id = ? AND message_id != ? AND snippet IS NOT NULL "
+                "ORDER BY seen_at DESC LIMIT ?",
+                (thread_id, exclude, limit)
+            ).fetchall()
+        return "\n".join(f"- {date} {sender}: {text}" for sender, date, text in reversed(rows))
+
+    def _evict(self):
+        """Forget the oldest messages down to 90% of max_messages"""
+        cutoff = self._db.execute(
+            "SELECT seen_at FROM messages ORDER BY seen_at DESC LIMIT 1 OFFSET ?",
+            (int(self.max_messages * 0.9),)
+        ).fetchone()
+        if cutoff is None:
+            return
+        self._db.execute("DELETE FROM messages WHERE seen_at <= ?", cutoff)
+        self._count = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def summary(self) -> str:
+        return (f"{self.stats['superseded']}/{self.stats['messages']} messages folded into a later reply, "
+                f"{self._count} indexed")
+
+def format_context(email_data: dict) -> str:
+    """Prompt block with the earlier messages of the email's thread, or ''"""
+    context = email_data.get('thread_context')
+    if not context:
+        return ""
+    return f"\nEarlier in this conversation (oldest first):\n{context}\n"
+
+_index = None
+
+def enabled() -> bool:
+    """Thread grouping is on unless THREAD_INDEX_DISABLED=1"""
+    return os.environ.get("THREAD_INDEX_DISABLED", "").lower() not in ("1", "true", "yes")
+
+def get_index():
+    """Process-wide index (THREAD_INDEX_PATH, THREAD_INDEX_MAX_MESSAGES); None when disabled"""
+    global _index
+    if not enabled():
+        return None
+    if _index is None:
+        _index = ThreadIndex(
+            path=os.environ.get("THREAD_INDEX_PATH", DEFAULT_PATH),
+            max_messages=int(os.environ.get("THREAD_INDEX_MAX_MESSAGES", DEFAULT_MAX_MESSAGES))
+        )
+    return _index
+
+def summary() -> str:
+    index = get_index()
+    return index.summary() if index else "disabled"
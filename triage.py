@@ -0,0 +1,383 @@
+import json
+import os
+import re
+import llm
+import local_classifier
+import near_dup
+import thread_index
+import prompt_budget
+import telemetry
+
+# ============================================
+# Combined Classify + Draft (one round trip)
+# ============================================
+
+MODEL = "models/gemini-2.5-flash"
+
+CATEGORIES = ['urgent', 'spam', 'customer_support', 'general_inquiry', 'internal']
+PRIORITIES = ['high', 'medium', 'low']
+SENTIMENTS = ['positive', 'neutral', 'negative']
+
+DEFAULT_CLASSIFICATION = {
+    'category': 'general_inquiry',
+    'priority': 'medium',
+    'sentiment': 'neutral',
+    'needs_reply': 'yes',
+    'reason': ''
+}
+
+_triage_config = None
+
+def triage_config():
+    """GenerateContentConfig constraining the answer to the triage JSON schema.
+
+    Built on first use so importing triage does not import google.genai.
+    'draft' is ordered last, so the classification fields are complete
+    before the draft starts streaming.
+    """
+    global _triage_config
+    if _triage_config is None:
+        from google.genai import types
+        schema = types.Schema(
+            type=types.Type.OBJECT,
+            properties={
+                'category': types.Schema(type=types.Type.STRING, enum=CATEGORIES),
+                'priority': types.Schema(type=types.Type.STRING, enum=PRIORITIES),
+                'sentiment': types.Schema(type=types.Type.STRING, enum=SENTIMENTS),
+                'needs_reply': types.Schema(type=types.Type.STRING, enum=['yes', 'no']),
+                'reason': types.Schema(type=types.Type.STRING),
+                'draft': types.Schema(
+                    type=types.Type.STRING,
+                    description="Reply to send, or an empty string when no reply is needed"
+                ),
+            },
+            required=['category', 'priority', 'sentiment', 'needs_reply', 'reason', 'draft'],
+            property_ordering=['category', 'priority', 'sentiment', 'needs_reply', 'reason', 'draft']
+        )
+        _triage_config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=schema
+        )
+    return _triage_config
+
+DEFAULT_DRAFT_REQUIREMENTS = """
+- Tone: immediate and solution-focused for high priority, empathetic and reassuring for negative sentiment, otherwise professional and helpful
+- 2-3 concise paragraphs
+- Include greeting and closing
+- Professional and clear
+"""
+
+def combined_mode_enabled() -> bool:
+    """Combined mode is the default; EMAIL_AGENT_TRIAGE_MODE=two_call restores the old path"""
+    return os.environ.get("EMAIL_AGENT_TRIAGE_MODE", "combined").lower() != "two_call"
+
+def streaming_enabled() -> bool:
+    """Drafts stream token by token unless EMAIL_AGENT_STREAM=0"""
+    return os.environ.get("EMAIL_AGENT_STREAM", "1").lower() not in ("0", "false", "no")
+
+def build_triage_instruction(guidelines: dict = None,
+                             draft_requirements: str = DEFAULT_DRAFT_REQUIREMENTS) -> str:
+    """Static part of the triage request, sent once as a system instruction / cached prefix"""
+    guideline_text = ""
+    if guidelines:
+        guideline_text = "\nDraft guidelines by category:\n" + "".join(
+            f"{category}:{text}" for category, text in guidelines.items()
+        )
+
+    return f"""
+You triage incoming emails: classify each one and draft a reply.
+
+Categories:
+- urgent: Payment issues, system down, angry customers, needs immediate action
+- spam: Promotional emails, scams, suspicious content
+- customer_support: Customer questions, feature requests, help needed
+- general_inquiry: General questions, information requests
+- internal: Emails from colleagues or internal team
+
+Set needs_reply to "no" and leave draft empty for spam or emails that need no answer.
+Keep reason to one short sentence.
+{guideline_text}
+Draft requirements:{draft_requirements}"""
+
+def build_triage_prompt(email_data: dict, body_tokens: int = None) -> str:
+    """Per-email part of the triage request"""
+    return f"""
+Analyze this email, classify it and draft a reply.
+
+From: {email_data['from']}
+Subject: {email_data['subject']}
+Body: {prompt_budget.fit_body(email_data, 'triage', body_tokens)}
+{thread_index.format_context(email_data)}"""
+
+def triage_request(email_data: dict, body_tokens: int = None, **instruction_kwargs) -> tuple:
+    """(instruction, prompt) for one email; instruction_kwargs go to build_triage_instruction"""
+    return build_triage_instruction(**instruction_kwargs), build_triage_prompt(email_data, body_tokens)
+
+def parse_triage(text: str):
+    """Parse the JSON answer into (classification, draft); None if unusable"""
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    classification = dict(DEFAULT_CLASSIFICATION)
+    for key, allowed in (('category', CATEGORIES), ('priority', PRIORITIES),
+                         ('sentiment', SENTIMENTS), ('needs_reply', ['yes', 'no'])):
+        value = str(data.get(key, '')).strip().lower()
+        if value in allowed:
+            classification[key] = value
+    classification['reason'] = str(data.get('reason') or '').strip()
+
+    draft = str(data.get('draft') or '').strip() or None
+    if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
+        draft = None
+
+    return classification, draft
+
+def triage_email(client, email_data: dict, model: str = MODEL, **prompt_kwargs):
+    """Classify and draft with a single schema-constrained call"""
+    instruction, prompt = triage_request(email_data, **prompt_kwargs)
+    response = llm.generate_content(
+        client,
+        model=model,
+        contents=prompt,
+        config=triage_config(),
+        instruction=instruction,
+        profile='triage',
+        validate=parse_triage
+    )
+    return parse_triage(response.text)
+
+async def triage_email_async(client, email_data: dict, model: str = MODEL, **prompt_kwargs):
+    """Async variant of triage_email"""
+    instruction, prompt = triage_request(email_data, **prompt_kwargs)
+    response = await llm.generate_content_async(
+        client,
+        model=model,
+        contents=prompt,
+        config=triage_config(),
+        instruction=instruction,
+        profile='triage',
+        validate=parse_triage
+    )
+    return parse_triage(response.text)
+
+def classify_locally(email_data: dict):
+    """Confident prediction of the local classifier, or None to ask the LLM.
+
+    Uses the 'local_classification' imap_fetch attached while scoring the
+    whole chunk, when present.
+    """
+    classifier = local_classifier.get_classifier()
+    if classifier is None:
+        return None
+    if 'local_classification' in email_data:
+        classification = email_data['local_classification']
+    else:
+        classification = classifier.predict(email_data)
+    if classification is not None:
+        classifier.stats['local'] += 1
+    return classification
+
+def remember_classification(email_data: dict, classification: dict):
+    """Count an LLM classification and teach it to the local classifier"""
+    classifier = local_classifier.get_classifier()
+    if classifier is not None:
+        classifier.stats['llm'] += 1
+        classifier.learn(email_data, classification)
+
+def reuse_near_duplicate(email_data: dict):
+    """(classification, draft) of an already-answered near-identical email, or None"""
+    index = near_dup.get_index()
+    if index is None:
+        return None
+    match = index.lookup(email_data)
+    return match[:2] if match else None
+
+def remember_draft(email_data: dict, classification: dict, draft):
+    """Index an LLM-drafted result so near-duplicates can reuse it"""
+    index = near_dup.get_index()
+    if index is not None:
+        index.add(email_data, classification, draft)
+
+def classify_and_draft(client, email_data: dict, classify_email, draft_response, **prompt_kwargs):
+    """Return (classification, draft), using one call unless combined mode is off.
+
+    Falls back to the module's own classify_email/draft_response pair when
+    the combined answer cannot be parsed. Messages already settled by a
+    header rule (see imap_fetch) or near-identical to one already answered
+    (see near_dup) cost no LLM call at all; those the local classifier is
+    confident about only cost the draft call, if any.
+    """
+    if email_data.get('rule_classification'):
+        return email_data['rule_classification'], None
+
+    with telemetry.span('classify') as span:
+        reused = reuse_near_duplicate(email_data)
+        if reused is not None:
+            span.set(source='near_dup')
+            return reused
+
+        classification = classify_locally(email_data)
+        span.set(source='local' if classification is not None else 'llm')
+        if classification is None:
+            if combined_mode_enabled():
+                result = triage_email(client, email_data, **prompt_kwargs)
+                if result is not None:
+                    # The draft came with it; there is no separate draft stage
+                    span.set(combined=True, category=result[0]['category'])
+                    remember_classification(email_data, result[0])
+                    remember_draft(email_data, *result)
+                    return result
+
+            classification = classify_email(email_data)
+            remember_classification(email_data, classification)
+        span.set(category=classification['category'])
+
+    draft = None
+    if classification['category'] != 'spam' and classification.get('needs_reply') != 'no':
+        with telemetry.span('draft'):
+            draft = draft_response(email_data, classification)
+    remember_draft(email_data, classification, draft)
+    return classification, draft
+
+# ============================================
+# Streaming Drafts
+# ============================================
+
+_DRAFT_START = re.compile(r'"draft"\s*:\s*"')
+_JSON_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+def _json_string_chunks(buffer: str, chunks):
+    """Decode a JSON string value incrementally, yielding text until its closing quote.
+
+    `buffer` holds what has arrived after the opening quote; more is pulled
+    from `chunks` as needed. Escapes split across chunks are held back until
+    complete. The rest of the stream is drained so the answer gets cached.
+    """
+    while True:
+        out = []
+        i = 0
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                if out:
+                    yield ''.join(out)
+                for _ in chunks:
+                    pass
+                return
+            if char == '\\':
+                if i + 1 >= len(buffer):
+                    break
+                escape = buffer[i + 1]
+                if escape == 'u':
+                    # \uD83D\uDE00 surrogate pairs need both halves before decoding
+                    width = 12 if buffer[i + 2:i + 4].lower() in ('d8', 'd9', 'da', 'db') else 6
+                    if i + width > len(buffer):
+                        break
+                    out.append(json.loads(f'"{buffer[i:i + width]}"'))
+                    i += width
+                    continue
+                out.append(_JSON_ESCAPES.get(escape, escape))
+                i += 2
+                continue
+            out.append(char)
+            i += 1
+        if out:
+            yield ''.join(out)
+        buffer = buffer[i:]
+        chunk = next(chunks, None)
+        if chunk is None:
+            return
+        buffer += chunk
+
+def triage_email_stream(client, email_data: dict, model: str = MODEL, **prompt_kwargs):
+    """Combined triage with the draft streamed: (classification, draft_chunks) or None.
+
+    triage_config() orders 'draft' last, so the classification fields are
+    complete once the draft starts arriving; they are parsed then and the
+    draft string is decoded and yielded as the model writes it.
+    draft_chunks is None when no reply is needed.
+    """
+    instruction, prompt = triage_request(email_data, **prompt_kwargs)
+    chunks = llm.generate_content_stream(
+        client,
+        model=model,
+        contents=prompt,
+        config=triage_config(),
+        instruction=instruction,
+        profile='triage',
+        validate=parse_triage
+    )
+
+    buffer = ''
+    match = None
+    for chunk in chunks:
+        buffer += chunk
+        match = _DRAFT_START.search(buffer)
+        if match:
+            break
+
+    if match is None:
+        result = parse_triage(buffer)
+        if result is None:
+            return None
+        return result[0], iter([result[1]]) if result[1] else None
+
+    result = parse_triage(buffer[:match.start()].rstrip().rstrip(',') + '}')
+    if result is None:
+        return None
+    classification = result[0]
+    if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
+        for _ in chunks:
+            pass
+        return classification, None
+    return classification, _json_string_chunks(buffer[match.end():], chunks)
+
+def _remember_streamed_draft(email_data: dict, classification: dict, chunks):
+    """Pass draft chunks through, indexing the full draft once it has been read"""
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    remember_draft(email_data, classification, ''.join(parts).strip() or None)
+
+def classify_and_draft_stream(client, email_data: dict, classify_email, draft_response_stream, **prompt_kwargs):
+    """Streaming variant of classify_and_draft: (classification, draft_chunks or None)"""
+    if email_data.get('rule_classification'):
+        return email_data['rule_classification'], None
+
+    with telemetry.span('classify') as span:
+        reused = reuse_near_duplicate(email_data)
+        if reused is not None:
+            span.set(source='near_dup')
+            classification, draft = reused
+            return classification, iter([draft]) if draft else None
+
+        classification = classify_locally(email_data)
+        span.set(source='local' if classification is not None else 'llm')
+        result = None
+        if classification is None:
+            if combined_mode_enabled():
+                # Returns once the classification fields are in; the draft streams later
+                result = triage_email_stream(client, email_data, **prompt_kwargs)
+            if result is None:
+                classification = classify_email(email_data)
+            else:
+                span.set(combined=True)
+                classification = result[0]
+            remember_classification(email_data, classification)
+        span.set(category=classification['category'])
+
+    if result is not None:
+        chunks = result[1]
+    elif classification['category'] == 'spam' or classification.get('needs_reply') == 'no':
+        chunks = None
+    else:
+        chunks = draft_response_stream(email_data, classification)
+    if chunks is None:
+        remember_draft(email_data, classification, None)
+        return classification, None
+    return classification, _remember_streamed_draft(email_data, classification, chunks)
@@ -0,0 +1,309 @@
+import email.utils
+import os
+from dotenv import load_dotenv
+import argparse
+import multiprocessing
+import socket
+import threading
+import time
+import triage
+import llm
+import imap_fetch
+import imap_pool
+import job_queue
+import thread_index
+import prompt_budget
+import profiles
+import profiler
+import telemetry
+
+load_dotenv()
+client = llm.LazyClient()
+
+# ============================================
+# Background Workers for emailpro.py
+# ============================================
+#
+# The Streamlit UI only enqueues a 'fetch' job and polls the review table.
+# Workers run the jobs: 'fetch' pulls unread mail and enqueues one 'triage'
+# job per message; 'triage' classifies, drafts and stores the review item.
+#
+#   python worker.py --processes 2 --concurrency 8
+#   python worker.py --profile cpu     # one profile per process, written when it stops
+
+DEFAULT_PROCESSES = 1
+DEFAULT_CONCURRENCY = 8
+POLL_SECONDS = 1.0
+DRAFT_FLUSH_SECONDS = 0.25  # how often a streaming draft is written back for the UI
+
+CLASSIFICATION_INSTRUCTION = """
+Classify each email.
+
+Reply ONLY:
+CATEGORY: [urgent/spam/customer_support/general_inquiry]
+PRIORITY: [high/medium/low]
+NEEDS_REPLY: [yes/no]
+"""
+
+DRAFT_INSTRUCTION = """
+Draft a professional email response to each email.
+
+Write a professional 2-paragraph response. Be concise and helpful.
+"""
+
+def classify_email(email_data):
+    """AI classification"""
+    prompt = f"""
+From: {email_data['from']}
+Subject: {email_data['subject']}
+Body: {prompt_budget.fit_body(email_data, 'classify')}
+"""
+
+    response = llm.generate_content(
+        client,
+        model="models/gemini-2.5-flash",
+        contents=prompt,
+        instruction=CLASSIFICATION_INSTRUCTION,
+        profile='classify'
+    )
+
+    text = response.text.lower()
+
+    return {
+        'category': 'urgent' if 'urgent' in text else 'spam' if 'spam' in text else 'customer_support' if 'customer' in text else 'general_inquiry',
+        'priority': 'high' if 'high' in text else 'low' if 'low' in text else 'medium',
+        'needs_reply': 'yes' if 'yes' in text else 'no'
+    }
+
+def build_draft_prompt(email_data, classification):
+    return f"""
+From: {email_data['from']}
+Subject: {email_data['subject']}
+Body: {prompt_budget.fit_body(email_data, 'draft')}
+{thread_index.format_context(email_data)}
+Category: {classification['category']}
+Priority: {classification['priority']}
+"""
+
+def draft_response(email_data, classification):
+    """AI draft response"""
+    if classification['category'] == 'spam' or classification['needs_reply'] == 'no':
+        return None
+
+    response = llm.generate_content(
+        client,
+        model="models/gemini-2.5-flash",
+        contents=build_draft_prompt(email_data, classification),
+        instruction=DRAFT_INSTRUCTION,
+        profile='draft'
+    )
+
+    return response.text
+
+def draft_response_stream(email_data, classification):
+    """AI draft response, yielded in chunks as it is generated"""
+    return llm.generate_content_stream(
+        client,
+        model="models/gemini-2.5-flash",
+        contents=build_draft_prompt(email_data, classification),
+        instruction=DRAFT_INSTRUCTION,
+        profile='draft'
+    )
+
+# ============================================
+# Job Handlers
+# ============================================
+
+def handle_fetch(queue, job):
+    """Fetch unread emails via IMAP and queue one triage job per message"""
+    email_address = os.environ.get("EMAIL_ADDRESS")
+    password = os.environ.get("EMAIL_PASSWORD")
+    server = os.environ.get("IMAP_SERVER", "imap.gmail.com")
+
+    if not email_address or not password:
+        raise RuntimeError("Missing EMAIL_ADDRESS / EMAIL_PASSWORD in .env")
+
+    with imap_pool.get_pool(server, email_address, password).connection() as imap:
+        limit = job['payload'].get('limit') or None
+        unread = imap_fetch.UnreadMessages(imap, email_address, limit=limit, max_chars=1500)
+        for msg in unread:
+            queue.enqueue('triage', {'email': {
+                'id': str(msg['id']),
+                'from': msg['from'],
+                'from_email': email.utils.parseaddr(msg['from'])[1],
+                'subject': msg['subject'],
+                'body': msg['body'],
+                'message_id': msg['message_id'],
+                'thread_id': msg.get('thread_id'),
+                'thread_context': msg.get('thread_context'),
+                'rule_classification': msg.get('rule_classification'),
+                'local_classification': msg.get('local_classification')
+            }, 'generation': job['payload'].get('generation')},
+                dedupe_key=f"triage:{email_address}:{msg['id']}")
+            queue.heartbeat(job['id'])
+        print(f"   📬 Queued {len(unread)} email(s) for triage")
+
+def handle_triage(queue, job):
+    """Classify and draft one email, then store it for review.
+
+    Unsent reviews of older messages in the same thread are marked
+    'superseded'. With streaming on, the review is stored as 'drafting' as
+    soon as it is classified and the partial draft is written back every
+    DRAFT_FLUSH_SECONDS, so the UI shows it being written. If the stream
+    fails on the last attempt, the review goes to 'pending' with whatever
+    was drafted (and 'draft_error'), so it does not stay 'drafting'.
+    """
+    email_data = job['payload']['email']
+    if email_data.get('thread_id'):
+        # Earlier drafts in this conversation are stale now that a newer message is here
+        queue.supersede_thread(email_data['thread_id'], email_data['id'])
+    if not triage.streaming_enabled():
+        classification, response = triage.classify_and_draft(
+            client, email_data, classify_email, draft_response
+        )
+        queue.add_review(dict(
+            email_data,
+            classification=classification,
+            response=response,
+            edited_response=response,
+            status='pending'
+        ))
+        return
+
+    classification, chunks = triage.classify_and_draft_stream(
+        client, email_data, classify_email, draft_response_stream
+    )
+    if chunks is None:
+        queue.add_review(dict(email_data, classification=classification, response=None,
+                              edited_response=None, status='pending'))
+        return
+
+    queue.add_review(dict(email_data, classification=classification, response='',
+                          edited_response='', status='drafting'))
+    parts = []
+    flushed = time.monotonic()
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            if time.monotonic() - flushed >= DRAFT_FLUSH_SECONDS:
+                # Stop if the review already left 'drafting' (e.g. finished by an earlier attempt)
+                if not queue.set_review_status(email_data['id'], 'drafting', expected='drafting',
+                                               response=''.join(parts)):
+                    return
+                flushed = time.monotonic()
+    except Exception as e:
+        if job['attempts'] >= job.get('max_attempts', job_queue.DEFAULT_MAX_ATTEMPTS):
+            # No retry left: hand the partial draft to the reviewer
+            partial = ''.join(parts).strip()
+            queue.set_review_status(email_data['id'], 'pending', expected='drafting',
+                                    response=partial, edited_response=partial, draft_error=str(e))
+        raise
+
+    response = ''.join(parts).strip()
+    queue.set_review_status(email_data['id'], 'pending', expected='drafting',
+                            response=response, edited_response=response)
+
+HANDLERS = {
+    'fetch': handle_fetch,
+    'triage': handle_triage
+}
+
+# ============================================
+# Worker Loop
+# ============================================
+
+def run_thread(name, stop):
+    """Claim and run jobs until stop is set"""
+    queue = job_queue.get_queue()
+    while not stop.is_set():
+        job = queue.claim(name)
+        if job is None:
+            stop.wait(POLL_SECONDS)
+            continue
+
+        handler = HANDLERS.get(job['kind'])
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+            # The preset chosen in emailpro for this fetch, for this job only
+            preset = profiles.use_preset(job['payload'].get('generation'))
+            try:
+                with telemetry.span(f"job.{job['kind']}", job=job['id'], attempt=job['attempts']):
+                    handler(queue, job)
+            finally:
+                profiles.reset_preset(preset)
+            queue.complete(job['id'])
+        except Exception as e:
+            print(f"   ❌ [{name}] {job['kind']} job {job['id']} failed (attempt {job['attempts']}): {e}")
+            queue.fail(job['id'], str(e))
+
+def run_worker(concurrency=DEFAULT_CONCURRENCY, metrics_port=0, profile=None):
+    """One worker process running `concurrency` job threads, profiled in `profile` mode until it stops"""
+    telemetry.serve(metrics_port)
+    stop = threading.Event()
+    base = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=run_thread, args=(f"{base}/{i}", stop), daemon=True)
+        for i in range(concurrency)
+    ]
+    with profiler.profiling(profile, label=f"worker_{os.getpid()}"):
+        for thread in threads:
+            thread.start()
+        print(f"🛠️  Worker {base} started with {concurrency} thread(s)")
+
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+def main(processes=DEFAULT_PROCESSES, concurrency=DEFAULT_CONCURRENCY, metrics_port=0, profile=None):
+    """Run the workers; with metrics_port, worker process i serves /metrics on metrics_port + i"""
+    print("="*80)
+    print(f"🤖 EMAIL WORKERS — queue: {os.environ.get('JOB_QUEUE_PATH', job_queue.DEFAULT_PATH)}")
+    print("="*80)
+
+    if processes <= 1:
+        run_worker(concurrency, metrics_port, profile)
+        return
+
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(concurrency, metrics_port + i if metrics_port else 0, profile))
+               for i in range(processes)]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        print("\n🛑 Stopping workers")
+        for process in workers:
+            process.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Background workers for the emailpro.py UI")
+    parser.add_argument("--processes", type=int,
+                        default=int(os.environ.get("WORKER_PROCESSES", DEFAULT_PROCESSES)),
+                        help="worker processes to start")
+    parser.add_argument("--concurrency", type=int,
+                        default=int(os.environ.get("WORKER_CONCURRENCY", DEFAULT_CONCURRENCY)),
+                        help="job threads per process (LLM calls are I/O bound)")
+    parser.add_argument("--generation", choices=list(profiles.PRESETS), default=profiles.get_preset(),
+                        help="per-stage model / thinking budget / output cap preset (GENERATION_PRESET)")
+    parser.add_argument("--metrics-port", type=int, default=int(os.environ.get("METRICS_PORT") or 0),
+                        help="serve Prometheus metrics at /metrics; worker process i uses this port + i (0 = off)")
+    parser.add_argument("--trace", choices=list(telemetry.TRACE_FORMATS),
+                        default=os.environ.get("TRACE_EXPORT", "none"),
+                        help="append a span per stage to TRACE_PATH as JSON or OTLP/JSON lines")
+    parser.add_argument("--profile", nargs="?", const="all", choices=list(profiler.MODES),
+                        help="sample CPU per stage and/or trace allocations (default: both) in each process; "
+                             "flamegraph-ready files go to profiling/ on Ctrl-C")
+    args = parser.parse_args()
+    profiles.set_preset(args.generation)
+    telemetry.configure_tracing(args.trace)
+    os.environ["GENERATION_PRESET"] = args.generation  # inherited by the worker processes
+    os.environ["TRACE_EXPORT"] = args.trace
+
+    main(args.processes, args.concurrency, args.metrics_port, args.profile)